@@ -0,0 +1,302 @@
+"""
+Client-side admission control toward the Task API.
+
+A batch screen left unchecked sends as many submits and polls as it has threads (or, with
+a JobTracker, as many as fall due), which can overload the upstream and get it throttling
+or failing requests; a fixed small limit leaves capacity unused when it is healthy. An
+AdmissionController admits each request through two limits:
+
+* a token bucket capping the request rate, and
+* an AIMD concurrency limit on requests in flight: while it is in use it grows by about
+  one for every `limit` requests that complete normally, and it is multiplied by
+  `backoff` when the upstream signals overload. Like TCP's congestion window, it is cut
+  at most once per round trip: only requests sent after the last cut can cut it again.
+
+Overload is a 429 or 5xx response, a connection error or timeout, or requests of one
+kind (submit, status, results) getting slower: their average latency over the last
+`SHORT_LATENCY_WINDOW` or so requests exceeding `latency_tolerance` times their average
+over the last `LONG_LATENCY_WINDOW`, as in the Vegas and Gradient limit algorithms.
+Comparing averages rather than single requests keeps ordinary jitter from reading as
+overload. The concurrency limit therefore settles around what the upstream can sustain,
+while the rate stays under the ceiling agreed with its operators. Both are reported
+through `metrics()` and as gauges on the instrumentation.
+
+AdmittedTaskApiClient wraps any client with the TaskApiClient `post`/`get` interface, so
+it can be passed to the builders, planner and `screen_pairs` unchanged.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+import requests
+
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Responses meaning the upstream is overloaded or failing
+OVERLOAD_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# Responses meaning the request was refused before doing anything, so it is safe to retry
+THROTTLE_STATUS = frozenset({429, 503})
+
+# Requests averaged over for a kind's recent and long-run latency
+SHORT_LATENCY_WINDOW = 20
+LONG_LATENCY_WINDOW = 200
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most `burst`.
+
+    Args:
+        rate: Tokens added per second
+        burst: Bucket size, i.e. how many requests may go out back to back
+            (default: one second's worth)
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, waiting for it if necessary; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+@dataclass
+class _LatencyAverages:
+    """Exponentially weighted short- and long-window averages of one request kind's latency"""
+
+    short: float = 0.0
+    long: float = 0.0
+    samples: int = 0
+
+    def add(self, latency: float) -> None:
+        # Plain means until a window is full, so the first requests do not dominate
+        self.samples += 1
+        self.short += (latency - self.short) / min(self.samples, SHORT_LATENCY_WINDOW)
+        self.long += (latency - self.long) / min(self.samples, LONG_LATENCY_WINDOW)
+
+    @property
+    def ready(self) -> bool:
+        return self.samples >= SHORT_LATENCY_WINDOW
+
+
+@dataclass
+class AdmissionMetrics:
+    """Snapshot of an AdmissionController's limits and counters."""
+
+    concurrency_limit: int
+    rate_limit: Optional[float]
+    in_flight: int
+    admitted: int = 0
+    overloads: int = 0
+    decreases: int = 0
+    rate_waits: int = 0
+    latency_baselines: Dict[str, float] = field(default_factory=dict)
+
+
+class AdmissionController:
+    """
+    Admits Task API requests through a token bucket and an AIMD concurrency limit.
+
+    Thread-safe; share one controller between every client talking to the same upstream.
+
+    Args:
+        rate: Maximum requests per second, or None for no rate limit
+        burst: Token bucket size (default: one second's worth of `rate`)
+        initial_limit: Concurrency limit to start from
+        min_limit: Lowest the concurrency limit goes
+        max_limit: Highest the concurrency limit goes
+        backoff: Factor applied to the concurrency limit on overload
+        latency_tolerance: A kind's recent average latency above this multiple of its
+            long-run average counts as overload
+        min_latency: Recent average latencies below this many seconds never count as overload
+        instrumentation: Receives the current limits as gauges
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = 50.0,
+        burst: Optional[float] = None,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        min_latency: float = 0.01,
+        instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+    ):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("Limits must satisfy 1 <= min_limit <= initial_limit <= max_limit")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.min_latency = min_latency
+        self.instrumentation = instrumentation
+
+        self._bucket = TokenBucket(rate, burst) if rate is not None else None
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._latencies: Dict[str, _LatencyAverages] = {}
+        self._last_decrease = float("-inf")
+        self._counts = {"admitted": 0, "overloads": 0, "decreases": 0, "rate_waits": 0}
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Current concurrency limit"""
+        return int(self._limit)
+
+    @property
+    def rate(self) -> Optional[float]:
+        """Rate limit in requests per second, or None if unlimited"""
+        return self._bucket.rate if self._bucket is not None else None
+
+    def metrics(self) -> AdmissionMetrics:
+        """Current limits and counters"""
+        with self._condition:
+            return AdmissionMetrics(
+                concurrency_limit=self.limit,
+                rate_limit=self.rate,
+                in_flight=self._in_flight,
+                latency_baselines={kind: averages.long for kind, averages in self._latencies.items()},
+                **self._counts,
+            )
+
+    def call(self, kind: str, request: Callable[[], object]) -> object:
+        """
+        Run `request()` once admitted and feed its outcome back into the limits.
+
+        Args:
+            kind: Request kind whose latencies are compared, e.g. "submit" or "status"
+            request: Performs the request and returns a response with a `status_code`
+        """
+        waited = self._bucket.acquire() if self._bucket is not None else 0.0
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+            self._counts["admitted"] += 1
+            if waited:
+                self._counts["rate_waits"] += 1
+
+        start = time.monotonic()
+        try:
+            response = request()
+        except Exception as e:
+            # Only connection errors and timeouts are the upstream's doing
+            overloaded = isinstance(e, (requests.ConnectionError, requests.Timeout))
+            self._release(kind, start, overloaded=overloaded)
+            raise
+        status_code = getattr(response, "status_code", 200)
+        self._release(kind, start, overloaded=status_code in OVERLOAD_STATUS)
+        return response
+
+    def _release(self, kind: str, start: float, overloaded: bool) -> None:
+        latency = time.monotonic() - start
+        with self._condition:
+            in_use = self._in_flight * 2 >= self._limit
+            self._in_flight -= 1
+            averages = self._latencies.setdefault(kind, _LatencyAverages())
+            if not overloaded:
+                averages.add(latency)
+            slow = (
+                averages.ready
+                and averages.short > self.min_latency
+                and averages.short > self.latency_tolerance * averages.long
+            )
+
+            if overloaded or slow:
+                self._counts["overloads"] += 1
+                # Requests sent before the last cut saw the load that caused it
+                if start > self._last_decrease:
+                    self._decrease()
+            elif in_use:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+            limit, rate, in_flight = self.limit, self.rate, self._in_flight
+
+        self.instrumentation.gauge("admission_concurrency_limit", limit)
+        self.instrumentation.gauge("admission_in_flight", in_flight)
+        if rate is not None:
+            self.instrumentation.gauge("admission_rate_limit", rate)
+
+    def _decrease(self) -> None:
+        self._last_decrease = time.monotonic()
+        self._counts["decreases"] += 1
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        logger.debug("Upstream overloaded; concurrency limit now %d", self.limit)
+
+
+class AdmittedTaskApiClient:
+    """
+    Task API client whose requests go through an AdmissionController.
+
+    A drop-in wrapper around any client with the TaskApiClient `post`/`get` calls.
+    Requests the upstream refused with 429 (or, for GETs, 503) are retried up to
+    `retries` times, each retry being admitted again under the reduced limits; a refused
+    submit created no job, so retrying it does not duplicate one.
+
+    Args:
+        client: The wrapped client
+        controller: Admission controller, shared between clients of the same upstream
+        retries: Retries of a throttled request
+    """
+
+    def __init__(self, client, controller: Optional[AdmissionController] = None, retries: int = 3):
+        self.client = client
+        self.controller = controller or AdmissionController()
+        self.retries = retries
+
+    def post(self, endpoint: str, data: Optional[dict] = None, **kwargs):
+        return self._send("submit", frozenset({429}), lambda: self.client.post(endpoint, data=data, **kwargs))
+
+    def get(self, endpoint: str, **kwargs):
+        return self._send(_request_kind(endpoint), THROTTLE_STATUS, lambda: self.client.get(endpoint, **kwargs))
+
+    def _send(self, kind: str, retry_status: frozenset, request: Callable[[], object]):
+        for _ in range(self.retries):
+            response = self.controller.call(kind, request)
+            if getattr(response, "status_code", 200) not in retry_status:
+                return response
+        return self.controller.call(kind, request)
+
+    def close(self) -> None:
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+
+
+def _request_kind(endpoint: str) -> str:
+    path = endpoint.lstrip("/")
+    if path.startswith("task/status/"):
+        return "status"
+    if path.startswith("task/results/"):
+        return "results"
+    return "other"
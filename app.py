@@ -1,17 +1,155 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from uuid import uuid4
+
 import streamlit as st
-from contingency_table_builder import ContingencyTableQuery
-from hutch_bunny.core.upstream.task_api_client import TaskApiClient
+from contingency_table_builder import CELLS, CellJob, ContingencyTableQuery, refresh_cell_job, table_from_cell_counts
 from hutch_bunny.core.settings import get_settings, DaemonSettings
 import pandas as pd
 
 from contingency_stats.methods.fishers_exact import FishersExactTest
 from contingency_stats.methods.chi_squared import ChiSquaredTest
-from contingency_stats.contingency_utils import create_contingency_typeddict
+from contingency_stats.contingency_utils import create_contingency_typeddict, tables_to_array
+from client_factory import PooledTaskApiClient, get_task_api_client
+from result_cache import ResultCache
+from results_store import ResultsStore
+from single_flight import default_single_flight
+
+
+@st.cache_resource
+def get_daemon_settings() -> DaemonSettings:
+    return get_settings(daemon=True)
+
+
+@st.cache_resource
+def get_client() -> PooledTaskApiClient:
+    """Task API client shared by every session, reusing pooled keep-alive connections"""
+    return get_task_api_client(get_daemon_settings())
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """Process-wide query result cache, persisted so repeated queries survive restarts"""
+    return ResultCache(sqlite_path=".query_cache.sqlite")
+
+
+class RunStore:
+    """
+    Process-wide store of submitted runs, so in-flight jobs outlive a browser refresh.
+
+    Completed runs are evicted when a run is added, once they have not been viewed for
+    `ttl` seconds or, least recently viewed first, while the store holds more than
+    `max_runs`. Runs with jobs still pending are kept.
+    """
+
+    def __init__(self, max_runs: int = 200, ttl: float = 3600.0):
+        self.max_runs = max_runs
+        self.ttl = ttl
+        self.runs: "OrderedDict[str, dict]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, run: dict) -> None:
+        with self.lock:
+            run["accessed"] = time.monotonic()
+            self.runs[run["id"]] = run
+            self._evict()
+
+    def get(self, run_id: str) -> Optional[dict]:
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is not None:
+                run["accessed"] = time.monotonic()
+                self.runs.move_to_end(run_id)
+            return run
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        # Least recently viewed first
+        for run_id, run in list(self.runs.items()):
+            if not run_complete(run):
+                continue
+            if len(self.runs) > self.max_runs or now - run["accessed"] > self.ttl:
+                del self.runs[run_id]
+
+
+@st.cache_resource
+def get_run_store() -> RunStore:
+    return RunStore()
+
+
+def session_run_ids() -> List[str]:
+    """Run ids of this session, restored from the URL after a browser refresh; evicted runs are dropped"""
+    store = get_run_store()
+    if "run_ids" not in st.session_state:
+        st.session_state["run_ids"] = list(st.query_params.get_all("run"))
+    run_ids = st.session_state["run_ids"]
+    live = [run_id for run_id in run_ids if store.get(run_id) is not None]
+    if len(live) != len(run_ids):
+        run_ids[:] = live
+        if live:
+            st.query_params["run"] = live
+        else:
+            del st.query_params["run"]
+    return run_ids
+
+
+def submit_run(exposure_omop: str, exposure_table: str, outcome_omop: str, outcome_table: str) -> None:
+    """Submit the four cell queries of a pair and record their job_uuids without waiting"""
+    store = get_run_store()
+    run_ids = session_run_ids()
+
+    # Never resubmit a pair that is already in flight in this session
+    for run_id in run_ids:
+        run = store.get(run_id)
+        params = (exposure_omop, exposure_table, outcome_omop, outcome_table)
+        if run is not None and run["params"] == params and not run_complete(run):
+            st.warning("This query is already running.")
+            return
+
+    settings = get_daemon_settings()
+    builder = ContingencyTableQuery(
+        exposure_omop_code=exposure_omop,
+        outcome_omop_code=outcome_omop,
+        exposure_table=exposure_table,
+        outcome_table=outcome_table,
+        result_cache=get_result_cache(),
+        # Sessions asking for the same query at once share one upstream job
+        single_flight=default_single_flight(),
+    )
+    run = {
+        "id": uuid4().hex,
+        "params": (exposure_omop, exposure_table, outcome_omop, outcome_table),
+        "collection_id": settings.COLLECTION_ID,
+        "jobs": builder.submit_cells(get_client(), settings.COLLECTION_ID, owner="user1"),
+        "lock": threading.Lock(),
+    }
+    store.add(run)
+    run_ids.append(run["id"])
+    st.query_params["run"] = run_ids
+
+
+def run_complete(run: dict) -> bool:
+    return all(job.done or job.failed for job in run["jobs"].values())
+
+
+def refresh_run(run: dict) -> None:
+    """Poll every pending job of a run once; concurrent sessions share the work"""
+    if not run["lock"].acquire(blocking=False):
+        return
+    try:
+        for job in run["jobs"].values():
+            refresh_cell_job(get_client(), job, run["collection_id"], get_result_cache())
+    finally:
+        run["lock"].release()
 
 
 def create_contingency_table(results: list) -> pd.DataFrame:
     """Creates a pandas DataFrame for the contingency table"""
-    # Assuming results are in order: [11, 10, 01, 00]
+    # Assuming results are in order: [11, 10, 01, 00]; pending cells are None
     table_data = {
         'Outcome +': [results[0], results[2]],
         'Outcome -': [results[1], results[3]]
@@ -34,6 +172,136 @@ def calculate_odds_ratio(table: dict) -> str:
     except Exception as e:
         return f"Error calculating odds ratio: {str(e)}"
 
+def render_progress(jobs: Dict[str, CellJob]) -> None:
+    """Per-job status view"""
+    finished = sum(job.done for job in jobs.values())
+    st.progress(finished / len(jobs), text=f"{finished} of {len(jobs)} queries complete")
+    st.dataframe(pd.DataFrame(
+        [
+            {
+                "Cell": cell,
+                "Job": job.job_uuid or "-",
+                "Status": job.status,
+                "Polls": job.polls,
+                "Count": job.count,
+                "Error": job.error or "",
+            }
+            for cell, job in jobs.items()
+        ]
+    ).set_index("Cell"))
+
+
+def render_statistics(table: dict) -> None:
+    # Calculate and display statistics
+    st.subheader("Basic Statistics")
+    total = sum(sum(cell for cell in row.values()) for row in table.values())
+    st.write(f"Total number of patients: {total}")
+
+    # Safer odds ratio calculation
+    odds_ratio = calculate_odds_ratio(table)
+    st.write(f"Odds Ratio: {odds_ratio}")
+
+    ct = create_contingency_typeddict([
+        table["exposed"]["with_outcome"],
+        table["exposed"]["without_outcome"],
+        table["unexposed"]["with_outcome"],
+        table["unexposed"]["without_outcome"]
+    ])
+
+    # Each test runs once, over a batch of this one table; the summary is its first row and
+    # the same frame fills the columnar view below
+    observed = tables_to_array([ct])
+
+    # Run Fisher's Exact Test
+    fisher_test = FishersExactTest()
+    fisher_frame = fisher_test.calculate_batch(observed)
+    fisher_result = fisher_frame.row(0)
+
+    st.subheader("Fisher's Exact Test")
+    st.write(f"P-value: {fisher_result.p_value:.3f}")
+    st.write(f"Odds Ratio: {fisher_result.odds_ratio:.2f}")
+    st.write(f"Confidence Interval: {fisher_result.confidence_interval}")
+    st.write(f"Interpretation: {fisher_result.interpretation}")
+
+    # Run Chi-Squared Test; a table with an empty row or column gets a NaN statistic
+    chi_test = ChiSquaredTest()
+    chi_frame = chi_test.calculate_batch(observed)
+    chi_result = chi_frame.row(0)
+
+    st.subheader("Chi-Squared Test")
+    if math.isnan(chi_result.test_statistic):
+        st.write("Cannot calculate: the table has an expected count of zero")
+    else:
+        st.write(f"P-value: {chi_result.p_value:.3f}")
+        st.write(f"Chi-Squared Statistic: {chi_result.test_statistic:.2f}")
+        st.write(f"Degrees of Freedom: {chi_result.degrees_of_freedom}")
+        st.write(f"Interpretation: {chi_result.interpretation}")
+
+    # Columnar view of both tests, exported to pandas without copying
+    with st.expander("Result Columns"):
+        st.dataframe(fisher_frame.to_pandas())
+        st.dataframe(chi_frame.to_pandas())
+
+
+def render_run(run_id: str) -> None:
+    """Render one run, polling its pending jobs; re-run on a timer while any are pending"""
+    run = get_run_store().get(run_id)
+    if run is None:
+        st.info("This run has expired.")
+        return
+    was_complete = run_complete(run)
+    if not was_complete:
+        refresh_run(run)
+
+    jobs = run["jobs"]
+    exposure_omop, exposure_table, outcome_omop, outcome_table = run["params"]
+    st.header(f"{exposure_table} {exposure_omop} x {outcome_table} {outcome_omop}")
+
+    render_progress(jobs)
+
+    # Each cell appears as soon as its job is done
+    st.dataframe(create_contingency_table([jobs[cell].count for cell in CELLS]))
+
+    if all(job.done for job in jobs.values()):
+        render_statistics(table_from_cell_counts({cell: job.count for cell, job in jobs.items()}))
+    elif any(job.failed for job in jobs.values()):
+        st.error("Some queries failed; statistics are unavailable for this run.")
+
+    # Display query payloads
+    st.subheader("Query Payloads")
+    for cell, label in [
+        ("exposed_with_outcome", "Exposed with Outcome"),
+        ("exposed_without_outcome", "Exposed without Outcome"),
+        ("unexposed_with_outcome", "Unexposed with Outcome"),
+        ("unexposed_without_outcome", "Unexposed without Outcome"),
+    ]:
+        with st.expander(label):
+            st.json(jobs[cell].payload)
+
+    # Leave the timed fragment once everything has finished
+    if not was_complete and run_complete(run):
+        st.rerun()
+
+
+def render_saved_screen(path: str, max_p_value: float, p_value_column: str = "fishers_exact_p_value") -> None:
+    """Show the pairs of a saved screen below a p-value threshold, reading only matching rows"""
+    import pyarrow.dataset as ds
+
+    store = ResultsStore(path)
+    total = store.count_rows()
+    st.header(f"Saved screen: {path}")
+    if total == 0:
+        st.info("No results have been written to this store yet.")
+        return
+    if p_value_column not in store.dataset().schema.names:
+        st.warning(f"The store has no {p_value_column} column.")
+        return
+
+    matches = ds.field(p_value_column) <= max_p_value
+    st.write(f"{store.count_rows(matches)} of {total} pairs with {p_value_column} <= {max_p_value:g}")
+    st.dataframe(store.head(1000, filter=matches).to_pandas().drop(columns=["payload_hashes"]))
+
+
 def main():
     st.title("OMOP Contingency Table Builder")
     
@@ -43,8 +311,10 @@ def main():
         st.markdown("""
         1. Enter the OMOP codes for your exposure and outcome variables
         2. Select the appropriate tables for each variable
-        3. Click "Run Query" to generate the contingency table
+        3. Click "Run Query" to submit the contingency table queries
         
+        Results appear as each query finishes, and you can start another query meanwhile.
+
         ### Example OMOP Codes
         - Chronic Laryngitis: 24970
         - Male: 8507
@@ -72,95 +342,41 @@ def main():
         if st.button("Run Query"):
             if not exposure_omop or not outcome_omop:
                 st.error("Please provide both OMOP codes")
-                return
-                
-            try:
-                # Initialize settings and client
-                settings: DaemonSettings = get_settings(daemon=True)
-                client = TaskApiClient(settings)
-                
-                # Create and execute query
-                builder = ContingencyTableQuery(
-                    exposure_omop_code=exposure_omop,
-                    outcome_omop_code=outcome_omop,
-                    exposure_table=exposure_table,
-                    outcome_table=outcome_table
-                )
-                
-                # Execute queries and get job responses
-                with st.spinner("Executing queries..."):
-                    table = builder.build_contingency_table(
-                        client=client,
-                        collection_id=settings.COLLECTION_ID,
-                        owner="user1"
-                    )
-                
-                # Store results in session state to display in main content
-                st.session_state['results'] = {
-                    'table': table,
-                    'exposure_omop': exposure_omop,
-                    'outcome_omop': outcome_omop,
-                    'query_payloads': builder.query_payloads
-                }
-
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+            else:
+                try:
+                    submit_run(exposure_omop, exposure_table, outcome_omop, outcome_table)
+                except Exception as e:
+                    st.error(f"An error occurred: {str(e)}")
+
+        st.header("Saved Screens")
+        store_path = st.text_input("Results store directory", value="")
+        max_p_value = st.number_input("Maximum p-value", value=0.05, min_value=0.0, max_value=1.0, format="%g")
+
+        cache_stats = get_result_cache().stats
+        st.caption(
+            f"Result cache: {cache_stats.hits} hits, {cache_stats.misses} misses "
+            f"({cache_stats.hit_rate:.0%} hit rate)"
+        )
     
-    # Main content area for displaying results
-    if 'results' in st.session_state:
-        results = st.session_state['results']
-        
-        st.header("Results")
-        st.dataframe(results['table'])
-        
-        # Calculate and display statistics
-        st.subheader("Basic Statistics")
-        total = sum(sum(cell for cell in row.values()) for row in results['table'].values())
-        st.write(f"Total number of patients: {total}")
-
-        # Safer odds ratio calculation
-        odds_ratio = calculate_odds_ratio(results['table'])
-        st.write(f"Odds Ratio: {odds_ratio}")
-
-        ct = create_contingency_typeddict([
-            results['table']["exposed"]["with_outcome"],
-            results['table']["exposed"]["without_outcome"],
-            results['table']["unexposed"]["with_outcome"],
-            results['table']["unexposed"]["without_outcome"]
-        ])
-
-        # Run Fisher's Exact Test
-        fisher_test = FishersExactTest()
-        fisher_result = fisher_test.calculate(ct)
-
-        st.subheader("Fisher's Exact Test")
-        st.write(f"P-value: {fisher_result.p_value:.3f}")
-        st.write(f"Odds Ratio: {fisher_result.odds_ratio:.2f}")
-        st.write(f"Confidence Interval: {fisher_result.confidence_interval}")
-        st.write(f"Interpretation: {fisher_result.interpretation}")
-
-        # Run Chi-Squared Test
-        chi_test = ChiSquaredTest()
-        chi_result = chi_test.calculate(ct)
-
-        st.subheader("Chi-Squared Test")
-        st.write(f"P-value: {chi_result.p_value:.3f}")
-        st.write(f"Chi-Squared Statistic: {chi_result.test_statistic:.2f}")
-        st.write(f"Degrees of Freedom: {chi_result.degrees_of_freedom}")
-        st.write(f"Interpretation: {chi_result.interpretation}")
-        
-        # Display query payloads
-        st.subheader("Query Payloads")
-        with st.expander("Exposed with Outcome"):
-            st.json(results['query_payloads']['exposed_with_outcome'])
-        with st.expander("Exposed without Outcome"):
-            st.json(results['query_payloads']['exposed_without_outcome'])
-        with st.expander("Unexposed with Outcome"):
-            st.json(results['query_payloads']['unexposed_with_outcome'])
-        with st.expander("Unexposed without Outcome"):
-            st.json(results['query_payloads']['unexposed_without_outcome'])
-    else:
+    if store_path:
+        if os.path.isdir(store_path):
+            render_saved_screen(store_path, max_p_value)
+        else:
+            st.error(f"No results store at {store_path}")
+        st.divider()
+
+    # Main content area for displaying results, newest run first
+    run_ids = session_run_ids()
+    if not run_ids and not store_path:
         st.info("Enter query parameters in the sidebar and click 'Run Query' to see results.")
 
+    for run_id in reversed(run_ids):
+        run = get_run_store().get(run_id)
+        if run is None:
+            continue
+        run_every = None if run_complete(run) else 2
+        st.fragment(render_run, run_every=run_every)(run_id)
+        st.divider()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
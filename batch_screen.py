@@ -0,0 +1,317 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from contingency_stats.protocols import ContingencyTable, ContingencyTestProtocol
+from contingency_stats.result_schemas import BaseStatResult
+from contingency_stats.methods.chi_squared import ChiSquaredTest
+from contingency_stats.methods.fishers_exact import FishersExactTest
+from concept_set import CodeSet
+from contingency_table_builder import CELLS, CellQueryError, ContingencyTableQuery, table_from_cell_counts
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from job_tracker import JobTracker
+from polling import CancellationToken, PollingPolicy
+from query_planner import MarginalQueryPlanner, derivation_issues, table_from_parts
+
+if TYPE_CHECKING:
+    from hutch_bunny.core.upstream.task_api_client import TaskApiClient
+    from results_store import ResultsStore
+
+
+@dataclass(frozen=True)
+class ScreeningPair:
+    """One exposure x outcome combination to screen; either side may be a concept set."""
+
+    exposure_omop_code: CodeSet
+    outcome_omop_code: CodeSet
+    exposure_table: str = "Condition"
+    outcome_table: str = "Condition"
+
+
+@dataclass
+class ScreeningResult:
+    """Contingency table and statistics for one screened pair."""
+
+    index: int
+    pair: ScreeningPair
+    table: Optional[ContingencyTable] = None
+    query_payloads: Dict[str, dict] = field(default_factory=dict)
+    stats: Dict[str, BaseStatResult] = field(default_factory=dict)
+    stat_errors: Dict[str, Exception] = field(default_factory=dict)
+    error: Optional[CellQueryError] = None
+    # Inconsistent counts behind a planner-derived table (see query_planner.derivation_issues)
+    derivation_issues: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def cross_pairs(
+    exposures: Iterable[Tuple[CodeSet, str]], outcomes: Iterable[Tuple[CodeSet, str]]
+) -> Iterator[ScreeningPair]:
+    """
+    Build every exposure x outcome pair, PheWAS-style.
+
+    Exposures are read lazily, one at a time; the outcomes are held in memory.
+
+    Args:
+        exposures: (omop_code, table) tuples
+        outcomes: (omop_code, table) tuples
+    """
+    outcomes = list(outcomes)
+    for exposure_code, exposure_table in exposures:
+        for outcome_code, outcome_table in outcomes:
+            yield ScreeningPair(exposure_code, outcome_code, exposure_table, outcome_table)
+
+
+def default_tests() -> Dict[str, ContingencyTestProtocol]:
+    # The conditional odds ratio stays finite for the zero cells common with rare outcomes
+    return {
+        "fishers_exact": FishersExactTest(odds_ratio_method="conditional"),
+        "chi_squared": ChiSquaredTest(),
+    }
+
+
+@dataclass
+class _PendingPair:
+    result: ScreeningResult
+    parts: Tuple[str, ...]
+    planned: bool = False
+    outcomes: Dict[str, tuple[int, dict]] = field(default_factory=dict)
+    errors: Dict[str, BaseException] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.outcomes) + len(self.errors) == len(self.parts)
+
+
+def screen_pairs(
+    client: "TaskApiClient",
+    collection_id: str,
+    owner: str,
+    pairs: Iterable[ScreeningPair],
+    max_workers: int = 16,
+    tests: Optional[Dict[str, ContingencyTestProtocol]] = None,
+    polling_policy: Optional[PollingPolicy] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    planner: Optional[MarginalQueryPlanner] = None,
+    query_options: Optional[Dict[str, Any]] = None,
+    instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+    results_store: Optional["ResultsStore"] = None,
+    job_tracker: Optional[JobTracker] = None,
+) -> Iterator[ScreeningResult]:
+    """
+    Screen many exposure x outcome pairs through one bounded worker pool.
+
+    All cell queries of all pairs share the same `max_workers` threads, so runtime is
+    governed by how many jobs the upstream can run at once rather than by the number
+    of pairs. Pairs are read lazily from `pairs` and only a bounded window of them is in
+    flight at a time. Each result is yielded as soon as its four cells are done, so
+    results arrive in completion order; use `ScreeningResult.index` to restore input order.
+
+    A pair whose cells fail is still yielded, with `error` set and no table or stats.
+
+    With a `planner`, each pair issues only its joint query and the remaining cells are
+    derived from marginal counts shared across pairs, roughly halving upstream load when
+    many pairs share an exposure. Derived cells are approximate when the upstream rounds
+    or suppresses counts; pairs whose counts are inconsistent list them in
+    `derivation_issues`.
+
+    With a `job_tracker`, no thread is held per cell: jobs are submitted, polled and
+    fetched by the tracker's few threads, and `max_workers` instead caps the number of
+    cell queries outstanding at once, so thousands of jobs can be pending upstream.
+
+    Args:
+        client: Task API client shared by all queries
+        collection_id: Collection to query
+        owner: Owner recorded on each query
+        pairs: Pairs to screen
+        max_workers: Maximum number of cell queries running at once
+        tests: Statistical tests to run on each table (default: Fisher's exact and chi-squared)
+        polling_policy: Polling schedule for every job (default: PollingPolicy())
+        cancel_token: Cancels every cell still polling when triggered; it is also
+            triggered if the generator is closed before the screen finishes
+        planner: Optional MarginalQueryPlanner to derive cells from cached marginals
+        query_options: Extra ContingencyTableQuery fields applied to every pair,
+            e.g. {"result_cache": ResultCache()}; pass {"journal": JobJournal(path)} (and
+            the same journal to the planner) to make the screen resumable after a crash
+        instrumentation: Records query stage timings and per-test stats computation time
+        results_store: Appends every result to this ResultsStore before it is yielded;
+            buffered rows are flushed when the screen ends or is closed
+        job_tracker: Optional JobTracker polling every cell query (and the planner's
+            marginal queries) in place of the worker pool
+
+    Yields:
+        ScreeningResult for each pair as it completes
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+
+    tests = default_tests() if tests is None else tests
+    cancel_token = cancel_token or CancellationToken()
+    executor = None
+    if job_tracker is None:
+        # Keep enough pairs in flight to saturate the pool without reading every pair up front
+        max_pending_pairs = max(1, max_workers // len(CELLS) + 1) * 2
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="screen-cell")
+    else:
+        max_pending_pairs = max(1, max_workers // len(CELLS))
+        if planner is not None and planner.job_tracker is None:
+            planner = replace(planner, job_tracker=job_tracker)
+
+    pair_iter = enumerate(pairs)
+    pending: Dict[int, _PendingPair] = {}
+    futures: Dict[Future, Tuple[int, str]] = {}
+
+    finished = False
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending_pairs:
+                try:
+                    index, pair = next(pair_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[index] = _submit_pair(
+                    executor, futures, client, collection_id, owner, index, pair,
+                    polling_policy, cancel_token, planner, query_options or {}, instrumentation, job_tracker
+                )
+
+            if not futures:
+                break
+
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, cell = futures.pop(future)
+                state = pending[index]
+                try:
+                    state.outcomes[cell] = future.result()
+                except Exception as e:
+                    state.errors[cell] = e
+
+                if state.complete:
+                    del pending[index]
+                    result = _finish_pair(state, tests, instrumentation)
+                    if results_store is not None:
+                        results_store.append(result, collection_id)
+                    yield result
+        finished = True
+    finally:
+        if not finished:
+            cancel_token.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if results_store is not None:
+            results_store.flush()
+
+
+def _submit_pair(
+    executor: Optional[ThreadPoolExecutor],
+    futures: Dict[Future, Tuple[int, str]],
+    client: "TaskApiClient",
+    collection_id: str,
+    owner: str,
+    index: int,
+    pair: ScreeningPair,
+    polling_policy: Optional[PollingPolicy],
+    cancel_token: CancellationToken,
+    planner: Optional[MarginalQueryPlanner],
+    query_options: Dict[str, Any],
+    instrumentation: Instrumentation,
+    job_tracker: Optional[JobTracker] = None,
+) -> _PendingPair:
+    """Queue the upstream queries of one pair, on `executor` or else on `job_tracker`"""
+    builder = ContingencyTableQuery(
+        exposure_omop_code=pair.exposure_omop_code,
+        outcome_omop_code=pair.outcome_omop_code,
+        exposure_table=pair.exposure_table,
+        outcome_table=pair.outcome_table,
+        **query_options,
+    )
+    if polling_policy is not None:
+        builder.polling_policy = polling_policy
+    if instrumentation.enabled:
+        builder.instrumentation = instrumentation
+
+    if executor is None:
+        builder.job_tracker = job_tracker
+        if planner is not None:
+            started = planner.part_futures(builder, client, collection_id, owner, cancel_token)
+        else:
+            started = {
+                cell: builder.start_single_query(
+                    client, collection_id, owner, exposure_present, outcome_present, cancel_token
+                )
+                for cell, (exposure_present, outcome_present) in CELLS.items()
+            }
+        for part, future in started.items():
+            futures[future] = (index, part)
+        return _PendingPair(
+            result=ScreeningResult(index=index, pair=pair),
+            parts=tuple(started),
+            planned=planner is not None,
+        )
+
+    tasks: Dict[str, Callable[[], tuple[int, dict]]]
+    if planner is not None:
+        tasks = planner.part_tasks(builder, client, collection_id, owner, cancel_token)
+    else:
+        tasks = {
+            cell: partial(
+                builder.execute_single_query, client, collection_id, owner,
+                exposure_present, outcome_present, cancel_token
+            )
+            for cell, (exposure_present, outcome_present) in CELLS.items()
+        }
+
+    for part, task in tasks.items():
+        futures[executor.submit(task)] = (index, part)
+
+    return _PendingPair(
+        result=ScreeningResult(index=index, pair=pair),
+        parts=tuple(tasks),
+        planned=planner is not None,
+    )
+
+
+def _finish_pair(
+    state: _PendingPair, tests: Dict[str, ContingencyTestProtocol], instrumentation: Instrumentation
+) -> ScreeningResult:
+    """Assemble the table for a completed pair and run the statistical tests on it"""
+    result = state.result
+    if state.errors:
+        # Report failures in submission order
+        result.error = CellQueryError({part: state.errors[part] for part in state.parts if part in state.errors})
+        return result
+
+    counts = {part: count for part, (count, _) in state.outcomes.items()}
+    result.query_payloads = {part: state.outcomes[part][1] for part in state.parts}
+    if state.planned:
+        result.table = ContingencyTable(**table_from_parts(counts))
+        result.derivation_issues = derivation_issues(**counts)
+        if result.derivation_issues:
+            instrumentation.count("derivation_inconsistent")
+    else:
+        result.table = ContingencyTable(**table_from_cell_counts(counts))
+
+    for name, test in tests.items():
+        try:
+            with instrumentation.timer(f"stats_{name}"):
+                result.stats[name] = test.calculate(result.table)
+        except Exception as e:
+            result.stat_errors[name] = e
+    return result
+
+
+def screen_all(
+    client: "TaskApiClient",
+    collection_id: str,
+    owner: str,
+    pairs: Iterable[ScreeningPair],
+    **kwargs,
+) -> List[ScreeningResult]:
+    """Run `screen_pairs` to completion and return the results in input order"""
+    return sorted(screen_pairs(client, collection_id, owner, pairs, **kwargs), key=lambda r: r.index)
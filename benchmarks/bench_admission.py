@@ -0,0 +1,120 @@
+"""
+Benchmark adaptive admission control against a capacity-limited mock Task API.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_admission --pairs 200 --capacity 16
+
+The mock serves `--capacity` requests at once; beyond that requests slow down, and
+beyond twice that they are refused with HTTP 429. The same screen is run with no
+admission control, with a fixed small concurrency limit, and with the adaptive
+AdmissionController (token bucket plus AIMD concurrency). Reports wall time, failed pairs,
+throttled requests and, for the adaptive run, where its limits settled.
+
+First, `--threads` threads send status requests through the adaptive controller to a
+mock with no capacity limit, whose request latency has lognormal jitter of each
+`--jitter` sigma. With no load to back off from, the concurrency limit must not fall
+below its initial value of `--threads`; exits with status 1 if it does.
+"""
+import argparse
+import sys
+import threading
+import time
+
+from admission import AdmissionController, AdmittedTaskApiClient
+from batch_screen import ScreeningPair, screen_pairs
+from mock_task_api import LatencyModel, MockTaskApi, MockTaskApiClient
+from polling import PollingPolicy
+
+
+def run(api: MockTaskApi, client, pairs: list, policy: PollingPolicy, workers: int):
+    throttled_before = api.requests["throttled"]
+    start = time.perf_counter()
+    results = list(
+        screen_pairs(
+            client, "bench", "bench", pairs, max_workers=workers, polling_policy=policy,
+            query_options={"single_flight": None},
+        )
+    )
+    elapsed = time.perf_counter() - start
+    failed = sum(not result.ok for result in results)
+    return elapsed, failed, api.requests["throttled"] - throttled_before
+
+
+def unloaded_limit(jitter: float, threads: int, request_latency: float, seconds: float):
+    """Concurrency limit and decreases after `threads` threads send requests to an unloaded, jittery mock"""
+    api = MockTaskApi(request_latency=request_latency, request_jitter=jitter)
+    controller = AdmissionController(rate=None, initial_limit=threads)
+    client = AdmittedTaskApiClient(MockTaskApiClient(api), controller)
+    deadline = time.monotonic() + seconds
+
+    def send() -> None:
+        while time.monotonic() < deadline:
+            client.get("task/status/unknown")
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    metrics = controller.metrics()
+    return metrics.concurrency_limit, metrics.decreases, metrics.admitted
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=128)
+    parser.add_argument("--capacity", type=int, default=16, help="Requests the mock serves at once")
+    parser.add_argument("--request-latency", type=float, default=0.02)
+    parser.add_argument("--latency-median", type=float, default=0.5)
+    parser.add_argument("--fixed-limit", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2_000.0, help="Rate ceiling of the adaptive controller")
+    parser.add_argument("--jitter", type=float, nargs="+", default=[0.0, 0.2, 0.4, 0.8])
+    parser.add_argument("--threads", type=int, default=32, help="Threads of the no-load jitter runs")
+    parser.add_argument("--jitter-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    failed_jitter = False
+    print(f"No load, {args.threads} threads, {args.request_latency * 1e3:.0f} ms median request latency")
+    print(f"{'jitter sigma':>12}{'requests':>10}{'decreases':>11}{'limit':>7}  limit held")
+    for jitter in args.jitter:
+        limit, decreases, admitted = unloaded_limit(jitter, args.threads, args.request_latency, args.jitter_seconds)
+        held = limit >= args.threads
+        failed_jitter |= not held
+        print(f"{jitter:>12.1f}{admitted:>10}{decreases:>11}{limit:>7}  {'OK' if held else 'FAILED'}")
+    print()
+
+    api = MockTaskApi(
+        latency=LatencyModel("lognormal", args.latency_median, 0.5),
+        request_latency=args.request_latency,
+        capacity=args.capacity,
+    )
+    policy = PollingPolicy(fast_interval=0.05, initial_interval=0.1, max_interval=0.5)
+    pairs = [ScreeningPair("8507", str(100000 + i), "Person", "Condition") for i in range(args.pairs)]
+
+    fixed = AdmissionController(
+        rate=None, initial_limit=args.fixed_limit, min_limit=args.fixed_limit, max_limit=args.fixed_limit
+    )
+    adaptive = AdmissionController(rate=args.rate, initial_limit=args.fixed_limit)
+    clients = {
+        "no admission control": MockTaskApiClient(api),
+        f"fixed limit of {args.fixed_limit}": AdmittedTaskApiClient(MockTaskApiClient(api), fixed),
+        "adaptive (token bucket + AIMD)": AdmittedTaskApiClient(MockTaskApiClient(api), adaptive),
+    }
+
+    print(f"{'run':<34}{'seconds':>9}{'failed pairs':>14}{'throttled':>11}{'pair/s':>9}")
+    for name, client in clients.items():
+        elapsed, failed, throttled = run(api, client, pairs, policy, args.workers)
+        print(f"{name:<34}{elapsed:>9.2f}{failed:>14}{throttled:>11}{len(pairs) / elapsed:>9.1f}")
+
+    metrics = adaptive.metrics()
+    print(
+        f"\nadaptive limits at the end: concurrency {metrics.concurrency_limit}, rate {metrics.rate_limit:.0f}/s; "
+        f"{metrics.decreases} decreases over {metrics.admitted} requests"
+    )
+    return 1 if failed_jitter else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
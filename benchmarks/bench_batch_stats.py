@@ -0,0 +1,103 @@
+"""
+Benchmark the vectorised `calculate_batch` APIs against per-table `calculate` calls.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_batch_stats --sizes 1000 100000 1000000
+
+The per-table loops, over `calculate` and over scipy's own per-table function, are
+timed on at most `--loop-sample` tables and extrapolated to N, since looping over a
+million tables takes many minutes. Batch results are checked against the per-table
+results on that sample. Exits with status 1 if, from N = 100,000 up, a batch is less
+than `--min-speedup` times faster than the scipy loop.
+"""
+import argparse
+import sys
+import time
+import warnings
+
+import numpy as np
+from scipy import stats
+
+from contingency_stats.contingency_utils import create_contingency_typeddict
+from contingency_stats.methods.chi_squared import ChiSquaredTest
+from contingency_stats.methods.fishers_exact import FishersExactTest
+
+
+def random_tables(n: int, seed: int = 0) -> np.ndarray:
+    """Tables with cell counts spread from single digits to the thousands"""
+    rng = np.random.default_rng(seed)
+    scale = rng.choice([10, 100, 5000], size=(n, 1, 1))
+    return rng.integers(1, scale + 1, size=(n, 2, 2))
+
+
+def time_loop(test, tables: np.ndarray) -> tuple[float, np.ndarray]:
+    start = time.perf_counter()
+    p_values = np.array([
+        test.calculate(create_contingency_typeddict(table.ravel().tolist())).p_value
+        for table in tables
+    ])
+    return time.perf_counter() - start, p_values
+
+
+def time_scipy(name: str, tables: np.ndarray) -> float:
+    """Seconds taken by scipy's per-table function over `tables`"""
+    start = time.perf_counter()
+    for table in tables:
+        if name == "fishers_exact":
+            stats.fisher_exact(table)
+        else:
+            stats.chi2_contingency(table, correction=False)
+    return time.perf_counter() - start
+
+
+def time_batch(test, tables: np.ndarray) -> tuple[float, np.ndarray]:
+    start = time.perf_counter()
+    p_values = test.calculate_batch(tables)["p_value"]
+    return time.perf_counter() - start, p_values
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--loop-sample", type=int, default=2_000)
+    parser.add_argument("--min-speedup", type=float, default=10.0, help="Required speedup over the scipy loop")
+    args = parser.parse_args()
+
+    tests = {"fishers_exact": FishersExactTest(), "chi_squared": ChiSquaredTest()}
+    failures = []
+    print(
+        f"{'test':<15}{'N':>10}{'loop (s)':>12}{'scipy (s)':>12}{'batch (s)':>12}"
+        f"{'speedup':>10}{'vs scipy':>10}{'max |dp|':>12}"
+    )
+    for n in args.sizes:
+        tables = random_tables(n)
+        sample = tables[: args.loop_sample]
+        for name, test in tests.items():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                loop_seconds, loop_p = time_loop(test, sample)
+                scipy_seconds = time_scipy(name, sample)
+                batch_seconds, batch_p = time_batch(test, tables)
+
+            loop_seconds *= n / len(sample)
+            scipy_seconds *= n / len(sample)
+            speedup = scipy_seconds / batch_seconds
+            max_diff = float(np.max(np.abs(loop_p - batch_p[: len(sample)])))
+            too_slow = n >= 100_000 and speedup < args.min_speedup
+            if too_slow:
+                failures.append(f"{name} at N={n}: {speedup:.0f}x")
+            print(
+                f"{name:<15}{n:>10}{loop_seconds:>12.3f}{scipy_seconds:>12.3f}{batch_seconds:>12.3f}"
+                f"{loop_seconds / batch_seconds:>9.0f}x{speedup:>9.0f}x{max_diff:>12.1e}"
+                + ("  TOO SLOW" if too_slow else "")
+            )
+
+    if failures:
+        print(f"\nBatch speedup over the scipy loop below {args.min_speedup:.0f}x: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Benchmark decoding Task API status and result responses.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_decode --responses 20000
+
+Three paths are timed on real `requests.Response` objects:
+
+    dict        `response.json()` (stdlib parser) then pydantic validation of the dict
+    json        `from_api_json(response.content)`: pydantic-core parses and validates the
+                raw body in one pass, without building intermediate Python objects
+    json strict the same with pydantic's strict mode (no type coercion)
+
+For reference, `model_construct` (unvalidated construction) after the stdlib parser is
+timed too. All paths are checked to produce the same models.
+"""
+import argparse
+import json
+import time
+
+import requests
+
+from job_status import JobStatus
+from query_result import QueryResult, QueryResultData
+
+
+def make_response(body: object) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(body).encode("utf-8")
+    return response
+
+
+def status_body(i: int) -> list:
+    return [{f"{i:08x}-1c2d-4e5f-8a9b-0c1d2e3f4a5b": "JOB_RUNNING" if i % 5 else "JOB_DONE"}]
+
+
+def result_body(i: int) -> dict:
+    return {
+        "status": "ok",
+        "protocolVersion": "v2",
+        "uuid": f"contingency_True_False_{i:032x}",
+        "message": "",
+        "queryResult": {"count": 1000 + i, "datasetsCount": 1, "files": []},
+        "collection_id": "RQ-CC-bench",
+    }
+
+
+def construct_status(response: requests.Response) -> JobStatus:
+    job_uuid, status = next(iter(json.loads(response.content)[0].items()))
+    return JobStatus.model_construct(job_uuid=job_uuid, status=status)
+
+
+def construct_result(response: requests.Response) -> QueryResult:
+    fields = json.loads(response.content)
+    fields["queryResult"] = QueryResultData.model_construct(**fields["queryResult"])
+    return QueryResult.model_construct(**fields)
+
+
+def timed(label: str, decode, responses: list, repeats: int) -> None:
+    """Best of `repeats` passes, discarding the models so holding them does not skew the timing"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for response in responses:
+            decode(response)
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<30}{best / len(responses) * 1e6:>12.2f}{len(responses) / best:>16,.0f}")
+
+
+def mismatches(reference, decoders: list, responses: list) -> int:
+    expected = [reference(response).model_dump() for response in responses]
+    return sum(decode(response).model_dump() != e for decode in decoders for response, e in zip(responses, expected))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--responses", type=int, default=20_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    decoders = {
+        "status": (
+            [make_response(status_body(i)) for i in range(args.responses)],
+            lambda r: JobStatus.from_api_response(r.json()),
+            [
+                ("json", lambda r: JobStatus.from_api_json(r.content)),
+                ("json strict", lambda r: JobStatus.from_api_json(r.content, strict=True)),
+                ("model_construct", construct_status),
+            ],
+        ),
+        "result": (
+            [make_response(result_body(i)) for i in range(args.responses)],
+            lambda r: QueryResult.from_api_response(r.json()),
+            [
+                ("json", lambda r: QueryResult.from_api_json(r.content)),
+                ("json strict", lambda r: QueryResult.from_api_json(r.content, strict=True)),
+                ("model_construct", construct_result),
+            ],
+        ),
+    }
+
+    print(f"{'decode':<30}{'us/response':>12}{'responses/s':>16}")
+    differing = 0
+    for kind, (responses, reference, paths) in decoders.items():
+        timed(f"{kind}, dict", reference, responses, args.repeats)
+        for name, decode in paths:
+            timed(f"{kind}, {name}", decode, responses, args.repeats)
+        differing += mismatches(reference, [decode for _, decode in paths], responses)
+        print()
+
+    if differing:
+        raise SystemExit(f"{differing} decoded models differ from the dict path")
+
+if __name__ == "__main__":
+    main()
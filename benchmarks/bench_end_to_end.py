@@ -0,0 +1,231 @@
+"""
+End-to-end benchmarks against the local mock Task API.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_end_to_end
+    python -m benchmarks.bench_end_to_end --transport http --pairs 200 --latency-median 0.1
+
+Reports p50/p95/p99 latency and throughput for single-pair builds, batch screens and
+the statistics methods, and checks that the marginal query planner agrees with the
+direct four-query tables. The "sessions" scenarios build the same table from many
+sessions at once, with and without single-flight sharing, and report the upstream jobs
+submitted. With --metrics, per-stage timings recorded by the
+instrumentation are summarised and written out in the Prometheus text format.
+"""
+import argparse
+import contextlib
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+
+from batch_screen import ScreeningPair, screen_pairs
+from client_factory import PooledTaskApiClient
+from contingency_stats.contingency_utils import create_contingency_typeddict
+from contingency_stats.methods.chi_squared import ChiSquaredTest
+from contingency_stats.methods.fishers_exact import FishersExactTest
+from contingency_table_builder import ContingencyTableQuery
+from instrumentation import NULL_INSTRUMENTATION, HistogramSink, Instrumentation, PrometheusTextSink
+from mock_task_api import LatencyModel, MockTaskApi, MockTaskApiClient, MockTaskApiServer
+from polling import PollingPolicy
+from query_planner import MarginalQueryPlanner, verify_marginal_plan
+from single_flight import SingleFlight
+
+
+def report(name: str, latencies: List[float], elapsed: float, unit: str = "op") -> None:
+    """Print latency percentiles (ms) and throughput for one scenario"""
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1e3, [50, 95, 99])
+    print(
+        f"{name:<32}{len(latencies):>8}{p50:>11.2f}{p95:>11.2f}{p99:>11.2f}"
+        f"{len(latencies) / elapsed:>12.1f} {unit}/s"
+    )
+
+
+@contextlib.contextmanager
+def make_client(api: MockTaskApi, transport: str):
+    if transport == "http":
+        with MockTaskApiServer(api) as server:
+            client = PooledTaskApiClient(server.url, pool_size=64)
+            try:
+                yield client
+            finally:
+                client.close()
+    else:
+        yield MockTaskApiClient(api)
+
+
+def bench_single_pair(
+    client, policy: PollingPolicy, repeats: int, concurrent: bool, instrumentation: Instrumentation
+) -> None:
+    latencies = []
+    start = time.perf_counter()
+    for i in range(repeats):
+        builder = ContingencyTableQuery(
+            str(8507 + i), "24970", "Person", polling_policy=policy, instrumentation=instrumentation
+        )
+        t0 = time.perf_counter()
+        builder.build_contingency_table(client, "bench", "bench", concurrent=concurrent)
+        latencies.append(time.perf_counter() - t0)
+    name = "single pair (concurrent)" if concurrent else "single pair (serial)"
+    report(name, latencies, time.perf_counter() - start, "table")
+
+
+def bench_shared_sessions(
+    api: MockTaskApi,
+    client,
+    policy: PollingPolicy,
+    sessions: int,
+    single_flight: bool,
+    instrumentation: Instrumentation,
+) -> None:
+    """Build the same table from `sessions` concurrent sessions, as analysts sharing a default exposure do"""
+    shared = SingleFlight() if single_flight else None
+    submits_before = api.requests["submit"]
+
+    def session(i: int) -> float:
+        builder = ContingencyTableQuery(
+            "8507", "4329847", "Person", polling_policy=policy,
+            instrumentation=instrumentation, single_flight=shared,
+        )
+        t0 = time.perf_counter()
+        builder.build_contingency_table(client, "bench", f"analyst{i}")
+        return time.perf_counter() - t0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        latencies = list(executor.map(session, range(sessions)))
+    name = f"{sessions} sessions ({'single-flight' if single_flight else 'independent'})"
+    report(name, latencies, time.perf_counter() - start, "table")
+    print(f"{'':<4}upstream jobs submitted: {api.requests['submit'] - submits_before}")
+
+
+def bench_batch_screen(
+    client, policy: PollingPolicy, pairs: int, workers: int, planner: bool, instrumentation: Instrumentation
+) -> None:
+    pair_list = [ScreeningPair("8507", str(100000 + i), "Person", "Condition") for i in range(pairs)]
+    latencies = []
+    start = time.perf_counter()
+    for _ in screen_pairs(
+        client, "bench", "bench", pair_list,
+        max_workers=workers,
+        polling_policy=policy,
+        planner=MarginalQueryPlanner(polling_policy=policy, instrumentation=instrumentation) if planner else None,
+        instrumentation=instrumentation,
+    ):
+        latencies.append(time.perf_counter() - start)
+    name = f"batch screen ({'planner' if planner else 'direct'}, {workers} workers)"
+    report(name, latencies, time.perf_counter() - start, "pair")
+
+
+def bench_stats(tables: np.ndarray) -> None:
+    tests = {"fishers_exact": FishersExactTest(), "chi_squared": ChiSquaredTest()}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for name, test in tests.items():
+            latencies = []
+            start = time.perf_counter()
+            for table in tables:
+                ct = create_contingency_typeddict(table.ravel().tolist())
+                t0 = time.perf_counter()
+                test.calculate(ct)
+                latencies.append(time.perf_counter() - t0)
+            report(f"{name}.calculate", latencies, time.perf_counter() - start, "table")
+
+            start = time.perf_counter()
+            for chunk in np.array_split(tables, 10):
+                test.calculate_batch(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"{name + '.calculate_batch':<32}{len(tables):>8}{'':>33}{len(tables) / elapsed:>12.1f} table/s")
+
+
+def bench_instrumentation_overhead(calls: int = 200_000) -> None:
+    """Cost of a timer block with instrumentation disabled vs recording into in-memory sinks"""
+    enabled = Instrumentation([HistogramSink(), PrometheusTextSink()])
+    for name, instrumentation in [("disabled", NULL_INSTRUMENTATION), ("histogram+prometheus", enabled)]:
+        start = time.perf_counter()
+        for _ in range(calls):
+            with instrumentation.timer("submit", cell="exposed_with_outcome", job_uuid="bench"):
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"{'timer (' + name + ')':<32}{calls:>8}{elapsed / calls * 1e9:>11.0f} ns/call")
+
+
+def timed_section(title: str, fn: Callable[[], None]) -> None:
+    print(f"\n{title}")
+    print(f"{'scenario':<32}{'n':>8}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'throughput':>14}")
+    fn()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--transport", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--latency-median", type=float, default=0.05, help="Median job latency (s)")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="Lognormal sigma of job latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Status request failure rate")
+    parser.add_argument("--repeats", type=int, default=20, help="Single-pair builds per scenario")
+    parser.add_argument("--pairs", type=int, default=100, help="Pairs per batch screen")
+    parser.add_argument("--workers", type=int, default=32, help="Batch screen worker threads")
+    parser.add_argument("--tables", type=int, default=2_000, help="Tables for the statistics benchmarks")
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent sessions building the same table")
+    parser.add_argument(
+        "--metrics", nargs="?", const="-", metavar="FILE",
+        help="Record stage timings and write Prometheus text to FILE (default: stdout)",
+    )
+    args = parser.parse_args()
+
+    histograms = HistogramSink()
+    prometheus = PrometheusTextSink()
+    instrumentation = Instrumentation([histograms, prometheus]) if args.metrics else NULL_INSTRUMENTATION
+
+    api = MockTaskApi(
+        latency=LatencyModel(median=args.latency_median, spread=args.latency_spread),
+        status_failure_rate=args.failure_rate,
+    )
+    policy = PollingPolicy(
+        fast_probes=3,
+        fast_interval=args.latency_median / 4,
+        initial_interval=args.latency_median / 2,
+        max_interval=args.latency_median * 4,
+    )
+
+    with make_client(api, args.transport) as client:
+        def upstream() -> None:
+            bench_single_pair(client, policy, args.repeats, concurrent=False, instrumentation=instrumentation)
+            bench_single_pair(client, policy, args.repeats, concurrent=True, instrumentation=instrumentation)
+            bench_batch_screen(client, policy, args.pairs, args.workers, False, instrumentation)
+            bench_batch_screen(client, policy, args.pairs, args.workers, True, instrumentation)
+            bench_shared_sessions(api, client, policy, args.sessions, False, instrumentation)
+            bench_shared_sessions(api, client, policy, args.sessions, True, instrumentation)
+
+        timed_section(f"Upstream scenarios ({args.transport} mock, median job {args.latency_median}s)", upstream)
+
+        builder = ContingencyTableQuery("8507", "24970", "Person", polling_policy=policy)
+        mismatches = verify_marginal_plan(builder, client, "bench", "bench")
+        print(f"\nMarginal planner agrees with direct queries: {not mismatches} {mismatches or ''}")
+        print(f"Upstream requests: {api.requests}")
+
+    rng = np.random.default_rng(0)
+    tables = rng.integers(1, rng.choice([10, 100, 5000], size=(args.tables, 1, 1)) + 1, size=(args.tables, 2, 2))
+    timed_section("Statistics", lambda: bench_stats(tables))
+    print()
+    bench_instrumentation_overhead()
+
+    if args.metrics:
+        print(f"\n{'stage':<32}{'n':>8}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+        for stage, summary in sorted(histograms.summary().items()):
+            print(
+                f"{stage:<32}{summary['count']:>8}{summary['p50'] * 1e3:>11.2f}"
+                f"{summary['p95'] * 1e3:>11.2f}{summary['p99'] * 1e3:>11.2f}"
+            )
+        if args.metrics == "-":
+            print("\n" + prometheus.render())
+        else:
+            with open(args.metrics, "w") as f:
+                f.write(prometheus.render())
+
+
+if __name__ == "__main__":
+    main()
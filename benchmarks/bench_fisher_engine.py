@@ -0,0 +1,138 @@
+"""
+Benchmark the FisherEngine against scipy.stats.fisher_exact and check its tolerance.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_fisher_engine --tables 500
+
+Each scenario times scipy on every table, then a cold engine (empty cache) and a warm
+one (same tables again), and reports the largest relative p-value difference from scipy
+over p-values above 1e-300.
+
+The conditional odds ratio section times `conditional_odds_ratio` over each whole
+scenario and compares it with `scipy.stats.contingency.odds_ratio(kind="conditional")`
+on up to `--or-sample` of its tables with at most 20,000 patients; scipy takes minutes
+per population-scale table, so larger scenarios are timed but not compared.
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+from scipy import stats
+from scipy.stats.contingency import odds_ratio
+
+from contingency_stats.conditional_odds_ratio import conditional_odds_ratio
+from contingency_stats.fisher_engine import FisherEngine
+
+EXACT_TOLERANCE = 1e-8
+ASYMPTOTIC_TOLERANCE = 1e-4
+ODDS_RATIO_TOLERANCE = 1e-6
+
+
+def scenarios(n: int, rng: np.random.Generator) -> dict:
+    def near_null(low: int, high: int, spread: int, size: int) -> np.ndarray:
+        base = rng.integers(low, high, size=(size, 1, 1))
+        return base + rng.integers(-spread, spread, size=(size, 2, 2))
+
+    shared = rng.integers(1_000, 200_000, size=(max(1, n // 20), 2, 2))
+    return {
+        "small counts (<30)": (rng.integers(0, 30, size=(n, 2, 2)), EXACT_TOLERANCE),
+        "mixed (10..5000)": (
+            rng.integers(1, rng.choice([10, 100, 5000], size=(n, 1, 1)) + 1, size=(n, 2, 2)),
+            EXACT_TOLERANCE,
+        ),
+        "population (~1e5/cell)": (near_null(50_000, 300_000, 800, n), EXACT_TOLERANCE),
+        "repeated margins": (shared[rng.integers(0, len(shared), size=n)], EXACT_TOLERANCE),
+        "asymptotic (~1e7/cell)": (
+            near_null(5_000_000, 30_000_000, 20_000, max(1, n // 10)),
+            ASYMPTOTIC_TOLERANCE,
+        ),
+    }
+
+
+def relative_difference(values: np.ndarray, reference: np.ndarray) -> float:
+    """Largest relative difference, treating matching infinities, zeros and NaNs as equal"""
+    same = (values == reference) | (np.isnan(values) & np.isnan(reference))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        difference = np.abs(values - reference) / np.abs(reference)
+    return float(np.max(np.where(same, 0.0, difference), initial=0.0))
+
+
+def bench_odds_ratio(name: str, tables: np.ndarray, sample: int) -> bool:
+    start = time.perf_counter()
+    conditional_odds_ratio(tables)
+    batch_seconds = time.perf_counter() - start
+
+    subset = tables[tables.sum(axis=(1, 2)) <= 20_000][:sample]
+    if len(subset) == 0:
+        print(f"{name:<26}{len(tables):>7}{'-':>11}{batch_seconds:>10.3f}{'':>10}{'-':>12}")
+        return True
+
+    start = time.perf_counter()
+    reference = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for table in subset:
+            result = odds_ratio(table, kind="conditional")
+            interval = result.confidence_interval(0.95)
+            reference.append((result.statistic, interval.low, interval.high))
+    scipy_seconds = (time.perf_counter() - start) / len(subset) * len(tables)
+
+    estimate = np.column_stack(conditional_odds_ratio(subset))
+    max_rel = relative_difference(estimate, np.array(reference, dtype=np.float64))
+    ok = max_rel <= ODDS_RATIO_TOLERANCE
+    print(
+        f"{name:<26}{len(tables):>7}{scipy_seconds:>11.3f}{batch_seconds:>10.3f}"
+        f"{'':>10}{max_rel:>12.1e}  {'yes' if ok else 'NO'}"
+    )
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tables", type=int, default=500, help="Tables per scenario")
+    parser.add_argument("--alternative", choices=["two-sided", "less", "greater"], default="two-sided")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--or-sample", type=int, default=20, help="Tables checked against scipy's odds_ratio")
+    args = parser.parse_args()
+
+    print(f"{'scenario':<26}{'N':>7}{'scipy (s)':>11}{'cold (s)':>10}{'warm (s)':>10}{'max rel dp':>12}  ok")
+    all_ok = True
+    cases = scenarios(args.tables, np.random.default_rng(args.seed))
+    for name, (tables, tolerance) in cases.items():
+        start = time.perf_counter()
+        reference = np.array([stats.fisher_exact(t, alternative=args.alternative)[1] for t in tables])
+        scipy_seconds = time.perf_counter() - start
+
+        engine = FisherEngine()
+        start = time.perf_counter()
+        p_values = engine.p_values(tables, args.alternative)
+        cold_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        engine.p_values(tables, args.alternative)
+        warm_seconds = time.perf_counter() - start
+
+        representable = reference > 1e-300
+        max_rel = float(np.max(
+            np.abs(p_values[representable] - reference[representable]) / reference[representable],
+            initial=0.0,
+        ))
+        ok = max_rel <= tolerance
+        all_ok &= ok
+        print(
+            f"{name:<26}{len(tables):>7}{scipy_seconds:>11.3f}{cold_seconds:>10.3f}"
+            f"{warm_seconds:>10.4f}{max_rel:>12.1e}  {'yes' if ok else 'NO'}"
+        )
+
+    print(f"\nConditional odds ratio (scipy time extrapolated from up to {args.or_sample} tables)")
+    print(f"{'scenario':<26}{'N':>7}{'scipy (s)':>11}{'batch (s)':>10}{'':>10}{'max rel':>12}  ok")
+    for name, (tables, _) in cases.items():
+        all_ok &= bench_odds_ratio(name, tables, args.or_sample)
+
+    if not all_ok:
+        raise SystemExit("Results exceeded their documented tolerance")
+
+
+if __name__ == "__main__":
+    main()
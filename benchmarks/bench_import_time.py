@@ -0,0 +1,141 @@
+"""
+Benchmark cold import times against a budget relative to numpy, and check that heavy dependencies are deferred.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_import_time --repeats 5
+
+Each module is imported in a fresh interpreter, `--repeats` times, right after
+`import numpy`, which every module needs anyway. Both imports are timed in the same
+interpreter, and the median ratio of the two together to numpy alone is compared with
+the module's budget in BUDGETS. Being relative to numpy on the same machine and run, the
+budgets hold on slow and fast machines alike; scale them with --budget-scale regardless.
+The run also checks that none of the heavy dependencies the library modules should defer
+(scipy, pandas, pyarrow, hutch_bunny) were loaded by the import; they are loaded on first
+use instead. The app needs them at start-up and is only held to its budget. Exits
+non-zero if a budget is exceeded or a heavy dependency was imported, so it can guard CLI,
+batch worker and app cold starts in CI.
+
+The "first use" rows time an import followed by the first call that needs the deferred
+dependencies, in milliseconds, for reference.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("scipy", "pandas", "pyarrow", "hutch_bunny")
+
+# Budgets: median time of `import numpy` followed by the module, as a multiple of numpy's
+# own import time in the same interpreter (about 1.5x what each measures today)
+BUDGETS = {
+    "contingency_stats": 2.0,
+    "contingency_stats.ratios": 5.0,
+    "contingency_stats.methods.fishers_exact": 5.0,
+    "contingency_stats.methods.chi_squared": 5.0,
+    "contingency_stats.methods.mantel_haenszel": 5.0,
+    "contingency_table_builder": 6.0,
+    "query_planner": 6.0,
+    "batch_screen": 7.0,
+    "results_store": 7.0,
+    "app": 25.0,
+}
+
+# Modules that import the heavy dependencies on purpose
+EAGER_MODULES = frozenset({"app"})
+
+FIRST_USE = {
+    "fisher 2x2 calculate": (
+        "import numpy; from contingency_stats.methods.fishers_exact import FishersExactTest; "
+        "FishersExactTest().calculate(numpy.array([[12, 5], [3, 20]]))"
+    ),
+    "chi-squared calculate": (
+        "import numpy; from contingency_stats.methods.chi_squared import ChiSquaredTest; "
+        "ChiSquaredTest().calculate(numpy.array([[12, 5], [3, 20]]))"
+    ),
+}
+
+# Prints the seconds taken by `import numpy` and by the module imported after it
+_TIMED_IMPORT = (
+    "import importlib, time; start = time.perf_counter(); import numpy; "
+    "numpy_done = time.perf_counter(); importlib.import_module({module!r}); "
+    "print(numpy_done - start, time.perf_counter() - numpy_done)"
+)
+
+
+def repository_env() -> dict:
+    """Environment whose PYTHONPATH puts the repository root first"""
+    paths = [os.getcwd(), os.environ.get("PYTHONPATH")]
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in paths if path))
+
+
+def interpreter_seconds(code: str, repeats: int) -> float:
+    """Median wall time of running `code` in a fresh interpreter"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, env=repository_env())
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def relative_import(module: str, repeats: int) -> tuple[float, float]:
+    """Median (milliseconds, multiple of numpy) of importing numpy and then `module` in a fresh interpreter"""
+    milliseconds, multiples = [], []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", _TIMED_IMPORT.format(module=module)],
+            check=True, env=repository_env(), capture_output=True, text=True,
+        )
+        numpy_seconds, module_seconds = map(float, output.stdout.split())
+        milliseconds.append((numpy_seconds + module_seconds) * 1e3)
+        multiples.append((numpy_seconds + module_seconds) / numpy_seconds)
+    return statistics.median(milliseconds), statistics.median(multiples)
+
+
+def heavy_imports(module: str) -> list:
+    """Heavy dependencies present in sys.modules after importing `module`"""
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, env=repository_env(), capture_output=True, text=True
+    )
+    return [name for name in output.stdout.strip().split(",") if name]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every budget by this factor")
+    args = parser.parse_args()
+
+    print(f"{'module':<42}{'import ms':>10}{'x numpy':>9}{'budget':>8}  heavy imports  ok")
+    failures = []
+    for module, budget in BUDGETS.items():
+        budget *= args.budget_scale
+        milliseconds, multiple = relative_import(module, args.repeats)
+        heavy = [] if module in EAGER_MODULES else heavy_imports(module)
+        ok = multiple <= budget and not heavy
+        if not ok:
+            failures.append(module)
+        print(
+            f"{module:<42}{milliseconds:>10.1f}{multiple:>9.1f}{budget:>8.1f}  "
+            f"{','.join(heavy) or '-':<13}  {'yes' if ok else 'NO'}"
+        )
+
+    print()
+    baseline = interpreter_seconds("pass", args.repeats)
+    for name, code in FIRST_USE.items():
+        elapsed = (interpreter_seconds(code, args.repeats) - baseline) * 1e3
+        print(f"{'first use: ' + name:<42}{elapsed:>10.1f}")
+
+    if failures:
+        raise SystemExit(f"Import budget exceeded or heavy dependency imported: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    main()
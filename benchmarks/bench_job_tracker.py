@@ -0,0 +1,105 @@
+"""
+Benchmark polling many pending jobs through a JobTracker against a thread per cell.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_job_tracker --pairs 500 --latency-median 2
+
+Screens the pairs against the mock Task API twice: with the worker pool, where every
+cell query holds a thread while its job runs, and with a JobTracker, where the
+tracker's scheduler and few I/O threads poll every outstanding job. Reports wall time,
+the peak number of live threads and of cell queries outstanding, and the status
+requests made, and checks that both runs produce the same tables.
+"""
+import argparse
+import threading
+import time
+
+from batch_screen import ScreeningPair, screen_pairs
+from job_tracker import JobTracker
+from mock_task_api import LatencyModel, MockTaskApi, MockTaskApiClient
+from polling import PollingPolicy
+
+
+class ThreadSampler:
+    """Samples the number of live threads in the background and keeps the peak"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "ThreadSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+
+def settle_threads(count: int, timeout: float = 10.0) -> None:
+    """Wait for threads left over from an earlier run (e.g. a shut-down pool's) to exit"""
+    deadline = time.monotonic() + timeout
+    while threading.active_count() > count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def run(api: MockTaskApi, pairs: list, policy: PollingPolicy, workers: int, job_tracker=None):
+    client = MockTaskApiClient(api)
+    before = dict(api.requests)
+    start = time.perf_counter()
+    with ThreadSampler() as sampler:
+        results = screen_pairs(
+            client, "bench", "bench", pairs, max_workers=workers, polling_policy=policy,
+            query_options={"single_flight": None}, job_tracker=job_tracker,
+        )
+        tables = {result.index: result.table for result in results}
+    elapsed = time.perf_counter() - start
+    requests = {name: api.requests[name] - before.get(name, 0) for name in api.requests}
+    # Not counting the main thread and the sampler's own
+    return tables, elapsed, sampler.peak - 2, requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=64, help="Worker pool size of the thread-per-cell run")
+    parser.add_argument("--tracker-workers", type=int, default=4, help="I/O threads of the JobTracker")
+    parser.add_argument(
+        "--outstanding", type=int, default=2_000, help="Cell queries the tracked screen keeps outstanding"
+    )
+    parser.add_argument("--latency-median", type=float, default=2.0)
+    args = parser.parse_args()
+
+    api = MockTaskApi(latency=LatencyModel("lognormal", args.latency_median, 0.5))
+    policy = PollingPolicy(fast_interval=0.1, initial_interval=0.25, max_interval=1.0)
+    pairs = [ScreeningPair("8507", str(100000 + i), "Person", "Condition") for i in range(args.pairs)]
+
+    print(f"{'run':<34}{'seconds':>9}{'threads':>9}{'outstanding':>13}{'status GETs':>13}{'pair/s':>9}")
+    pooled, seconds, threads, requests = run(api, pairs, policy, args.workers)
+    print(
+        f"{f'thread per cell ({args.workers} workers)':<34}{seconds:>9.2f}{threads:>9}{args.workers:>13}"
+        f"{requests['status']:>13}{len(pooled) / seconds:>9.1f}"
+    )
+
+    settle_threads(1)
+    with JobTracker(max_workers=args.tracker_workers) as tracker:
+        tracked, seconds, threads, requests = run(api, pairs, policy, args.outstanding, tracker)
+        print(
+            f"{f'job tracker ({args.tracker_workers} I/O threads)':<34}{seconds:>9.2f}{threads:>9}"
+            f"{tracker.stats.max_outstanding:>13}{requests['status']:>13}{len(tracked) / seconds:>9.1f}"
+        )
+
+    print("\nthreads: peak live threads besides the main one, sampled every 10 ms")
+    if tracked != pooled:
+        raise SystemExit("The tracked screen produced different tables")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark resuming an interrupted batch screen from a JobJournal.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_journal_resume --pairs 200 --interrupt-after 0.5
+
+Screens the pairs once from scratch, then again with a journal, abandoning the run
+after a fraction of the pairs have completed (the generator is closed, so cells still
+polling are cancelled with their jobs left running upstream, as in a crash). A third
+run resumes from the journal: fetched cells are skipped, submitted ones are re-attached
+to, and only the rest are submitted. The resumed tables are checked against the fresh
+ones. The cost of a journal record, with and without fsync, is reported last.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from batch_screen import ScreeningPair, screen_pairs
+from job_journal import JobJournal
+from mock_task_api import LatencyModel, MockTaskApi, MockTaskApiClient
+from polling import PollingPolicy
+
+
+def run(client, api: MockTaskApi, pairs, policy: PollingPolicy, workers: int, journal=None, stop_after=None):
+    submits_before = api.requests["submit"]
+    query_options = {"journal": journal, "single_flight": None}
+    tables = {}
+    start = time.perf_counter()
+    screen = screen_pairs(
+        client, "bench", "bench", pairs, max_workers=workers, polling_policy=policy, query_options=query_options
+    )
+    try:
+        for result in screen:
+            tables[result.index] = result.table
+            if stop_after is not None and len(tables) >= stop_after:
+                break
+    finally:
+        screen.close()
+    return tables, api.requests["submit"] - submits_before, time.perf_counter() - start
+
+
+def bench_record(path: str, durable: bool, records: int) -> float:
+    with JobJournal(path, durable=durable) as journal:
+        start = time.perf_counter()
+        for i in range(records):
+            journal.record(f"{i:064x}", "submitted", f"mock-{i:08d}")
+        return (time.perf_counter() - start) / records
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--interrupt-after", type=float, default=0.5, help="Fraction of pairs completed before the interruption")
+    parser.add_argument("--latency-median", type=float, default=0.2)
+    parser.add_argument("--records", type=int, default=2_000)
+    args = parser.parse_args()
+
+    api = MockTaskApi(latency=LatencyModel("lognormal", args.latency_median, 0.5))
+    client = MockTaskApiClient(api)
+    policy = PollingPolicy(initial_interval=0.02, max_interval=0.1)
+    pairs = [ScreeningPair("8507", str(100000 + i), "Person", "Condition") for i in range(args.pairs)]
+
+    fresh, fresh_submits, fresh_seconds = run(client, api, pairs, policy, args.workers)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "screen.journal")
+        with JobJournal(path) as journal:
+            partial, partial_submits, partial_seconds = run(
+                client, api, pairs, policy, args.workers, journal, int(args.pairs * args.interrupt_after)
+            )
+
+        with JobJournal(path) as journal:
+            pending = len(journal.pending())
+            fetched = len(journal) - pending
+            resumed, resumed_submits, resumed_seconds = run(client, api, pairs, policy, args.workers, journal)
+
+        print(f"{'run':<28}{'pairs':>8}{'submits':>10}{'seconds':>10}")
+        print(f"{'fresh':<28}{len(fresh):>8}{fresh_submits:>10}{fresh_seconds:>10.2f}")
+        print(f"{'interrupted':<28}{len(partial):>8}{partial_submits:>10}{partial_seconds:>10.2f}")
+        print(f"{'resumed from journal':<28}{len(resumed):>8}{resumed_submits:>10}{resumed_seconds:>10.2f}")
+        print(f"\njournal on restart: {fetched} cells fetched, {pending} submitted but not fetched")
+
+        if resumed != fresh:
+            raise SystemExit("Resumed tables differ from the fresh run")
+        if partial_submits + resumed_submits != fresh_submits:
+            raise SystemExit("The resumed run resubmitted cells the journal already had")
+
+        for durable in (True, False):
+            seconds = bench_record(os.path.join(directory, f"records-{durable}.journal"), durable, args.records)
+            print(f"record ({'fsync' if durable else 'flush only'}): {seconds * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
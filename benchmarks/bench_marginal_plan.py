@@ -0,0 +1,72 @@
+"""
+Check the marginal query planner's derived tables against direct four-query tables.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_marginal_plan --pairs 50 --rounding 0 10
+
+For each rounding target, screens the pairs against a MockTaskApi that rounds counts
+like bunny, with `verify_marginal_plan`. With exact counts (rounding 0) every derived
+table must equal the direct one and no derivation may be flagged; with rounded counts
+derived tables must be seen to differ. Pairs whose counts were inconsistent
+(`derivation_issues`) are reported; the mock's rounding alone rarely makes them so, so
+counts left by a suppressed marginal are checked to be flagged as well. Exits with
+status 1 if any expectation fails.
+"""
+import argparse
+import sys
+import time
+
+from contingency_table_builder import ContingencyTableQuery
+from mock_task_api import LatencyModel, MockTaskApi, MockTaskApiClient
+from polling import PollingPolicy
+from query_planner import MarginalQueryPlanner, derivation_issues, verify_marginal_plan
+
+
+def check(rounding: int, pairs: int, population_size: int) -> tuple[int, int, float]:
+    """Verify `pairs` pairs; returns (pairs whose tables differ, pairs with derivation issues, seconds)"""
+    api = MockTaskApi(population_size=population_size, latency=LatencyModel(kind="fixed", median=0.0),
+                      rounding=rounding)
+    client = MockTaskApiClient(api)
+    policy = PollingPolicy(initial_interval=0.001, max_interval=0.005)
+    planner = MarginalQueryPlanner(polling_policy=policy)
+    differing = flagged = 0
+    start = time.perf_counter()
+    for i in range(pairs):
+        # A few exposures against many outcomes, so marginals are shared as in a screen
+        builder = ContingencyTableQuery(str(1000 + i % 5), str(2000 + i), polling_policy=policy)
+        differing += bool(verify_marginal_plan(builder, client, "bench", "bench", planner))
+        flagged += bool(builder.derivation_issues)
+    return differing, flagged, time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--rounding", type=int, nargs="+", default=[0, 10])
+    parser.add_argument("--population-size", type=int, default=500)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'rounding':>8}{'pairs':>8}{'differ':>8}{'flagged':>9}{'time (s)':>10}  expectation")
+    for rounding in args.rounding:
+        differing, flagged, seconds = check(rounding, args.pairs, args.population_size)
+        if rounding:
+            ok, expectation = differing > 0, "derived tables differ"
+        else:
+            ok, expectation = differing == 0 and flagged == 0, "derived tables agree, none flagged"
+        failed |= not ok
+        print(
+            f"{rounding:>8}{args.pairs:>8}{differing:>8}{flagged:>9}{seconds:>10.2f}  "
+            f"{expectation}: {'OK' if ok else 'FAILED'}"
+        )
+
+    # Most of the population exposed, and the few unexposed suppressed to 0
+    issues = derivation_issues(joint=380, exposure_present=490, exposure_absent=0, outcome_present=400)
+    failed |= not issues
+    print(f"\nSuppressed exposure_absent flagged: {'OK' if issues else 'FAILED'} {issues}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Benchmark building cell payloads from compiled templates against the hutch_bunny DTO path.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_payload_compiler --cells 50000
+
+Builds the payloads of a batch screen's cells (2x2 tables, marginals, exclusive R x C
+cells and 2x2 tables on concept sets of 2 to 20 codes) both through the DTOs and through
+a PayloadCompiler, reports the time per payload and throughput of each, and checks that
+every compiled payload serialises to exactly the same JSON as its DTO counterpart.
+"""
+import argparse
+import json
+import time
+from uuid import uuid4
+
+from contingency_table_builder import CELLS, CategoricalTableQuery, ContingencyTableQuery, render_rules_payload
+from payload_compiler import PayloadCompiler, RuleSpec
+
+
+def cell_rules(cells: int) -> list:
+    """Rules of `cells` cell queries, cycling through the shapes a screen issues"""
+    drugs = CategoricalTableQuery(
+        {f"class{i}": str(21600000 + i) for i in range(3)}, {"mi": "4329847"}, "Drug", outcome_reference="none"
+    )
+    rules = []
+    for i in range(cells):
+        shape = i % 7
+        if shape < 4:
+            exposure_present, outcome_present = list(CELLS.values())[shape]
+            builder = ContingencyTableQuery("8507", str(100000 + i), "Person")
+            rules.append(builder.cell_rules(exposure_present, outcome_present))
+        elif shape == 4:
+            rules.append([RuleSpec("Condition", str(100000 + i), bool(i % 2))])
+        elif shape == 5:
+            rules.append(drugs.cell_rules(f"class{i % 3}", "mi"))
+        else:
+            concept_set = [str(200000 + i + j) for j in range(2 + i % 19)]
+            builder = ContingencyTableQuery("8507", concept_set, "Person")
+            rules.append(builder.cell_rules(bool(i % 2), bool(i // 2 % 2)))
+    return rules
+
+
+def timed(label: str, build, all_rules: list, uuids: list) -> None:
+    """Time building every payload, discarding each so holding them all does not skew the timing"""
+    start = time.perf_counter()
+    for rules, query_uuid in zip(all_rules, uuids):
+        build("bench", "analyst", rules, query_uuid)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28}{elapsed / len(all_rules) * 1e6:>12.2f}{len(all_rules) / elapsed:>16,.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cells", type=int, default=50_000)
+    args = parser.parse_args()
+
+    all_rules = cell_rules(args.cells)
+    uuids = [f"contingency_{uuid4().hex}" for _ in all_rules]
+    compiler = PayloadCompiler(render_rules_payload)
+
+    print(f"{'path':<28}{'us/payload':>12}{'payloads/s':>16}")
+    timed("hutch_bunny DTOs", render_rules_payload, all_rules, uuids)
+    timed("compiled (first pass)", compiler.payload, all_rules, uuids)
+    timed("compiled (warm)", compiler.payload, all_rules, uuids)
+
+    mismatches = sum(
+        json.dumps(render_rules_payload("bench", "analyst", rules, query_uuid))
+        != json.dumps(compiler.payload("bench", "analyst", rules, query_uuid))
+        for rules, query_uuid in zip(all_rules, uuids)
+    )
+    print(f"\n{len(compiler)} templates; {mismatches} of {args.cells} payloads differ from the DTO output")
+    if mismatches:
+        raise SystemExit("Compiled payloads are not byte-identical to the DTO payloads")
+
+
+if __name__ == "__main__":
+    main()
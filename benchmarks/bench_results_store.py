@@ -0,0 +1,122 @@
+"""
+Benchmark writing and re-opening a large screen in the columnar ResultsStore.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_results_store --rows 1000000
+
+Appends synthetic screening rows in batches, then re-opens the store as a fresh reader
+and times counting the rows, a filtered read of the significant pairs, and reading one
+whole column. Arrow memory is the bytes allocated by pyarrow's memory pool during each
+read; memory-mapped IPC columns are not counted because they are not copied. The
+flattening of real ScreeningResults is timed separately on a sample.
+"""
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from batch_screen import ScreeningPair, ScreeningResult, default_tests
+from contingency_stats.contingency_utils import create_contingency_typeddict
+from contingency_table_builder import CELLS
+from results_store import ResultsStore, result_row
+
+
+def synthetic_rows(rows: int, rng: np.random.Generator):
+    counts = rng.integers(0, 100_000, size=(rows, 4))
+    p_values = rng.uniform(size=rows) ** 4
+    odds_ratios = rng.lognormal(sigma=0.5, size=rows)
+    for i in range(rows):
+        row = {
+            "index": i,
+            "collection_id": "bench",
+            "exposure_omop_code": str(8507 + i % 50),
+            "exposure_table": "Person",
+            "outcome_omop_code": str(100_000 + i),
+            "outcome_table": "Condition",
+            "payload_hashes": [(cell, f"{i:064x}") for cell in CELLS],
+            "error": None,
+            "fishers_exact_p_value": float(p_values[i]),
+            "fishers_exact_odds_ratio": float(odds_ratios[i]),
+            "fishers_exact_is_significant": bool(p_values[i] < 0.05),
+        }
+        row.update(zip(CELLS, counts[i].tolist()))
+        yield row
+
+
+def timed(label: str, fn):
+    allocated = pa.total_allocated_bytes()
+    start = time.perf_counter()
+    value = fn()
+    elapsed = time.perf_counter() - start
+    growth = (pa.total_allocated_bytes() - allocated) / 2 ** 20
+    print(f"{label:<44}{elapsed:>10.3f}{growth:>14.1f}")
+    return value
+
+
+def bench_flatten(samples: int) -> None:
+    tests = default_tests()
+    rng = np.random.default_rng(1)
+    results = []
+    for i in range(samples):
+        table = create_contingency_typeddict(rng.integers(1, 5_000, size=4).tolist())
+        result = ScreeningResult(index=i, pair=ScreeningPair("8507", str(i)), table=table)
+        result.stats = {name: test.calculate(table) for name, test in tests.items()}
+        results.append(result)
+
+    start = time.perf_counter()
+    for result in results:
+        result_row(result, "bench")
+    elapsed = time.perf_counter() - start
+    print(f"\nresult_row on ScreeningResults: {elapsed / samples * 1e6:.1f} us/row")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--format", choices=["arrow", "parquet"], default="arrow")
+    parser.add_argument("--flatten-sample", type=int, default=2_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        rows = list(synthetic_rows(args.rows, np.random.default_rng(0)))
+        writer = ResultsStore(path, batch_size=args.batch_size, format=args.format)
+
+        def write(rows: list) -> None:
+            for row in rows:
+                writer.append_row(row)
+            writer.flush()
+
+        print(f"{'step (' + args.format + ')':<44}{'seconds':>10}{'arrow MiB':>14}")
+        timed(f"append {args.rows} rows + flush", partial(write, rows))
+        del rows
+
+        reader = ResultsStore(path)
+        total = timed("re-open and count rows", reader.count_rows)
+        significant = timed(
+            "filtered read (p < 1e-4, 4 columns)",
+            lambda: reader.read(
+                ["exposure_omop_code", "outcome_omop_code", "fishers_exact_p_value", "fishers_exact_odds_ratio"],
+                filter=ds.field("fishers_exact_p_value") < 1e-4,
+            ),
+        )
+        column = timed("read one column", lambda: reader.read(["fishers_exact_odds_ratio"]))
+        timed("first 1000 rows", lambda: reader.head(1000))
+
+        size = sum(os.path.getsize(part) for part in reader.parts()) / 2 ** 20
+        print(
+            f"\n{total} rows in {len(reader.parts())} parts, {size:.0f} MiB on disk; "
+            f"{significant.num_rows} significant; column of {column.num_rows} values"
+        )
+
+    bench_flatten(args.flatten_sample)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark the R x C Fisher and chi-squared tests and check exact against Monte Carlo p-values.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_rxc --simulations 10000
+
+For each scenario, the exact Freeman-Halton p-value (where enumeration fits within
+`--max-tables`) is compared with the Monte Carlo one; they should agree within four
+Monte Carlo standard errors. The simulated chi-squared p-value is compared with the
+asymptotic one only for reference, since they differ by design when counts are small.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from contingency_stats.fisher_rxc import fisher_rxc_exact_p_value, fisher_rxc_monte_carlo_p_value
+from contingency_stats.methods.chi_squared import ChiSquaredTest
+
+
+def scenarios(rng: np.random.Generator) -> dict:
+    return {
+        "2x3 small": rng.integers(0, 15, size=(2, 3)),
+        "3x3 small": rng.integers(0, 10, size=(3, 3)),
+        "3x4 sparse": rng.integers(0, 6, size=(3, 4)),
+        "4x4 Job satisfaction": np.array([[1, 2, 1, 0], [3, 3, 6, 1], [10, 10, 14, 9], [6, 7, 12, 11]]),
+        "5x6 moderate": rng.integers(0, 40, size=(5, 6)),
+        "4x5 population": rng.integers(5_000, 60_000, size=(4, 5)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--simulations", type=int, default=10_000)
+    parser.add_argument("--max-tables", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'scenario':<22}{'exact p':>10}{'exact (s)':>11}{'MC p':>10}{'MC (s)':>9}"
+        f"{'|z|':>7}{'chi2 p':>10}{'chi2 MC p':>11}{'chi2 MC (s)':>13}  ok"
+    )
+    all_ok = True
+    for name, table in scenarios(np.random.default_rng(args.seed)).items():
+        start = time.perf_counter()
+        exact = fisher_rxc_exact_p_value(table, args.max_tables)
+        exact_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        simulated = fisher_rxc_monte_carlo_p_value(table, args.simulations, args.seed)
+        simulated_seconds = time.perf_counter() - start
+
+        if exact is None:
+            z, ok = float("nan"), True
+        else:
+            standard_error = max(np.sqrt(exact * (1 - exact) / args.simulations), 1 / args.simulations)
+            z = abs(simulated - exact) / standard_error
+            ok = z <= 4
+        all_ok &= ok
+
+        asymptotic = ChiSquaredTest().calculate(table).p_value
+        start = time.perf_counter()
+        chi2_simulated = ChiSquaredTest(
+            simulate_p_value=True, n_simulations=args.simulations, seed=args.seed
+        ).calculate(table).p_value
+        chi2_seconds = time.perf_counter() - start
+
+        exact_text = f"{exact:>10.4f}" if exact is not None else f"{'-':>10}"
+        print(
+            f"{name:<22}{exact_text}{exact_seconds:>11.3f}{simulated:>10.4f}{simulated_seconds:>9.3f}"
+            f"{z:>7.1f}{asymptotic:>10.4f}{chi2_simulated:>11.4f}{chi2_seconds:>13.3f}  {'yes' if ok else 'NO'}"
+        )
+
+    if not all_ok:
+        raise SystemExit("Monte Carlo p-values disagreed with the exact ones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledTaskApiClient:
+    """
+    Task API client that reuses connections across requests.
+
+    A drop-in replacement for hutch_bunny's TaskApiClient (same `post`/`get` calls) backed by
+    a single `requests.Session`, so submits, status polls and result fetches share pooled
+    keep-alive connections instead of paying a TCP/TLS handshake each time. Idempotent GETs
+    are retried with backoff on connection errors and 5xx gateway responses; POSTs, which
+    create jobs, are never retried.
+
+    The session is safe to share between threads; size the pool to at least the number of
+    threads issuing requests at once.
+
+    Args:
+        base_url: Task API base URL
+        username: Basic auth username
+        password: Basic auth password
+        pool_size: Maximum number of kept-alive connections to the Task API
+        get_retries: Retries for failed GET requests
+        backoff_factor: Base of the exponential backoff between GET retries, in seconds
+        timeout: Per-request timeout, in seconds
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        pool_size: int = 32,
+        get_retries: int = 3,
+        backoff_factor: float = 0.2,
+        timeout: float = 30.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        if username is not None:
+            self.session.auth = (username, password or "")
+
+        retry = Retry(
+            total=get_retries,
+            backoff_factor=backoff_factor,
+            allowed_methods=frozenset({"GET"}),
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_settings(cls, settings, **kwargs) -> "PooledTaskApiClient":
+        """Create a client from hutch_bunny DaemonSettings"""
+        return cls(
+            base_url=settings.TASK_API_BASE_URL,
+            username=settings.TASK_API_USERNAME,
+            password=settings.TASK_API_PASSWORD,
+            **kwargs,
+        )
+
+    def _url(self, endpoint: str) -> str:
+        return f"{self.base_url}/{endpoint.lstrip('/')}"
+
+    def post(self, endpoint: str, data: Optional[dict] = None, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(self._url(endpoint), json=data, **kwargs)
+
+    def get(self, endpoint: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(self._url(endpoint), **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_shared_client: Optional[PooledTaskApiClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_task_api_client(settings=None, **kwargs) -> PooledTaskApiClient:
+    """
+    Return the process-wide pooled Task API client, creating it on first use.
+
+    Args:
+        settings: hutch_bunny DaemonSettings (default: loaded with get_settings(daemon=True))
+        **kwargs: PooledTaskApiClient options, only used when the client is first created
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            if settings is None:
+                from hutch_bunny.core.settings import get_settings
+
+                settings = get_settings(daemon=True)
+            _shared_client = PooledTaskApiClient.from_settings(settings, **kwargs)
+        return _shared_client
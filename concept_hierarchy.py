@@ -0,0 +1,144 @@
+"""
+OMOP concept hierarchy, for expanding codes into concept sets of their descendants.
+
+Reads the vocabulary's `concept_ancestor` table (CONCEPT_ANCESTOR.csv as downloaded from
+Athena, tab-separated, or a comma-separated export with the same columns) into an
+in-memory index: descendant ids grouped by ancestor in one int32 array, with the sorted
+ancestor ids and their offsets alongside, so a lookup is a binary search and a slice.
+The full table has tens of millions of rows, so `load_concept_hierarchy` loads each file
+once per process and shares the index.
+
+numpy is imported when a hierarchy is built, so importing this module is cheap.
+"""
+import csv
+import logging
+import threading
+from array import array
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from concept_set import CodeSet, code_set
+
+logger = logging.getLogger(__name__)
+
+ANCESTOR_COLUMN = "ancestor_concept_id"
+DESCENDANT_COLUMN = "descendant_concept_id"
+LEVELS_COLUMN = "min_levels_of_separation"
+
+
+class ConceptHierarchy:
+    """
+    Index of ancestor -> descendant concepts.
+
+    Args:
+        ancestors: Ancestor concept id of each row
+        descendants: Descendant concept id of each row
+        levels: Optional minimum levels of separation of each row, needed for `max_levels`
+    """
+
+    def __init__(
+        self,
+        ancestors: Iterable[int],
+        descendants: Iterable[int],
+        levels: Optional[Iterable[int]] = None,
+    ):
+        import numpy as np
+
+        ancestors = np.asarray(ancestors, dtype=np.int32)
+        order = np.argsort(ancestors, kind="stable")
+        self._descendants = np.asarray(descendants, dtype=np.int32)[order]
+        self._levels = np.asarray(levels, dtype=np.int16)[order] if levels is not None else None
+        self._ancestors, starts = np.unique(ancestors[order], return_index=True)
+        self._offsets = np.append(starts, len(order))
+
+    @classmethod
+    def from_file(cls, path: str) -> "ConceptHierarchy":
+        """Read a concept_ancestor file, tab- or comma-separated, with a header row"""
+        ancestors, descendants, levels = array("i"), array("i"), array("h")
+        with open(path, newline="", encoding="utf-8") as f:
+            delimiter = "\t" if "\t" in f.readline() else ","
+            f.seek(0)
+            reader = csv.reader(f, delimiter=delimiter)
+            header = next(reader)
+            ancestor, descendant = header.index(ANCESTOR_COLUMN), header.index(DESCENDANT_COLUMN)
+            level = header.index(LEVELS_COLUMN) if LEVELS_COLUMN in header else None
+            for row in reader:
+                ancestors.append(int(row[ancestor]))
+                descendants.append(int(row[descendant]))
+                if level is not None:
+                    levels.append(int(row[level]))
+        logger.info("Loaded %d concept_ancestor rows from %s", len(ancestors), path)
+        return cls(ancestors, descendants, levels if level is not None else None)
+
+    def __len__(self) -> int:
+        """Number of ancestor -> descendant rows"""
+        return len(self._descendants)
+
+    def __contains__(self, omop_code: str) -> bool:
+        """Whether the code is an ancestor in the hierarchy (every concept is its own)"""
+        return self._rows(omop_code) is not None
+
+    def descendants(
+        self, omop_code: str, max_levels: Optional[int] = None, include_self: bool = True
+    ) -> Tuple[str, ...]:
+        """
+        The descendants of a concept, sorted by id.
+
+        Args:
+            omop_code: The ancestor concept
+            max_levels: Only descendants at most this many levels below it
+            include_self: Include the concept itself, even if the hierarchy does not know it
+
+        Raises:
+            ValueError: if `max_levels` is given but the file had no min_levels_of_separation
+        """
+        import numpy as np
+
+        rows = self._rows(omop_code)
+        if rows is None:
+            found = np.empty(0, dtype=np.int32)
+        elif max_levels is None:
+            found = self._descendants[rows]
+        elif self._levels is None:
+            raise ValueError(f"max_levels needs the {LEVELS_COLUMN} column")
+        else:
+            found = self._descendants[rows][self._levels[rows] <= max_levels]
+
+        codes = set(map(str, np.unique(found).tolist()))
+        if include_self:
+            codes.add(str(omop_code))
+        else:
+            codes.discard(str(omop_code))
+        return tuple(sorted(codes))
+
+    def expand(self, codes: Union[str, Iterable[str]], max_levels: Optional[int] = None) -> CodeSet:
+        """The concept set of the codes and all their descendants"""
+        codes = (codes,) if isinstance(codes, str) else codes
+        return code_set(
+            descendant for omop_code in codes for descendant in self.descendants(omop_code, max_levels)
+        )
+
+    def _rows(self, omop_code: str) -> Optional[slice]:
+        """Slice of the rows of an ancestor, or None if it is not in the hierarchy"""
+        import numpy as np
+
+        try:
+            concept_id = int(omop_code)
+        except ValueError:
+            return None
+        i = int(np.searchsorted(self._ancestors, concept_id))
+        if i == len(self._ancestors) or self._ancestors[i] != concept_id:
+            return None
+        return slice(int(self._offsets[i]), int(self._offsets[i + 1]))
+
+
+_hierarchies: Dict[str, ConceptHierarchy] = {}
+_hierarchies_lock = threading.Lock()
+
+
+def load_concept_hierarchy(path: str) -> ConceptHierarchy:
+    """The hierarchy in a concept_ancestor file, read on first use and shared by the whole process"""
+    with _hierarchies_lock:
+        hierarchy = _hierarchies.get(path)
+        if hierarchy is None:
+            hierarchy = _hierarchies[path] = ConceptHierarchy.from_file(path)
+        return hierarchy
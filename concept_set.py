@@ -0,0 +1,55 @@
+"""
+Concept sets: several OMOP codes standing for one exposure or outcome.
+
+In practice an outcome is rarely a single code but a code plus its descendants, or a
+curated list. Wherever the builders take an OMOP code they also take a concept set,
+queried as one upstream cohort: "present" matches patients with any code in the set (an
+OR group of `=` rules) and "absent" patients with none of them (an AND group of `!=`
+rules). Overlapping patients are counted once and each cell stays one upstream job
+however large the set.
+
+A concept set is normalised to a sorted tuple of distinct codes, so the same set always
+builds the same payload (and hits the same cache entries), while a single code stays a
+plain string and builds exactly the single-rule payload it always has.
+"""
+from typing import Iterable, Tuple, Union
+
+# A single OMOP code, or a normalised concept set of several
+CodeSet = Union[str, Tuple[str, ...]]
+
+# Separates the codes of a concept set written as text, e.g. "201826|443238"
+CODE_SET_SEPARATOR = "|"
+
+
+def code_set(codes: Union[str, Iterable[str]]) -> CodeSet:
+    """
+    Normalise a code or a collection of codes.
+
+    Returns:
+        The code itself for a single code (or a collection of one), otherwise a sorted
+        tuple of the distinct codes
+
+    Raises:
+        ValueError: if no codes are given
+    """
+    if isinstance(codes, str):
+        return codes
+    unique = tuple(sorted({str(code) for code in codes}))
+    if not unique:
+        raise ValueError("A concept set needs at least one code")
+    return unique[0] if len(unique) == 1 else unique
+
+
+def set_codes(codes: CodeSet) -> Tuple[str, ...]:
+    """The codes of a normalised code set, as a tuple even for a single code"""
+    return (codes,) if isinstance(codes, str) else codes
+
+
+def format_code_set(codes: Union[str, Iterable[str]]) -> str:
+    """Write a code set as text, e.g. for a results column; a single code is written as is"""
+    return CODE_SET_SEPARATOR.join(set_codes(code_set(codes)))
+
+
+def parse_code_set(text: str) -> CodeSet:
+    """Read a code set written by `format_code_set` (or a single code)"""
+    return code_set(code.strip() for code in text.split(CODE_SET_SEPARATOR) if code.strip())
@@ -0,0 +1,212 @@
+"""
+Conditional maximum-likelihood odds ratios with exact (Cornfield) confidence intervals.
+
+Conditioned on the margins, the top-left count X of a 2x2 table follows Fisher's
+noncentral hypergeometric distribution, P(X = x) proportional to
+C(n1, x) C(n2, n - x) psi^x. The conditional MLE of the odds ratio psi solves
+E_psi[X] = a, and the exact interval bounds solve P_psi(X >= a) = alpha/2 (lower) and
+P_psi(X <= a) = alpha/2 (upper). These match `scipy.stats.contingency.odds_ratio` with
+kind="conditional", and stay finite where the sample odds ratio is 0 or infinite.
+
+All three equations share the same log weights log C(n1, x) + log C(n2, n - x), which
+are computed once per table from a log-factorial table. The roots are found by
+safeguarded Newton iterations in log psi, run for every table of a batch at once over
+the concatenated supports. For large counts only a window of about +/-15 standard
+deviations around the observed count is enumerated; the mass outside it is negligible.
+"""
+from typing import Literal, Optional, Tuple
+
+import numpy as np
+
+from contingency_stats.fisher_engine import LogFactorialTable
+
+# Supports are processed in chunks of at most this many points to bound memory
+_CHUNK_POINTS = 2_000_000
+_MAX_ITERATIONS = 100
+_MAX_STEP = 2.0
+_TOLERANCE = 1e-10
+
+
+def conditional_odds_ratio(
+    observed: np.ndarray,
+    confidence_level: float = 0.95,
+    alternative: Literal["two-sided", "greater", "less"] = "two-sided",
+    log_factorials: Optional[LogFactorialTable] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Conditional MLE odds ratios and exact confidence intervals for an (N, 2, 2) array.
+
+    Args:
+        observed: (N, 2, 2) array of non-negative counts
+        confidence_level: Confidence level (e.g., 0.95 for 95% CI)
+        alternative: 'two-sided', or 'less'/'greater' for one-sided intervals
+            (0, upper] and [lower, inf) as in scipy
+        log_factorials: Log-factorial table to share (default: a new LogFactorialTable)
+
+    Returns:
+        Tuple of (odds_ratio, lower_bound, upper_bound) arrays. Tables with an empty row
+        or column get NaN with the interval (0, inf).
+    """
+    if not 0 < confidence_level < 1:
+        raise ValueError("confidence_level must be between 0 and 1")
+    if alternative not in ("two-sided", "less", "greater"):
+        raise ValueError("`alternative` should be one of {'two-sided', 'less', 'greater'}")
+
+    observed = np.asarray(observed, dtype=np.int64)
+    log_factorials = log_factorials or LogFactorialTable()
+    count = len(observed)
+
+    a = observed[:, 0, 0]
+    n1 = observed[:, 0, 0] + observed[:, 0, 1]
+    n2 = observed[:, 1, 0] + observed[:, 1, 1]
+    n = observed[:, 0, 0] + observed[:, 1, 0]
+    lo = np.maximum(0, n - n2)
+    hi = np.minimum(n1, n)
+
+    odds_ratio = np.full(count, np.nan)
+    lower = np.zeros(count)
+    upper = np.full(count, np.inf)
+
+    live = (n1 > 0) & (n2 > 0) & (n > 0) & (n < n1 + n2)
+    odds_ratio[live & (a == lo)] = 0.0
+    odds_ratio[live & (a == hi)] = np.inf
+
+    # Each bound only needs solving when the observed count is not at that end of the support
+    tail = 1 - confidence_level if alternative != "two-sided" else (1 - confidence_level) / 2
+    solve_mle = live & (a > lo) & (a < hi)
+    solve_lower = live & (a > lo) & (alternative != "less")
+    solve_upper = live & (a < hi) & (alternative != "greater")
+
+    rows = np.flatnonzero(solve_mle | solve_lower | solve_upper)
+    if len(rows) == 0:
+        return odds_ratio, lower, upper
+
+    # Window of +/-15 approximate standard deviations of X around a, clipped to the support;
+    # at the interval bounds the mean of X moves only a few standard deviations from a
+    cells = observed[rows].reshape(-1, 4) + 0.5
+    sd = np.sqrt(1 / np.sum(1 / cells, axis=1))
+    half_width = np.ceil(15 * sd).astype(np.int64) + 20
+    start = np.maximum(lo[rows], a[rows] - half_width)
+    stop = np.minimum(hi[rows], a[rows] + half_width)
+    sizes = stop - start + 1
+
+    chunk_start = 0
+    while chunk_start < len(rows):
+        chunk_stop = chunk_start + max(1, int(np.searchsorted(
+            np.cumsum(sizes[chunk_start:]), _CHUNK_POINTS, side="right"
+        )))
+        chunk = slice(chunk_start, chunk_stop)
+        idx = rows[chunk]
+        theta = _solve_chunk(
+            a[idx], n1[idx], n2[idx], n[idx], start[chunk], sizes[chunk], sd[chunk], tail,
+            solve_mle[idx], solve_lower[idx], solve_upper[idx], log_factorials,
+        )
+        odds_ratio[idx] = np.where(solve_mle[idx], np.exp(theta[0]), odds_ratio[idx])
+        lower[idx] = np.where(solve_lower[idx], np.exp(theta[1]), lower[idx])
+        upper[idx] = np.where(solve_upper[idx], np.exp(theta[2]), upper[idx])
+        chunk_start = chunk_stop
+
+    return odds_ratio, lower, upper
+
+
+def _solve_chunk(
+    a: np.ndarray,
+    n1: np.ndarray,
+    n2: np.ndarray,
+    n: np.ndarray,
+    start: np.ndarray,
+    sizes: np.ndarray,
+    sd: np.ndarray,
+    tail: float,
+    solve_mle: np.ndarray,
+    solve_lower: np.ndarray,
+    solve_upper: np.ndarray,
+    log_factorials: LogFactorialTable,
+) -> np.ndarray:
+    """
+    Solve for log psi of the MLE, lower and upper bounds of every table in a chunk.
+
+    Returns:
+        (3, T) array of log odds ratios; rows are MLE, lower, upper
+    """
+    tables = len(a)
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    segment = np.repeat(np.arange(tables), sizes)
+    x = np.arange(sizes.sum()) - np.repeat(offsets, sizes) + np.repeat(start, sizes)
+
+    # Shared log weights log C(n1, x) + log C(n2, n - x), up to a per-table constant
+    log_weights = -(
+        log_factorials(x)
+        + log_factorials(np.repeat(n1, sizes) - x)
+        + log_factorials(np.repeat(n, sizes) - x)
+        + log_factorials(np.repeat(n2 - n, sizes) + x)
+    )
+    u = (x - np.repeat(a, sizes)).astype(np.float64)
+    at_or_above = u >= 0
+    at_or_below = u <= 0
+
+    # Start from the Haldane-corrected sample log odds ratio and its Woolf interval
+    from scipy import special
+
+    log_odds = np.log((a + 0.5) * (n2 - n + a + 0.5) / ((n1 - a + 0.5) * (n - a + 0.5)))
+    z = special.ndtri(1 - tail)
+    theta = np.stack([log_odds, log_odds - z / sd, log_odds + z / sd])
+    low = np.full((3, tables), -np.inf)
+    high = np.full((3, tables), np.inf)
+    active = np.stack([solve_mle, solve_lower, solve_upper])
+    log_tail = np.log(tail)
+
+    def segment_sum(values: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(values, offsets, axis=1)
+
+    for _ in range(_MAX_ITERATIONS):
+        if not active.any():
+            break
+
+        w = log_weights + theta[:, segment] * x
+        w -= np.maximum.reduceat(w, offsets, axis=1)[:, segment]
+        p = np.exp(w)
+        total = segment_sum(p)
+        mean = segment_sum(p * u) / total
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # MLE: E[U] = 0, derivative Var[U]
+            variance = segment_sum(p * u * u) / total - mean ** 2
+            upper_mass = segment_sum(np.where(at_or_above, p, 0.0))
+            lower_mass = segment_sum(np.where(at_or_below, p, 0.0))
+            # Lower bound: log P(X >= a) = log tail, derivative E[U | U >= 0] - E[U]
+            upper_mean = segment_sum(np.where(at_or_above, p * u, 0.0)) / upper_mass
+            # Upper bound: log P(X <= a) = log tail, derivative E[U | U <= 0] - E[U]
+            lower_mean = segment_sum(np.where(at_or_below, p * u, 0.0)) / lower_mass
+
+            value = np.stack([
+                mean[0],
+                np.log(upper_mass[1] / total[1]) - log_tail,
+                np.log(lower_mass[2] / total[2]) - log_tail,
+            ])
+            slope = np.stack([variance[0], upper_mean[1] - mean[1], lower_mean[2] - mean[2]])
+
+        # Every equation is monotone in theta: MLE and lower increase, upper decreases
+        increasing = np.array([[True], [True], [False]])
+        too_low = np.where(increasing, value < 0, value > 0)
+        low = np.where(active & too_low, np.maximum(low, theta), low)
+        high = np.where(active & ~too_low, np.minimum(high, theta), high)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = -value / slope
+        newton = np.isfinite(step)
+        converged = (value == 0) | (newton & (np.abs(step) < _TOLERANCE))
+        direction = np.where(too_low, 1.0, -1.0)
+        proposal = theta + np.where(newton, np.clip(step, -_MAX_STEP, _MAX_STEP), direction * _MAX_STEP)
+
+        # Fall back to bisection when Newton leaves the bracket
+        bracketed = np.isfinite(low) & np.isfinite(high)
+        outside = (proposal < low) | (proposal > high)
+        with np.errstate(invalid="ignore"):
+            proposal = np.where(bracketed & outside, (low + high) / 2, proposal)
+        converged |= bracketed & (high - low < _TOLERANCE)
+
+        theta = np.where(active & ~(value == 0), proposal, theta)
+        active &= ~converged
+
+    return theta
@@ -1,5 +1,7 @@
+from typing import Sequence, Union
+
 import numpy as np
-from contingency_stats.protocols import ContingencyTable
+from contingency_stats.protocols import CategoricalTable, ContingencyTable, StratifiedTable
 
 
 def create_contingency_typeddict(results: list) -> ContingencyTable:
@@ -13,19 +15,75 @@ def create_contingency_typeddict(results: list) -> ContingencyTable:
     )
 
 
-def table_to_array(table: ContingencyTable) -> np.ndarray:
+def table_to_array(table: Union[ContingencyTable, CategoricalTable, np.ndarray]) -> np.ndarray:
     """
-    Convert a contingency table dict to a 2x2 numpy array.
+    Convert a contingency table dict to a numpy array.
+
+    A 2x2 ContingencyTable gives the usual [[a, b], [c, d]] layout. Any other nested dict
+    (exposure level -> outcome level -> count, as built by CategoricalTableQuery) gives an
+    R x C array with rows and columns in the dict's order. Arrays are returned unchanged.
     """
-    return np.array([
-        [table["exposed"]["with_outcome"], table["exposed"]["without_outcome"]],
-        [table["unexposed"]["with_outcome"], table["unexposed"]["without_outcome"]]
-    ])
+    if isinstance(table, np.ndarray):
+        return table
+    if set(table) == {"exposed", "unexposed"} and set(table["exposed"]) == {"with_outcome", "without_outcome"}:
+        return np.array([
+            [table["exposed"]["with_outcome"], table["exposed"]["without_outcome"]],
+            [table["unexposed"]["with_outcome"], table["unexposed"]["without_outcome"]]
+        ])
+
+    columns = list(next(iter(table.values())))
+    return np.array([[row[column] for column in columns] for row in table.values()])
+
+
+def tables_to_array(
+    tables: Union[np.ndarray, Sequence[Union[ContingencyTable, CategoricalTable]]]
+) -> np.ndarray:
+    """
+    Convert a batch of contingency tables to an (N, R, C) int64 array.
+
+    Accepts either an array that already has that shape or a sequence of table dicts,
+    which must all have the same shape. 2x2 tables give an (N, 2, 2) array.
+    """
+    if isinstance(tables, np.ndarray):
+        observed = tables.astype(np.int64, copy=False)
+    elif len(tables) == 0:
+        observed = np.zeros((0, 2, 2), dtype=np.int64)
+    else:
+        observed = np.array([table_to_array(table) for table in tables], dtype=np.int64)
+
+    if observed.ndim != 3 or min(observed.shape[1:]) < 2:
+        raise ValueError(f"Expected an (N, R, C) array of tables with R, C >= 2, got shape {observed.shape}")
+    if np.any(observed < 0):
+        raise ValueError("Contingency table counts must be non-negative")
+    return observed
+
+
+def stratified_tables_to_array(tables: Union[np.ndarray, Sequence[StratifiedTable]]) -> np.ndarray:
+    """
+    Convert a batch of stratified 2x2 tables to an (N, K, 2, 2) int64 array.
+
+    Accepts either an array that already has that shape or a sequence of StratifiedTable
+    dicts, which must all have the same number of strata; strata keep their dict order.
+    """
+    if isinstance(tables, np.ndarray):
+        observed = tables.astype(np.int64, copy=False)
+    elif len(tables) == 0:
+        observed = np.zeros((0, 1, 2, 2), dtype=np.int64)
+    else:
+        observed = np.array(
+            [[table_to_array(stratum) for stratum in table.values()] for table in tables], dtype=np.int64
+        )
+
+    if observed.ndim != 4 or observed.shape[2:] != (2, 2):
+        raise ValueError(f"Expected an (N, K, 2, 2) array of stratified tables, got shape {observed.shape}")
+    if np.any(observed < 0):
+        raise ValueError("Contingency table counts must be non-negative")
+    return observed
 
 
 def calculate_expected_values(observed: np.ndarray) -> np.ndarray:
     """
-    Calculate expected values for a 2x2 contingency table.
+    Calculate expected values for an R x C contingency table.
     """
     row_sums = observed.sum(axis=1, keepdims=True)
     col_sums = observed.sum(axis=0, keepdims=True)
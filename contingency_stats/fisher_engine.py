@@ -0,0 +1,501 @@
+"""
+Fisher's exact test engine for large and repeated 2x2 tables.
+
+Conditioned on its margins, the top-left count of a 2x2 table is hypergeometric. For
+margins shared by several tables (or seen before), the engine evaluates that
+distribution once and caches its cumulative tails, so every table sharing those margins
+is answered with a lookup. Tables whose margins are unique within a batch are evaluated
+all at once by the vectorised path instead, which costs no Python work per table.
+
+Vectorised path
+    scipy's hypergeometric cdf / sf for every table at once; for the two-sided test the
+    opposite tail is located with an element-wise binary search over the log-space pmf,
+    as `scipy.stats.fisher_exact` does table by table.
+
+Exact path
+    The pmf is built from the mode outwards by the ratio recurrence
+    p(x + 1) / p(x) = (n1 - x)(n - x) / ((x + 1)(n2 - n + x + 1)), then normalised, which
+    keeps full relative precision even for population-scale counts. Only the window
+    where p(x) is within a factor of exp(-112.5) of the mode is enumerated, about +/-15
+    standard deviations as in `conditional_odds_ratio`. Counts so unlikely that the mass
+    outside the window is not negligible next to their own probability (p-values below
+    about 1e-36) are passed to the vectorised path. The window edges are found by
+    bisection on a growable table of log-factorials.
+
+Asymptotic path
+    When that window is wider than `exact_support_limit` points (standard deviations in
+    the thousands, i.e. totals in the tens of millions), enumeration no longer adds
+    anything. Tail sums are then taken as continuity-corrected integrals of the
+    continuous (log-gamma) pmf with adaptive quadrature.
+
+Tolerance against `scipy.stats.fisher_exact`
+    Exact path: relative difference below 1e-8 for p-values above 1e-300; smaller
+    p-values may underflow to 0 (as scipy's do). Asymptotic path: relative difference
+    below 1e-4. As in R's fisher.test, table probabilities within a relative 1e-7 of the
+    observed one count as ties in the two-sided test.
+
+scipy is imported on first use, so importing this module only requires numpy.
+"""
+import threading
+import warnings
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Literal, Optional, Tuple, Union
+
+import numpy as np
+
+Alternative = Literal["two-sided", "greater", "less"]
+
+# Relative tolerance (in log space) under which two table probabilities count as equal.
+# Matches R's fisher.test; scipy uses 1e-14 on boost's pmf.
+LOG_TIE_TOLERANCE = 1e-7
+
+# Outcomes less likely than the mode by more than this (in log space) are not enumerated:
+# +/-15 standard deviations of the normal approximation
+_LOG_WINDOW = 0.5 * 15 ** 2
+
+# Observed outcomes less likely than the mode by more than this are answered by the
+# vectorised path, as the mass outside the window is no longer below 1e-13 of their own
+_LOG_TRUSTED = _LOG_WINDOW - 30.0
+
+
+def _log_gamma(x: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    """scipy's log-gamma, imported on first use"""
+    from scipy.special import gammaln
+
+    return gammaln(x)
+
+
+class LogFactorialTable:
+    """
+    Table of log(k!) that grows on demand, doubling up to `max_size` entries.
+
+    Lookups beyond `max_size` fall back to log-gamma. Safe to share between threads:
+    growth swaps in a new array, so concurrent readers keep a consistent view.
+    """
+
+    def __init__(self, initial_size: int = 1 << 16, max_size: int = 1 << 22):
+        self.max_size = max_size
+        self._values = _log_gamma(np.arange(min(initial_size, max_size), dtype=np.float64) + 1)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def grow(self, size: int) -> None:
+        """Ensure the table covers 0..size-1 (capped at `max_size`)"""
+        with self._lock:
+            current = len(self._values)
+            if size <= current:
+                return
+            new_size = min(max(size, 2 * current), self.max_size)
+            extension = _log_gamma(np.arange(current, new_size, dtype=np.float64) + 1)
+            self._values = np.concatenate([self._values, extension])
+
+    def __call__(self, k: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        """log(k!) for a non-negative integer or integer array"""
+        if isinstance(k, int):
+            if k < len(self._values):
+                return float(self._values[k])
+            top = k
+        else:
+            top = int(np.max(k))
+        if top >= len(self._values):
+            if top >= self.max_size:
+                return _log_gamma(np.asarray(k, dtype=np.float64) + 1)
+            self.grow(top + 1)
+        return self._values[k]
+
+
+@dataclass(frozen=True)
+class _ExactTails:
+    """Normalised log pmf and cumulative tail sums over the enumerated window [lo, lo + len)."""
+
+    lo: int
+    mode_index: int
+    log_pmf: np.ndarray
+    cdf: np.ndarray  # P(X <= lo + i)
+    sf: np.ndarray  # P(X >= lo + i)
+
+    @property
+    def size(self) -> int:
+        return len(self.log_pmf)
+
+
+@dataclass(frozen=True)
+class _AsymptoticMargins:
+    """Window and normalising integral of the continuous pmf for very wide supports."""
+
+    n1: int
+    n2: int
+    n: int
+    lo: int
+    hi: int
+    mode: int
+    log_mode: float
+    log_total: float
+
+    size = 1
+
+    def log_f(self, x: float) -> float:
+        """Unnormalised continuous log pmf"""
+        from scipy.special import gammaln
+
+        return -(
+            gammaln(x + 1)
+            + gammaln(self.n1 - x + 1)
+            + gammaln(self.n - x + 1)
+            + gammaln(self.n2 - self.n + x + 1)
+        )
+
+    def log_integral(self, start: float, stop: float, anchor: float) -> float:
+        """log of the integral of the pmf over [start, stop], scaled around `anchor`"""
+        from scipy import integrate
+
+        if stop <= start:
+            return -np.inf
+        log_anchor = self.log_f(anchor)
+        with warnings.catch_warnings():
+            # quad flags roundoff once the relative tolerance is within log-gamma precision
+            warnings.simplefilter("ignore", integrate.IntegrationWarning)
+            value, _ = integrate.quad(
+                lambda x: np.exp(self.log_f(x) - log_anchor),
+                start, stop, epsabs=0.0, epsrel=1e-10, limit=200,
+            )
+        return log_anchor + np.log(value) if value > 0 else -np.inf
+
+    def log_lower(self, x: int) -> float:
+        """log P(X <= x)"""
+        return self.log_integral(self.lo - 0.5, x + 0.5, min(x + 0.5, self.mode)) - self.log_total
+
+    def log_upper(self, x: int) -> float:
+        """log P(X >= x)"""
+        return self.log_integral(x - 0.5, self.hi + 0.5, max(x - 0.5, self.mode)) - self.log_total
+
+
+class FisherEngine:
+    """
+    Fisher's exact test p-values with per-margin caching.
+
+    In a batch, only margins shared by several tables, or already cached, go through the
+    cache; the rest are evaluated by the vectorised path. Caches are bounded by the total
+    number of enumerated support points they hold and evicted least-recently-used first.
+    The engine is thread-safe; share one instance (see `default_fisher_engine`) so tables
+    with common margins reuse each other's work.
+
+    Args:
+        exact_support_limit: Widest window enumerated exactly before switching to the
+            asymptotic path
+        cache_points: Maximum number of support points held in the tail cache
+        log_factorials: Log-factorial table to use (default: a new LogFactorialTable)
+    """
+
+    def __init__(
+        self,
+        exact_support_limit: int = 200_000,
+        cache_points: int = 4_000_000,
+        log_factorials: Optional[LogFactorialTable] = None,
+    ):
+        self.exact_support_limit = exact_support_limit
+        self.cache_points = cache_points
+        self.log_factorials = log_factorials or LogFactorialTable()
+        self._cache: "OrderedDict[Tuple[int, int, int], Union[_ExactTails, _AsymptoticMargins]]" = OrderedDict()
+        self._cached_points = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def p_value(self, table: np.ndarray, alternative: Alternative = "two-sided") -> float:
+        """p-value for a single 2x2 table, whose margins are cached for later calls"""
+        observed = np.asarray(table, dtype=np.int64).reshape(1, 2, 2)
+        return float(self._p_values(observed, alternative, min_repeats=1)[0])
+
+    def p_values(self, observed: np.ndarray, alternative: Alternative = "two-sided") -> np.ndarray:
+        """
+        p-values for an (N, 2, 2) array of tables.
+
+        Args:
+            observed: (N, 2, 2) array of non-negative counts
+            alternative: Type of hypothesis test ('two-sided', 'greater', or 'less')
+
+        Returns:
+            Array of N p-values
+        """
+        return self._p_values(observed, alternative, min_repeats=2)
+
+    def _p_values(self, observed: np.ndarray, alternative: Alternative, min_repeats: int) -> np.ndarray:
+        """p-values, through the cache for margins of at least `min_repeats` tables or already cached"""
+        if alternative not in ("two-sided", "less", "greater"):
+            raise ValueError("`alternative` should be one of {'two-sided', 'less', 'greater'}")
+
+        observed = np.asarray(observed, dtype=np.int64)
+        a = observed[:, 0, 0]
+        n1 = observed[:, 0, 0] + observed[:, 0, 1]
+        n2 = observed[:, 1, 0] + observed[:, 1, 1]
+        n = observed[:, 0, 0] + observed[:, 1, 0]
+
+        # Tables with an empty row or column carry no information; scipy reports p = 1
+        p_values = np.ones(len(observed), dtype=np.float64)
+        live = np.flatnonzero((n1 > 0) & (n2 > 0) & (n > 0) & (n < n1 + n2))
+        if len(live) == 0:
+            return p_values
+
+        margins, inverse, counts = np.unique(
+            np.stack([n1[live], n2[live], n[live]], axis=1), axis=0, return_inverse=True, return_counts=True
+        )
+        inverse = inverse.ravel()
+        keys = margins.tolist()
+        with self._lock:
+            cached = np.fromiter((tuple(key) in self._cache for key in keys), dtype=bool, count=len(keys))
+        shared = np.flatnonzero((counts >= min_repeats) | cached)
+
+        # Margins of a single table are cheaper to evaluate together than to cache one by one
+        vectorised = np.ones(len(live), dtype=bool)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(margins) + 1))
+        for i in shared.tolist():
+            positions = order[bounds[i]:bounds[i + 1]]
+            rows = live[positions]
+            tails = self._margin_tails(*keys[i])
+            if isinstance(tails, _ExactTails):
+                p = _exact_p_values(tails, a[rows], alternative)
+                p_values[rows] = p
+                vectorised[positions] = np.isnan(p)
+            else:
+                p_values[rows] = [_asymptotic_p_value(tails, x, alternative) for x in a[rows].tolist()]
+                vectorised[positions] = False
+
+        rows = live[vectorised]
+        if len(rows):
+            p_values[rows] = _vectorised_p_values(a[rows], n1[rows], n2[rows], n[rows], alternative)
+        return np.minimum(p_values, 1.0)
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._cached_points = 0
+
+    def _margin_tails(self, n1: int, n2: int, n: int) -> Union[_ExactTails, _AsymptoticMargins]:
+        key = (n1, n2, n)
+        with self._lock:
+            tails = self._cache.get(key)
+            if tails is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return tails
+            self.misses += 1
+
+        tails = self._compute_tails(n1, n2, n)
+
+        with self._lock:
+            if key not in self._cache and tails.size <= self.cache_points:
+                self._cache[key] = tails
+                self._cached_points += tails.size
+                while self._cached_points > self.cache_points:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_points -= evicted.size
+        return tails
+
+    def _compute_tails(self, n1: int, n2: int, n: int) -> Union[_ExactTails, _AsymptoticMargins]:
+        support_lo = max(0, n - n2)
+        support_hi = min(n1, n)
+        mode = min(max((n + 1) * (n1 + 1) // (n1 + n2 + 2), support_lo), support_hi)
+
+        lf = self.log_factorials
+
+        def log_f(x: int) -> float:
+            return -(lf(x) + lf(n1 - x) + lf(n - x) + lf(n2 - n + x))
+
+        log_mode = log_f(mode)
+        cutoff = log_mode - _LOG_WINDOW
+
+        lo = _window_edge(log_f, cutoff, support_lo, mode)
+        hi = _window_edge(log_f, cutoff, support_hi, mode)
+
+        if hi - lo + 1 > self.exact_support_limit:
+            margins = _AsymptoticMargins(n1, n2, n, lo, hi, mode, log_mode, 0.0)
+            log_total = margins.log_integral(lo - 0.5, hi + 0.5, mode)
+            return _AsymptoticMargins(n1, n2, n, lo, hi, mode, log_mode, log_total)
+
+        # log p(x + 1) - log p(x) for x in [lo, hi), accumulated outward from the window edge
+        x = np.arange(lo, hi, dtype=np.float64)
+        log_ratios = np.log((n1 - x) * (n - x)) - np.log((x + 1) * (n2 - n + x + 1))
+        log_pmf = np.concatenate([[0.0], np.cumsum(log_ratios)])
+        peak = log_pmf.max()
+        log_pmf -= peak + np.log(np.exp(log_pmf - peak).sum())
+
+        # Summing each tail from its far end keeps full relative precision in the tails
+        pmf = np.exp(log_pmf)
+        return _ExactTails(
+            lo=lo,
+            mode_index=int(np.argmax(log_pmf)),
+            log_pmf=log_pmf,
+            cdf=np.minimum(np.cumsum(pmf), 1.0),
+            sf=np.minimum(np.cumsum(pmf[::-1])[::-1], 1.0),
+        )
+
+
+def _window_edge(log_f, cutoff: float, edge: int, mode: int) -> int:
+    """Outermost point between `edge` and `mode` with log_f(x) >= cutoff (log_f is unimodal)"""
+    if log_f(edge) >= cutoff:
+        return edge
+    inside, outside = mode, edge
+    while abs(inside - outside) > 1:
+        mid = (inside + outside) // 2
+        if log_f(mid) >= cutoff:
+            inside = mid
+        else:
+            outside = mid
+    return inside
+
+
+def _exact_p_values(tails: _ExactTails, a: np.ndarray, alternative: Alternative) -> np.ndarray:
+    """p-values for counts `a` sharing the margins of `tails`; NaN for counts too unlikely to answer"""
+    index = a - tails.lo
+    size = tails.size
+    clipped = np.clip(index, 0, size - 1)
+    m = tails.mode_index
+    trusted = (index >= 0) & (index < size) & (tails.log_pmf[clipped] >= tails.log_pmf[m] - _LOG_TRUSTED)
+
+    # One-sided p-values are only small, and so only need the fallback, on their own side
+    if alternative == "less":
+        p = np.where(index >= size, 1.0, tails.cdf[clipped])
+        return np.where(trusted | (index > m), p, np.nan)
+    if alternative == "greater":
+        p = np.where(index < 0, 1.0, tails.sf[clipped])
+        return np.where(trusted | (index < m), p, np.nan)
+
+    # Two-sided: sum every outcome no more likely than the observed one. Left of the mode
+    # the pmf rises and right of it falls, so those outcomes form one tail on each side.
+    threshold = tails.log_pmf[clipped] + LOG_TIE_TOLERANCE
+    rising = tails.log_pmf[:m]
+    falling = tails.log_pmf[m:][::-1]
+
+    n_lower = np.searchsorted(rising, threshold, side="right")
+    n_upper = np.searchsorted(falling, threshold, side="right")
+    lower = np.where(n_lower > 0, tails.cdf[np.maximum(n_lower - 1, 0)], 0.0)
+    upper = np.where(n_upper > 0, tails.sf[np.minimum(size - n_upper, size - 1)], 0.0)
+
+    p = np.where(threshold >= tails.log_pmf[m], 1.0, lower + upper)
+    return np.where(trusted, p, np.nan)
+
+
+def _vectorised_p_values(
+    a: np.ndarray, n1: np.ndarray, n2: np.ndarray, n: np.ndarray, alternative: Alternative
+) -> np.ndarray:
+    """p-values of tables with non-degenerate margins, all at once through scipy's hypergeometric distribution"""
+    from scipy.stats import hypergeom
+
+    total = n1 + n2
+    if alternative == "less":
+        return hypergeom.cdf(a, total, n1, n)
+    if alternative == "greater":
+        return hypergeom.sf(a - 1, total, n1, n)
+
+    mode = (n + 1) * (n1 + 1) // (total + 2)
+    log_exact = _hypergeom_logpmf(a, total, n1, n)
+    threshold = log_exact + LOG_TIE_TOLERANCE
+    p_values = np.ones(len(a), dtype=np.float64)
+    at_mode = _hypergeom_logpmf(mode, total, n1, n) - log_exact <= LOG_TIE_TOLERANCE
+
+    # Observed count below the mode: lower tail plus the matching part of the upper tail
+    lower = ~at_mode & (a < mode)
+    if np.any(lower):
+        M, K, N, t = total[lower], n1[lower], n[lower], threshold[lower]
+        p_lower = hypergeom.cdf(a[lower], M, K, N)
+        guess = _vectorised_binary_search(lambda x: -_hypergeom_logpmf(x, M, K, N), -t, mode[lower], N)
+        no_upper = _hypergeom_logpmf(N, M, K, N) > t
+        p_values[lower] = np.where(no_upper, p_lower, p_lower + hypergeom.sf(guess, M, K, N))
+
+    # Observed count at or above the mode: upper tail plus the matching part of the lower tail
+    upper = ~at_mode & (a >= mode)
+    if np.any(upper):
+        M, K, N, t = total[upper], n1[upper], n[upper], threshold[upper]
+        p_upper = hypergeom.sf(a[upper] - 1, M, K, N)
+        guess = _vectorised_binary_search(lambda x: _hypergeom_logpmf(x, M, K, N), t, np.zeros_like(N), mode[upper])
+        no_lower = _hypergeom_logpmf(np.zeros_like(N), M, K, N) > t
+        p_values[upper] = np.where(no_lower, p_upper, p_upper + hypergeom.cdf(guess, M, K, N))
+
+    return p_values
+
+
+def _hypergeom_logpmf(x: np.ndarray, total: np.ndarray, n1: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """Log hypergeometric pmf via log-gamma, -inf outside the support"""
+    in_support = (x >= np.maximum(0, n - (total - n1))) & (x <= np.minimum(n1, n))
+    x = np.where(in_support, x, 0)
+    log_pmf = _log_binom(n1, x) + _log_binom(total - n1, np.where(in_support, n - x, 0)) - _log_binom(total, n)
+    return np.where(in_support, log_pmf, -np.inf)
+
+
+def _log_binom(n: np.ndarray, k: np.ndarray) -> np.ndarray:
+    return _log_gamma(n + 1) - _log_gamma(k + 1) - _log_gamma(n - k + 1)
+
+
+def _vectorised_binary_search(
+    fn: Callable[[np.ndarray], np.ndarray], target: np.ndarray, lo: np.ndarray, hi: np.ndarray
+) -> np.ndarray:
+    """
+    Element-wise binary search for the index i in [lo, hi] with fn(i) <= target < fn(i + 1).
+
+    fn must be ascending on [lo, hi] for every element. Mirrors the search scipy uses in
+    `fisher_exact` to locate the opposite tail.
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    while np.any(lo < hi):
+        mid = lo + (hi - lo) // 2
+        midval = fn(mid)
+        below = midval < target
+        above = midval > target
+        equal = midval == target
+        lo = np.where(below, mid + 1, np.where(equal, mid, lo))
+        hi = np.where(above, mid - 1, np.where(equal, mid, hi))
+    return np.where(fn(lo) <= target, lo, lo - 1)
+
+
+def _asymptotic_p_value(margins: _AsymptoticMargins, a: int, alternative: Alternative) -> float:
+    """p-value for one count from continuity-corrected integrals of the continuous pmf"""
+    from scipy import optimize
+
+    if alternative == "less":
+        if a >= margins.mode:
+            return 1.0 - float(np.exp(margins.log_upper(a + 1)))
+        return float(np.exp(margins.log_lower(a)))
+    if alternative == "greater":
+        if a <= margins.mode:
+            return 1.0 - float(np.exp(margins.log_lower(a - 1)))
+        return float(np.exp(margins.log_upper(a)))
+
+    threshold = margins.log_f(a) + LOG_TIE_TOLERANCE
+    if threshold >= margins.log_mode:
+        return 1.0
+
+    if a < margins.mode:
+        own = margins.log_lower(a)
+        far_edge = min(margins.n1, margins.n)
+        if margins.log_f(far_edge) > threshold:
+            return float(np.exp(own))
+        crossing = optimize.brentq(lambda x: margins.log_f(x) - threshold, margins.mode, far_edge)
+        opposite = margins.log_upper(int(np.ceil(crossing)))
+    else:
+        own = margins.log_upper(a)
+        far_edge = max(0, margins.n - margins.n2)
+        if margins.log_f(far_edge) > threshold:
+            return float(np.exp(own))
+        crossing = optimize.brentq(lambda x: margins.log_f(x) - threshold, far_edge, margins.mode)
+        opposite = margins.log_lower(int(np.floor(crossing)))
+
+    return float(np.exp(np.logaddexp(own, opposite)))
+
+
+_default_engine: Optional[FisherEngine] = None
+_default_engine_lock = threading.Lock()
+
+
+def default_fisher_engine() -> FisherEngine:
+    """Return the process-wide FisherEngine, creating it on first use"""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = FisherEngine()
+        return _default_engine
@@ -0,0 +1,122 @@
+"""
+Fisher's exact test for R x C tables (the Freeman-Halton extension).
+
+Conditioned on its margins, an R x C table has probability proportional to
+1 / prod(x_ij!). The two-sided p-value is the total probability of the tables with the
+same margins that are no more likely than the observed one, with the same tie tolerance
+as the 2x2 FisherEngine (see `contingency_stats.fisher_engine.LOG_TIE_TOLERANCE`).
+
+Exact path
+    Every table with the observed margins is enumerated, a cell at a time, as a set of
+    partial tables held in NumPy arrays: each step expands every partial table by all
+    counts its next cell can take given the remaining row and column sums, and the last
+    row of each column and the last column are fixed by the margins. The number of
+    tables grows quickly with the counts and the table size, so enumeration stops once
+    it passes `max_tables` and the caller falls back to Monte Carlo.
+
+Monte Carlo path
+    The statistic -sum(log x_ij!) is evaluated on random tables with the observed
+    margins (see `contingency_stats.monte_carlo`), as R's fisher.test does with
+    simulate.p.value = TRUE.
+"""
+from typing import Optional
+
+import numpy as np
+
+from contingency_stats.fisher_engine import LOG_TIE_TOLERANCE, LogFactorialTable
+from contingency_stats.monte_carlo import DEFAULT_SIMULATIONS, monte_carlo_p_value, simulated_statistics
+
+DEFAULT_MAX_TABLES = 1_000_000
+
+
+def fisher_rxc_exact_p_value(
+    observed: np.ndarray,
+    max_tables: int = DEFAULT_MAX_TABLES,
+    log_factorials: Optional[LogFactorialTable] = None,
+) -> Optional[float]:
+    """
+    Two-sided exact p-value for an R x C table by complete enumeration.
+
+    Args:
+        observed: R x C array of non-negative counts
+        max_tables: Give up once more than this many (partial) tables are needed
+        log_factorials: Log-factorial table to share (default: a new LogFactorialTable)
+
+    Returns:
+        The p-value, or None if enumeration would exceed `max_tables`
+    """
+    log_factorials = log_factorials or LogFactorialTable()
+    observed = np.asarray(observed, dtype=np.int64)
+    # Rows and columns with no patients do not change the distribution
+    observed = observed[observed.sum(axis=1) > 0][:, observed.sum(axis=0) > 0]
+    if min(observed.shape) < 2:
+        return 1.0
+    # Enumerate along the longer side so each column has as few free cells as possible
+    if observed.shape[0] > observed.shape[1]:
+        observed = observed.T
+
+    rows = observed.shape[0]
+    column_sums = observed.sum(axis=0)
+    remaining = observed.sum(axis=1)[None, :].copy()
+    log_weight = np.zeros(1)
+
+    for column_sum in column_sums[:-1]:
+        column_left = np.full(1, column_sum, dtype=np.int64).repeat(len(remaining))
+        for row in range(rows - 1):
+            capacity = remaining[:, row + 1:].sum(axis=1)
+            low = np.maximum(0, column_left - capacity)
+            high = np.minimum(remaining[:, row], column_left)
+            sizes = high - low + 1
+            total = int(sizes.sum())
+            if total > max_tables:
+                return None
+
+            parent = np.repeat(np.arange(len(remaining)), sizes)
+            offsets = np.cumsum(sizes) - sizes
+            x = low[parent] + np.arange(total) - offsets[parent]
+            remaining = remaining[parent]
+            remaining[:, row] -= x
+            column_left = column_left[parent] - x
+            log_weight = log_weight[parent] - log_factorials(x)
+
+        # The last row takes whatever is left of the column
+        remaining[:, rows - 1] -= column_left
+        log_weight -= log_factorials(column_left)
+
+    # The last column takes whatever is left of each row
+    log_weight -= log_factorials(remaining).sum(axis=1)
+
+    observed_log_weight = -float(log_factorials(observed.ravel()).sum())
+    peak = log_weight.max()
+    weights = np.exp(log_weight - peak)
+    as_extreme = log_weight <= observed_log_weight + LOG_TIE_TOLERANCE
+    return float(min(1.0, weights[as_extreme].sum() / weights.sum()))
+
+
+def fisher_rxc_monte_carlo_p_value(
+    observed: np.ndarray,
+    n_simulations: int = DEFAULT_SIMULATIONS,
+    seed: Optional[int] = None,
+    log_factorials: Optional[LogFactorialTable] = None,
+) -> float:
+    """
+    Two-sided Monte Carlo p-value for an R x C table.
+
+    Args:
+        observed: R x C array of non-negative counts
+        n_simulations: Number of random tables with the observed margins
+        seed: Seed for the random tables (default: fresh entropy)
+        log_factorials: Log-factorial table to share (default: a new LogFactorialTable)
+
+    Returns:
+        The p-value, resolved to 1 / (n_simulations + 1)
+    """
+    log_factorials = log_factorials or LogFactorialTable()
+    observed = np.asarray(observed, dtype=np.int64)
+
+    # Less likely tables have a larger sum of log-factorials
+    def statistic(tables: np.ndarray) -> np.ndarray:
+        return log_factorials(tables.reshape(len(tables), -1)).sum(axis=1)
+
+    simulated = simulated_statistics(observed, statistic, n_simulations, seed)
+    return monte_carlo_p_value(float(statistic(observed[None])[0]), simulated)
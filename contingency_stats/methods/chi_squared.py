@@ -1,51 +1,130 @@
-from scipy import stats
+from typing import Optional, Sequence, Union
+
 import numpy as np
 
-from contingency_stats.protocols import ContingencyTable, ContingencyTestProtocol
+from contingency_stats.monte_carlo import DEFAULT_SIMULATIONS, monte_carlo_p_value, simulated_statistics
+from contingency_stats.protocols import CategoricalTable, ContingencyTable, ContingencyTestProtocol
+from contingency_stats.result_frame import ResultFrame
 from contingency_stats.result_schemas import ChiSquaredResult
-from contingency_stats.contingency_utils import table_to_array, calculate_expected_values, format_p_value
+from contingency_stats.contingency_utils import (
+    table_to_array,
+    tables_to_array,
+    calculate_expected_values,
+    format_p_value,
+)
+
+
+def chi_squared_statistics(observed: np.ndarray, yates_correction: bool = False) -> np.ndarray:
+    """
+    Pearson chi-squared statistics for an (N, R, C) array of tables.
+
+    Yates' correction is only applied to tables with one degree of freedom, as in
+    `scipy.stats.chi2_contingency`. Tables with an expected count of zero get NaN.
+    """
+    observed = observed.astype(np.float64)
+    n = observed.sum(axis=(1, 2))
+    row_sums = observed.sum(axis=2, keepdims=True)
+    col_sums = observed.sum(axis=1, keepdims=True)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = row_sums * col_sums / n[:, None, None]
+
+        if yates_correction and observed.shape[1:] == (2, 2):
+            # Same adjustment as scipy: move each observed count up to 0.5 towards its expected value
+            diff = expected - observed
+            observed = observed + np.sign(diff) * np.minimum(0.5, np.abs(diff))
+
+        chi2 = ((observed - expected) ** 2 / expected).sum(axis=(1, 2))
+    valid = np.all(expected > 0, axis=(1, 2))
+    return np.where(valid, chi2, np.nan)
 
 
 class ChiSquaredTest(ContingencyTestProtocol[ChiSquaredResult]):
-    """Chi-squared test implementation for 2x2 contingency tables."""
+    """Chi-squared test implementation for 2x2 and R x C contingency tables."""
 
-    def __init__(self, alpha: float = 0.05, yates_correction: bool = False):
+    def __init__(
+        self,
+        alpha: float = 0.05,
+        yates_correction: bool = False,
+        simulate_p_value: bool = False,
+        n_simulations: int = DEFAULT_SIMULATIONS,
+        seed: Optional[int] = None,
+    ):
         """
         Initialise the Chi-squared test.
 
         Args:
             alpha: Significance level (default: 0.05)
+            yates_correction: Apply Yates' continuity correction (2x2 tables only)
+            simulate_p_value: Compute the p-value by Monte Carlo over random tables with the
+                observed margins instead of from the chi-squared distribution, for tables
+                with small expected counts
+            n_simulations: Number of random tables when simulating (default: 10,000)
+            seed: Seed for the random tables, for reproducible p-values
         """
         self.alpha = alpha
         self.test_name = "Chi-squared Test"
         self.yates_correction = yates_correction
+        self.simulate_p_value = simulate_p_value
+        self.n_simulations = n_simulations
+        self.seed = seed
 
-    def calculate(self, table: ContingencyTable) -> ChiSquaredResult:
+    def calculate(self, table: Union[ContingencyTable, CategoricalTable]) -> ChiSquaredResult:
         """
         Calculate Chi-squared statistic and p-value for the contingency table.
         Calculate Cramér's V as a measure of the strength of association.
 
         Args:
-            table: A 2x2 contingency table with the structure from ContingencyTableQuery
+            table: A 2x2 contingency table with the structure from ContingencyTableQuery,
+                or an R x C table from CategoricalTableQuery
 
         Returns:
             ChiSquaredResult with test results
         """
+        from scipy import stats
+
         observed = table_to_array(table)
         expected = calculate_expected_values(observed)
 
         chi2, p, dof, _ = stats.chi2_contingency(
             observed, correction=self.yates_correction
         )
+        if self.simulate_p_value:
+            p = self._simulated_p_value(observed, chi2)
 
         n = observed.sum()
         cramers_v = np.sqrt(chi2 / (n * (min(observed.shape) - 1)))
 
+        return self._build_result(observed, expected, chi2, p, dof, cramers_v)
+
+    def _simulated_p_value(self, observed: np.ndarray, chi2: float) -> float:
+        """Monte Carlo p-value of the chi-squared statistic given the observed margins"""
+        if np.isnan(chi2):
+            return float("nan")
+        simulated = simulated_statistics(
+            observed,
+            lambda tables: chi_squared_statistics(tables, self.yates_correction),
+            self.n_simulations,
+            self.seed,
+        )
+        return monte_carlo_p_value(chi2, simulated)
+
+    def _build_result(
+        self,
+        observed: np.ndarray,
+        expected: np.ndarray,
+        chi2: float,
+        p: float,
+        dof: int,
+        cramers_v: float,
+    ) -> ChiSquaredResult:
+        """Assemble the result model, including its interpretation, for one table"""
         interpretation = (
             f"There is {'no ' if p >= self.alpha else ''}statistically significant association between exposure and outcome "
             f"({format_p_value(p)}). Chi-squared statistic: {chi2:.2f}, df={dof}" +
             (" (with Yates' correction)" if self.yates_correction else "") +
-            f". Cramér's V: {cramers_v:.2f}"
+            f". Cramér's V: {cramers_v:.2f}" +
+            (f" (p-value simulated from {self.n_simulations} random tables)" if self.simulate_p_value else "")
         )
 
         return ChiSquaredResult(
@@ -59,5 +138,62 @@ class ChiSquaredTest(ContingencyTestProtocol[ChiSquaredResult]):
             alpha=self.alpha,
             expected_values=expected.tolist(),
             yates_correction_applied=self.yates_correction,
-            additional_info={"observed_values": observed.tolist()}
+            additional_info={
+                "observed_values": observed.tolist(),
+                "p_value_method": "monte_carlo" if self.simulate_p_value else "asymptotic",
+                **({"n_simulations": self.n_simulations} if self.simulate_p_value else {}),
+            }
+        )
+
+    def _frame_row(self, frame: ResultFrame, index: int) -> ChiSquaredResult:
+        observed = frame.observed[index]
+        return self._build_result(
+            observed,
+            calculate_expected_values(observed),
+            float(frame["test_statistic"][index]),
+            float(frame["p_value"][index]),
+            int(frame["degrees_of_freedom"][index]),
+            float(frame["cramers_v"][index]),
         )
+
+    def calculate_batch(
+        self, tables: Union[np.ndarray, Sequence[Union[ContingencyTable, CategoricalTable]]]
+    ) -> ResultFrame:
+        """
+        Calculate the Chi-squared test for many tables of the same shape at once.
+
+        Produces the same numbers as calling `calculate` on each table. Tables with an
+        expected count of zero, which `calculate` rejects, get NaN statistics.
+        `frame.row(i)` builds the ChiSquaredResult on demand. Simulated p-values are
+        drawn table by table, each with the test's seed.
+
+        Args:
+            tables: An (N, R, C) array of counts, or a sequence of table dicts
+
+        Returns:
+            ResultFrame with columns test_statistic, p_value, is_significant,
+            degrees_of_freedom and cramers_v
+        """
+        counts = tables_to_array(tables)
+        n = counts.sum(axis=(1, 2))
+        dof = (counts.shape[1] - 1) * (counts.shape[2] - 1)
+
+        chi2 = chi_squared_statistics(counts, self.yates_correction)
+        if self.simulate_p_value:
+            p_values = np.array([self._simulated_p_value(table, stat) for table, stat in zip(counts, chi2)])
+        else:
+            from scipy import special
+
+            # chdtrc is the chi-squared survival function, without loading scipy.stats
+            p_values = special.chdtrc(dof, chi2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cramers_v = np.sqrt(chi2 / (n * (min(counts.shape[1:]) - 1)))
+
+        columns = {
+            "test_statistic": chi2,
+            "p_value": p_values,
+            "is_significant": p_values < self.alpha,
+            "degrees_of_freedom": np.full(len(chi2), dof, dtype=np.int64),
+            "cramers_v": cramers_v,
+        }
+        return ResultFrame(columns, counts, self._frame_row)
@@ -1,16 +1,92 @@
-from typing import Tuple, Literal
+from typing import Optional, Sequence, Tuple, Literal, Union
 import numpy as np
-from scipy import stats
 
-from contingency_stats.protocols import ContingencyTable, ContingencyTestProtocol
+from contingency_stats.conditional_odds_ratio import conditional_odds_ratio
+from contingency_stats.fisher_engine import FisherEngine, default_fisher_engine
+from contingency_stats.fisher_rxc import (
+    DEFAULT_MAX_TABLES,
+    fisher_rxc_exact_p_value,
+    fisher_rxc_monte_carlo_p_value,
+)
+from contingency_stats.monte_carlo import DEFAULT_SIMULATIONS
+from contingency_stats.protocols import CategoricalTable, ContingencyTable, ContingencyTestProtocol
+from contingency_stats.result_frame import ResultFrame
 from contingency_stats.result_schemas import FishersExactResult
-from contingency_stats.contingency_utils import table_to_array, format_p_value
+from contingency_stats.contingency_utils import table_to_array, tables_to_array, format_p_value
+
+
+def fisher_exact_pvalues(
+    observed: np.ndarray, alternative: Literal["two-sided", "greater", "less"] = "two-sided"
+) -> np.ndarray:
+    """
+    Fisher's exact test p-values for an (N, 2, 2) array of tables.
+
+    Evaluated by the process-wide FisherEngine, which caches hypergeometric tail sums
+    per set of margins; see `contingency_stats.fisher_engine` for the tolerance against
+    `scipy.stats.fisher_exact`.
+
+    Args:
+        observed: (N, 2, 2) array of non-negative counts
+        alternative: Type of hypothesis test ('two-sided', 'greater', or 'less')
+
+    Returns:
+        Array of N p-values
+    """
+    return default_fisher_engine().p_values(observed, alternative)
+
+
+def woolf_odds_ratio_ci(
+    observed: np.ndarray, confidence_level: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sample odds ratios and Woolf (log-normal) confidence intervals for an (N, 2, 2) array.
+
+    Matches `FishersExactTest._calculate_odds_ratio_ci` element for element.
+
+    Returns:
+        Tuple of (odds_ratio, lower_bound, upper_bound) arrays
+    """
+    from scipy import special
+
+    a = observed[:, 0, 0].astype(np.float64)
+    b = observed[:, 0, 1].astype(np.float64)
+    c = observed[:, 1, 0].astype(np.float64)
+    d = observed[:, 1, 1].astype(np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        finite = (b * c) != 0
+        odds_ratio = np.where(finite, (a * d) / np.where(finite, b * c, 1.0), np.inf)
+        any_zero = (a == 0) | (b == 0) | (c == 0) | (d == 0)
+        se_log_odds = np.where(any_zero, np.nan, np.sqrt(1 / a + 1 / b + 1 / c + 1 / d))
+        z = special.ndtri(1 - (1 - confidence_level) / 2)
+        log_odds = np.log(odds_ratio)
+        lower = np.where(finite, np.round(np.exp(log_odds - z * se_log_odds), 3), np.nan)
+        upper = np.where(finite, np.round(np.exp(log_odds + z * se_log_odds), 3), np.inf)
+
+    return odds_ratio, lower, upper
 
 
 class FishersExactTest(ContingencyTestProtocol[FishersExactResult]):
-    """Fisher's Exact test implementation for 2x2 contingency tables, supporting different alternative hypotheses."""
+    """
+    Fisher's Exact test implementation for 2x2 contingency tables, supporting different alternative hypotheses.
+
+    R x C tables get the two-sided Freeman-Halton test (see `contingency_stats.fisher_rxc`):
+    exact while the tables with the observed margins can be enumerated, otherwise by
+    Monte Carlo. Their odds ratio and confidence interval are NaN.
+    """
 
-    def __init__(self, alpha: float = 0.05, confidence_level: float = 0.95, alternative: Literal["two-sided", "greater", "less"] = "two-sided"):
+    def __init__(
+        self,
+        alpha: float = 0.05,
+        confidence_level: float = 0.95,
+        alternative: Literal["two-sided", "greater", "less"] = "two-sided",
+        engine: Optional[FisherEngine] = None,
+        odds_ratio_method: Literal["sample", "conditional"] = "sample",
+        simulate_p_value: bool = False,
+        n_simulations: int = DEFAULT_SIMULATIONS,
+        seed: Optional[int] = None,
+        max_exact_tables: int = DEFAULT_MAX_TABLES,
+    ):
         """
         Initialise the Fisher's Exact test.
 
@@ -18,10 +94,27 @@ class FishersExactTest(ContingencyTestProtocol[FishersExactResult]):
             alpha: Significance level (default: 0.05)
             confidence_level: Confidence level for intervals (default: 0.95)
             alternative: Type of hypothesis test ('two-sided', 'greater', or 'less')
+            engine: FisherEngine computing the p-values (default: the shared process-wide engine)
+            odds_ratio_method: 'sample' for the sample odds ratio with a Woolf CI, or
+                'conditional' for the conditional MLE with an exact CI, which stays finite
+                when a cell is zero
+            simulate_p_value: Always use Monte Carlo for R x C tables (2x2 tables are exact)
+            n_simulations: Number of random tables for Monte Carlo p-values (default: 10,000)
+            seed: Seed for the random tables, for reproducible p-values
+            max_exact_tables: Largest number of tables to enumerate for an exact R x C
+                p-value before falling back to Monte Carlo
         """
+        if odds_ratio_method not in ("sample", "conditional"):
+            raise ValueError("`odds_ratio_method` should be one of {'sample', 'conditional'}")
         self.alpha = alpha
         self.confidence_level = confidence_level
         self.alternative = alternative
+        self.engine = engine or default_fisher_engine()
+        self.odds_ratio_method = odds_ratio_method
+        self.simulate_p_value = simulate_p_value
+        self.n_simulations = n_simulations
+        self.seed = seed
+        self.max_exact_tables = max_exact_tables
         self.test_name = f"Fisher's Exact Test ({alternative})"
 
     def _calculate_odds_ratio_ci(
@@ -37,6 +130,8 @@ class FishersExactTest(ContingencyTestProtocol[FishersExactResult]):
         Returns:
             Tuple of (odds_ratio, (lower_bound, upper_bound))
         """
+        from scipy import special
+
         a, b = table[0, 0], table[0, 1]
         c, d = table[1, 0], table[1, 1]
 
@@ -49,7 +144,7 @@ class FishersExactTest(ContingencyTestProtocol[FishersExactResult]):
             else:
                 se_log_odds = np.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
 
-            z = stats.norm.ppf(1 - (1 - confidence_level) / 2)
+            z = special.ndtri(1 - (1 - confidence_level) / 2)
             log_lower = log_odds - z * se_log_odds
             log_upper = log_odds + z * se_log_odds
 
@@ -60,26 +155,71 @@ class FishersExactTest(ContingencyTestProtocol[FishersExactResult]):
 
         return odds_ratio, (lower, upper)
 
-    def calculate(self, table: ContingencyTable) -> FishersExactResult:
+    def calculate(self, table: Union[ContingencyTable, CategoricalTable]) -> FishersExactResult:
         """
         Calculate Fisher's Exact test for the contingency table.
 
         Args:
-            table: A 2x2 contingency table with the structure from ContingencyTableQuery
+            table: A 2x2 contingency table with the structure from ContingencyTableQuery,
+                or an R x C table from CategoricalTableQuery
 
         Returns:
             FishersExactResult with test results
         """
         observed = table_to_array(table)
+        if observed.shape != (2, 2):
+            p, method = self._rxc_p_value(observed)
+            return self._build_result(observed, p, float("nan"), (float("nan"), float("nan")), method)
 
         # Calculate Fisher's Exact test with the chosen alternative hypothesis
-        _, p = stats.fisher_exact(observed, alternative=self.alternative)
+        p = self.engine.p_value(observed, alternative=self.alternative)
 
         # Calculate odds ratio and confidence interval
-        odds_ratio, ci = self._calculate_odds_ratio_ci(observed, self.confidence_level)
+        if self.odds_ratio_method == "conditional":
+            odds_ratio, lower, upper = self._conditional_odds_ratio_ci(observed.reshape(1, 2, 2))
+            odds_ratio, ci = float(odds_ratio[0]), (float(lower[0]), float(upper[0]))
+        else:
+            odds_ratio, ci = self._calculate_odds_ratio_ci(observed, self.confidence_level)
+
+        return self._build_result(observed, p, odds_ratio, ci)
+
+    def _rxc_p_value(self, observed: np.ndarray) -> Tuple[float, str]:
+        """Two-sided p-value of an R x C table and how it was computed ('exact' or 'monte_carlo')"""
+        if self.alternative != "two-sided":
+            raise ValueError("Only the two-sided alternative is defined for tables larger than 2x2")
+
+        if not self.simulate_p_value:
+            p = fisher_rxc_exact_p_value(observed, self.max_exact_tables, self.engine.log_factorials)
+            if p is not None:
+                return p, "exact"
+        p = fisher_rxc_monte_carlo_p_value(
+            observed, self.n_simulations, self.seed, self.engine.log_factorials
+        )
+        return p, "monte_carlo"
 
+    def _conditional_odds_ratio_ci(self, observed: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Conditional MLE odds ratios and exact CIs, sharing the engine's log-factorial table"""
+        return conditional_odds_ratio(
+            observed, self.confidence_level, self.alternative, self.engine.log_factorials
+        )
+
+    def _build_result(
+        self,
+        observed: np.ndarray,
+        p: float,
+        odds_ratio: float,
+        ci: Tuple[float, float],
+        p_value_method: str = "exact",
+    ) -> FishersExactResult:
+        """Assemble the result model, including its interpretation, for one table"""
         # Construct interpretation based on alternative hypothesis
-        if self.alternative == "two-sided":
+        if observed.shape != (2, 2):
+            interpretation = (
+                f"There is {'no' if p >= self.alpha else 'a'} statistically significant association between exposure and outcome "
+                f"({format_p_value(p)}, {observed.shape[0]}x{observed.shape[1]} table"
+                + (f", p-value simulated from {self.n_simulations} random tables)" if p_value_method == "monte_carlo" else ")")
+            )
+        elif self.alternative == "two-sided":
             interpretation = (
                 f"There is {'no' if p >= self.alpha else 'a'} statistically significant association between exposure and outcome "
                 f"({format_p_value(p)}). Odds ratio: {odds_ratio:.2f} "
@@ -108,5 +248,67 @@ class FishersExactTest(ContingencyTestProtocol[FishersExactResult]):
                 "observed_values": observed.tolist(),
                 "confidence_level": self.confidence_level,
                 "alternative": self.alternative,
+                "odds_ratio_method": self.odds_ratio_method,
+                "p_value_method": p_value_method,
+                **({"n_simulations": self.n_simulations} if p_value_method == "monte_carlo" else {}),
             }
         )
+
+    def _frame_row(self, frame: ResultFrame, index: int) -> FishersExactResult:
+        return self._build_result(
+            frame.observed[index],
+            float(frame["p_value"][index]),
+            float(frame["odds_ratio"][index]),
+            (float(frame["ci_lower"][index]), float(frame["ci_upper"][index])),
+            str(frame["p_value_method"][index]) if "p_value_method" in frame else "exact",
+        )
+
+    def calculate_batch(
+        self, tables: Union[np.ndarray, Sequence[Union[ContingencyTable, CategoricalTable]]]
+    ) -> ResultFrame:
+        """
+        Calculate Fisher's Exact test for many tables of the same shape at once.
+
+        Produces the same numbers as calling `calculate` on each table, without building a
+        result model per table; `frame.row(i)` builds the FishersExactResult on demand.
+        R x C p-values are computed table by table.
+
+        Args:
+            tables: An (N, R, C) array of counts, or a sequence of table dicts
+
+        Returns:
+            ResultFrame with columns p_value, is_significant, odds_ratio, ci_lower and ci_upper,
+            plus p_value_method for R x C tables
+        """
+        observed = tables_to_array(tables)
+        if observed.shape[1:] != (2, 2):
+            return self._calculate_rxc_batch(observed)
+
+        p_values = self.engine.p_values(observed, self.alternative)
+        if self.odds_ratio_method == "conditional":
+            odds_ratio, ci_lower, ci_upper = self._conditional_odds_ratio_ci(observed)
+        else:
+            odds_ratio, ci_lower, ci_upper = woolf_odds_ratio_ci(observed, self.confidence_level)
+
+        columns = {
+            "p_value": p_values,
+            "is_significant": p_values < self.alpha,
+            "odds_ratio": odds_ratio,
+            "ci_lower": ci_lower,
+            "ci_upper": ci_upper,
+        }
+        return ResultFrame(columns, observed, self._frame_row)
+
+    def _calculate_rxc_batch(self, observed: np.ndarray) -> ResultFrame:
+        p_values, methods = zip(*(self._rxc_p_value(table) for table in observed)) if len(observed) else ((), ())
+        p_values = np.array(p_values, dtype=np.float64)
+        missing = np.full(len(observed), np.nan)
+        columns = {
+            "p_value": p_values,
+            "is_significant": p_values < self.alpha,
+            "odds_ratio": missing,
+            "ci_lower": missing,
+            "ci_upper": missing,
+            "p_value_method": np.array(methods, dtype=object),
+        }
+        return ResultFrame(columns, observed, self._frame_row)
@@ -0,0 +1,292 @@
+"""
+Cochran-Mantel-Haenszel analysis of stratified 2x2 tables.
+
+For an exposure and outcome tabulated within K strata (e.g. sex), as built by
+StratifiedTableQuery:
+
+* the Cochran-Mantel-Haenszel test of no association given the strata, with R's
+  continuity correction by default (as `mantelhaen.test`),
+* the Mantel-Haenszel pooled odds ratio, with the Robins-Breslow-Greenland confidence
+  interval,
+* the Breslow-Day test that the odds ratio is the same in every stratum, optionally with
+  Tarone's correction.
+
+Every function takes an (N, K, 2, 2) array, N stratified tables of K strata each, and
+works on whole arrays with no Python loop over tables or strata. Strata with fewer than
+two patients carry no information and are left out, as in `mantelhaen.test`.
+"""
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from contingency_stats.protocols import ContingencyTestProtocol, StratifiedTable
+from contingency_stats.result_frame import ResultFrame
+from contingency_stats.result_schemas import MantelHaenszelResult
+from contingency_stats.contingency_utils import format_p_value, stratified_tables_to_array
+
+
+def _cells(observed: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """The a, b, c, d cells and totals of an (N, K, 2, 2) array, as (N, K) float arrays"""
+    observed = observed.astype(np.float64)
+    a, b = observed[..., 0, 0], observed[..., 0, 1]
+    c, d = observed[..., 1, 0], observed[..., 1, 1]
+    return a, b, c, d, a + b + c + d
+
+
+def cochran_mantel_haenszel(
+    observed: np.ndarray, continuity_correction: bool = True
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cochran-Mantel-Haenszel chi-squared statistics (1 df) and p-values for an (N, K, 2, 2) array.
+
+    Tables whose strata all have a fixed exposed-with-outcome count given their margins
+    get NaN.
+
+    Returns:
+        Tuple of (statistic, p_value) arrays of length N
+    """
+    from scipy import special
+
+    a, b, c, d, n = _cells(observed)
+    informative = n > 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = np.where(informative, (a + b) * (a + c) / n, 0.0)
+        variance = np.where(informative, (a + b) * (c + d) * (a + c) * (b + d) / (n * n * (n - 1)), 0.0)
+    deviation = np.abs(np.where(informative, a, 0.0).sum(axis=1) - expected.sum(axis=1))
+    total_variance = variance.sum(axis=1)
+    if continuity_correction:
+        # As mantelhaen.test: only corrected when the deviation is at least the correction
+        deviation = np.where(deviation >= 0.5, deviation - 0.5, deviation)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        statistic = np.where(total_variance > 0, deviation ** 2 / total_variance, np.nan)
+    return statistic, special.chdtrc(1, statistic)
+
+
+def mantel_haenszel_odds_ratio(
+    observed: np.ndarray, confidence_level: float = 0.95
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Mantel-Haenszel pooled odds ratios and Robins-Breslow-Greenland confidence intervals.
+
+    An odds ratio of 0 gets the interval (0, NaN) and an infinite one (NaN, inf); tables
+    with no discordant products at all get NaN throughout.
+
+    Returns:
+        Tuple of (odds_ratio, lower_bound, upper_bound) arrays of length N
+    """
+    from scipy import special
+
+    a, b, c, d, n = _cells(observed)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Empty strata have a*d = b*c = 0, so dividing them by 1 instead of 0 drops them
+        n = np.where(n > 0, n, 1.0)
+        r, s = a * d / n, b * c / n
+        p, q = (a + d) / n, (b + c) / n
+        r_total, s_total = r.sum(axis=1), s.sum(axis=1)
+        odds_ratio = r_total / s_total
+
+        variance = (
+            (p * r).sum(axis=1) / (2 * r_total ** 2)
+            + (p * s + q * r).sum(axis=1) / (2 * r_total * s_total)
+            + (q * s).sum(axis=1) / (2 * s_total ** 2)
+        )
+        z = special.ndtri(1 - (1 - confidence_level) / 2)
+        log_odds = np.log(odds_ratio)
+        half_width = z * np.sqrt(variance)
+        valid = (r_total > 0) & (s_total > 0)
+        lower = np.where(valid, np.exp(log_odds - half_width), np.where(r_total == 0, 0.0, np.nan))
+        upper = np.where(valid, np.exp(log_odds + half_width), np.where(s_total == 0, np.inf, np.nan))
+    invalid_zero = (r_total == 0) & (s_total == 0)
+    lower[invalid_zero] = np.nan
+    upper[invalid_zero] = np.nan
+    return odds_ratio, lower, upper
+
+
+def breslow_day(
+    observed: np.ndarray, odds_ratio: Optional[np.ndarray] = None, tarone_correction: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Breslow-Day statistics for homogeneous odds ratios across strata, for an (N, K, 2, 2) array.
+
+    Each stratum's expected exposed-with-outcome count under the common odds ratio is the
+    root within its margins of the quadratic a(N - n1 - m1 + a) = psi (n1 - a)(m1 - a).
+    Only strata whose margins leave that count free take part, with K' - 1 degrees of
+    freedom for K' such strata. Tables with a pooled odds ratio of 0, infinity or NaN, or
+    fewer than two such strata, get NaN.
+
+    Args:
+        observed: (N, K, 2, 2) array of counts
+        odds_ratio: Common odds ratio of each table (default: the Mantel-Haenszel estimate)
+        tarone_correction: Apply Tarone's correction to the statistic
+
+    Returns:
+        Tuple of (statistic, p_value, degrees_of_freedom) arrays of length N
+    """
+    from scipy import special
+
+    if odds_ratio is None:
+        odds_ratio, _, _ = mantel_haenszel_odds_ratio(observed)
+    a, b, c, _d, n = _cells(observed)
+    n1, m1 = a + b, a + c
+    lowest, highest = np.maximum(0.0, n1 + m1 - n), np.minimum(n1, m1)
+    informative = highest > lowest
+    psi = np.broadcast_to(np.asarray(odds_ratio, dtype=np.float64)[:, None], a.shape)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # (1 - psi) e^2 + (n - n1 - m1 + psi (n1 + m1)) e - psi n1 m1 = 0, solved stably
+        quadratic = 1 - psi
+        linear = n - n1 - m1 + psi * (n1 + m1)
+        constant = -psi * n1 * m1
+        root = np.sqrt(linear ** 2 - 4 * quadratic * constant)
+        half = -(linear + np.copysign(root, linear)) / 2
+        first, second = half / quadratic, constant / half
+        tolerance = 1e-9 * np.maximum(n, 1.0)
+        first_inside = (first >= lowest - tolerance) & (first <= highest + tolerance)
+        expected = np.where(np.abs(quadratic) < 1e-12, n1 * m1 / n, np.where(first_inside, first, second))
+
+        variance = 1 / (1 / expected + 1 / (n1 - expected) + 1 / (m1 - expected) + 1 / (n - n1 - m1 + expected))
+        deviation = np.where(informative, a - expected, 0.0)
+        variance = np.where(informative, variance, 0.0)
+        statistic = np.where(informative, deviation ** 2 / np.where(informative, variance, 1.0), 0.0).sum(axis=1)
+        if tarone_correction:
+            statistic -= deviation.sum(axis=1) ** 2 / variance.sum(axis=1)
+
+    degrees_of_freedom = np.maximum(informative.sum(axis=1) - 1, 0)
+    usable = (degrees_of_freedom >= 1) & np.isfinite(odds_ratio) & (np.asarray(odds_ratio) > 0)
+    statistic = np.where(usable, statistic, np.nan)
+    p_value = special.chdtrc(np.maximum(degrees_of_freedom, 1), statistic)
+    return statistic, p_value, degrees_of_freedom
+
+
+class MantelHaenszelTest(ContingencyTestProtocol[MantelHaenszelResult]):
+    """
+    Cochran-Mantel-Haenszel test, Mantel-Haenszel pooled odds ratio and Breslow-Day test
+    for stratified 2x2 tables.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.05,
+        confidence_level: float = 0.95,
+        continuity_correction: bool = True,
+        tarone_correction: bool = False,
+    ):
+        """
+        Initialise the Cochran-Mantel-Haenszel test.
+
+        Args:
+            alpha: Significance level, for both the CMH and the Breslow-Day test (default: 0.05)
+            confidence_level: Confidence level for the pooled odds ratio (default: 0.95)
+            continuity_correction: Continuity correct the CMH statistic, as R's mantelhaen.test
+            tarone_correction: Apply Tarone's correction to the Breslow-Day statistic
+        """
+        self.alpha = alpha
+        self.confidence_level = confidence_level
+        self.continuity_correction = continuity_correction
+        self.tarone_correction = tarone_correction
+        self.test_name = "Cochran-Mantel-Haenszel Test"
+
+    def calculate(self, table: StratifiedTable) -> MantelHaenszelResult:
+        """
+        Calculate the CMH test, pooled odds ratio and Breslow-Day test for one stratified table.
+
+        Args:
+            table: A stratified 2x2 table with the structure from StratifiedTableQuery
+
+        Returns:
+            MantelHaenszelResult with test results
+        """
+        return self.calculate_batch([table]).row(0)
+
+    def calculate_batch(self, tables: Union[np.ndarray, Sequence[StratifiedTable]]) -> ResultFrame:
+        """
+        Calculate the test for many stratified tables with the same number of strata at once.
+
+        `frame.row(i)` builds the MantelHaenszelResult on demand.
+
+        Args:
+            tables: An (N, K, 2, 2) array of counts, or a sequence of stratified table dicts
+
+        Returns:
+            ResultFrame with columns test_statistic, p_value, is_significant, odds_ratio,
+            ci_lower, ci_upper, breslow_day_statistic, breslow_day_p_value,
+            breslow_day_degrees_of_freedom and n_strata
+        """
+        observed = stratified_tables_to_array(tables)
+        statistic, p_values = cochran_mantel_haenszel(observed, self.continuity_correction)
+        odds_ratio, ci_lower, ci_upper = mantel_haenszel_odds_ratio(observed, self.confidence_level)
+        bd_statistic, bd_p_values, bd_dof = breslow_day(observed, odds_ratio, self.tarone_correction)
+
+        columns = {
+            "test_statistic": statistic,
+            "p_value": p_values,
+            "is_significant": p_values < self.alpha,
+            "odds_ratio": odds_ratio,
+            "ci_lower": ci_lower,
+            "ci_upper": ci_upper,
+            "breslow_day_statistic": bd_statistic,
+            "breslow_day_p_value": bd_p_values,
+            "breslow_day_degrees_of_freedom": bd_dof,
+            "n_strata": (observed.sum(axis=(2, 3)) > 1).sum(axis=1),
+        }
+        return ResultFrame(columns, observed, self._frame_row)
+
+    def _frame_row(self, frame: ResultFrame, index: int) -> MantelHaenszelResult:
+        return self._build_result(
+            frame.observed[index],
+            float(frame["test_statistic"][index]),
+            float(frame["p_value"][index]),
+            float(frame["odds_ratio"][index]),
+            (float(frame["ci_lower"][index]), float(frame["ci_upper"][index])),
+            float(frame["breslow_day_statistic"][index]),
+            float(frame["breslow_day_p_value"][index]),
+            int(frame["breslow_day_degrees_of_freedom"][index]),
+            int(frame["n_strata"][index]),
+        )
+
+    def _build_result(
+        self,
+        observed: np.ndarray,
+        statistic: float,
+        p: float,
+        odds_ratio: float,
+        ci: Tuple[float, float],
+        bd_statistic: float,
+        bd_p: float,
+        bd_dof: int,
+        n_strata: int,
+    ) -> MantelHaenszelResult:
+        """Assemble the result model, including its interpretation, for one stratified table"""
+        interpretation = (
+            f"There is {'no ' if not p < self.alpha else ''}statistically significant association between exposure "
+            f"and outcome given the {n_strata} strata ({format_p_value(p)}). Mantel-Haenszel odds ratio: "
+            f"{odds_ratio:.2f} ({self.confidence_level:.0%} CI: {ci[0]:.2f} to "
+            f"{f'{ci[1]:.2f}' if ci[1] != float('inf') else 'infinity'})."
+        )
+        if not np.isnan(bd_p):
+            interpretation += (
+                f" The odds ratio {'differs' if bd_p < self.alpha else 'does not differ significantly'} "
+                f"between strata (Breslow-Day {format_p_value(bd_p)})."
+            )
+
+        return MantelHaenszelResult(
+            test_name=self.test_name,
+            test_statistic=statistic,
+            p_value=p,
+            is_significant=p < self.alpha,
+            interpretation=interpretation,
+            alpha=self.alpha,
+            odds_ratio=odds_ratio,
+            confidence_interval=ci,
+            breslow_day_statistic=bd_statistic,
+            breslow_day_p_value=bd_p,
+            breslow_day_degrees_of_freedom=bd_dof,
+            n_strata=n_strata,
+            continuity_correction_applied=self.continuity_correction,
+            additional_info={
+                "observed_values": observed.tolist(),
+                "confidence_level": self.confidence_level,
+                "tarone_correction": self.tarone_correction,
+            },
+        )
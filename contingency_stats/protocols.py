@@ -8,6 +8,13 @@ class ContingencyTable(TypedDict):
     unexposed: Dict[str, int]
 
 
+# R x C table from CategoricalTableQuery: exposure level -> outcome level -> count, in order
+CategoricalTable = Dict[str, Dict[str, int]]
+
+# 2x2xK table from StratifiedTableQuery: stratum label -> 2x2 table of that stratum, in order
+StratifiedTable = Dict[str, ContingencyTable]
+
+
 # Clever pydantic typing for test result that's a subclass of BaseStatResult
 # When defining you can specialise StatTestProtocol with the specific result type
 T_Result = TypeVar('T_Result', bound=BaseStatResult)
@@ -22,6 +29,7 @@ class ContingencyTestProtocol(Protocol[T_Result]):
 
         Args:
             table: A 2x2 contingency table with the structure from ContingencyTableQuery
+                (tests that support R x C tables also accept a CategoricalTable)
 
         Returns:
             A test specific result object that inherits from BaseStatResult
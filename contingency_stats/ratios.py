@@ -1,6 +1,6 @@
 from typing import Optional
 
-from protocols import ContingencyTable
+from contingency_stats.protocols import ContingencyTable
 
 
 def calculate_risk_ratio(table: ContingencyTable) -> Optional[float]:
@@ -0,0 +1,98 @@
+from typing import Callable, Dict, Iterator, List, Union
+
+import numpy as np
+
+from contingency_stats.result_schemas import BaseStatResult
+
+
+class ResultFrame:
+    """
+    Struct-of-arrays container for the results of one test over many tables.
+
+    Each statistic is held as a single NumPy column, so a batch of a million results costs
+    a handful of arrays rather than a million pydantic models. Interpretation strings and
+    per-row result models are only built when a single row is accessed.
+
+    Indexing with a column name returns that column; indexing with an integer returns the
+    row as the test's usual BaseStatResult subclass.
+
+    Args:
+        columns: Equal-length 1-D arrays keyed by column name
+        observed: The (N, R, C) tables the results were computed from
+        row_factory: Builds the result model for row i from the frame
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, np.ndarray],
+        observed: np.ndarray,
+        row_factory: Callable[["ResultFrame", int], BaseStatResult],
+    ):
+        lengths = {len(column) for column in columns.values()} | {len(observed)}
+        if len(lengths) > 1:
+            raise ValueError(f"All columns must have the same length, got {sorted(lengths)}")
+
+        self._columns = {name: np.ascontiguousarray(column) for name, column in columns.items()}
+        self.observed = observed
+        self._row_factory = row_factory
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def __len__(self) -> int:
+        return len(self.observed)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._columns
+
+    def __getitem__(self, key: Union[str, int]) -> Union[np.ndarray, BaseStatResult]:
+        if isinstance(key, str):
+            return self._columns[key]
+        return self.row(key)
+
+    def keys(self) -> List[str]:
+        return self.columns
+
+    def row(self, index: int) -> BaseStatResult:
+        """Build the full result model, including its interpretation, for one row"""
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Row {index} out of range for {len(self)} results")
+        return self._row_factory(self, index % len(self))
+
+    def interpretation(self, index: int) -> str:
+        return self.row(index).interpretation
+
+    def __iter__(self) -> Iterator[BaseStatResult]:
+        """Iterate over the rows as result models (builds each one on demand)"""
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def to_pandas(self):
+        """
+        Return the columns as a pandas DataFrame without copying them.
+
+        The observed counts of 2x2 tables are included as a, b, c and d columns (views into
+        `observed`); R x C counts are left out.
+        """
+        import pandas as pd
+
+        data = {}
+        if self.observed.shape[1:] == (2, 2):
+            data = {
+                "a": self.observed[:, 0, 0],
+                "b": self.observed[:, 0, 1],
+                "c": self.observed[:, 1, 0],
+                "d": self.observed[:, 1, 1],
+            }
+        data.update(self._columns)
+        return pd.DataFrame(data, copy=False)
+
+    def to_arrow(self):
+        """Return the columns as a pyarrow Table; numeric columns are shared, not copied"""
+        import pyarrow as pa
+
+        return pa.table({name: pa.array(column) for name, column in self._columns.items()})
+
+    def __repr__(self) -> str:
+        return f"ResultFrame(rows={len(self)}, columns={self.columns})"
@@ -38,4 +38,22 @@ class FishersExactResult(BaseStatResult):
     odds_ratio: float = Field(..., description="Odds ratio")
     confidence_interval: Tuple[float, float] = Field(
         ..., description="Confidence interval for the odds ratio"
-    )
\ No newline at end of file
+    )
+
+
+class MantelHaenszelResult(BaseStatResult):
+    """Cochran-Mantel-Haenszel test specific result model, for a stratified 2x2 table."""
+
+    test_statistic: float = Field(..., description="Cochran-Mantel-Haenszel chi-squared statistic")
+    degrees_of_freedom: int = Field(1, description="Degrees of freedom of the CMH statistic")
+    odds_ratio: float = Field(..., description="Mantel-Haenszel pooled odds ratio")
+    confidence_interval: Tuple[float, float] = Field(
+        ..., description="Robins-Breslow-Greenland confidence interval for the pooled odds ratio"
+    )
+    breslow_day_statistic: float = Field(..., description="Breslow-Day statistic for homogeneous odds ratios")
+    breslow_day_p_value: float = Field(..., description="P-value of the Breslow-Day test")
+    breslow_day_degrees_of_freedom: int = Field(..., description="Degrees of freedom of the Breslow-Day test")
+    n_strata: int = Field(..., description="Number of strata with at least two patients")
+    continuity_correction_applied: bool = Field(
+        True, description="Whether the CMH statistic was continuity corrected"
+    )
@@ -1,134 +1,1347 @@
-from dataclasses import dataclass
-from typing import Dict, Optional
-from hutch_bunny.core.rquest_dto.cohort import Cohort
-from hutch_bunny.core.rquest_dto.group import Group
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, fields, replace
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+from uuid import uuid4
 from job_status import JobStatus
-from rule import CustomRule
 from query_result import QueryResult
 from job_response import JobResponse
-from availability_query import CustomAvailabilityQuery
-from hutch_bunny.core.upstream.task_api_client import TaskApiClient
-import time
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from job_journal import JobJournal
+from job_tracker import JobTracker
+from concept_set import CodeSet, code_set, set_codes
+from payload_compiler import PayloadCompiler, RuleSpec
+from payload_hash import canonical_payload_hash
+from polling import CancellationToken, JobPollCancelled, PollingPolicy, PollResult, poll_job
+from result_cache import ResultCache
+from single_flight import Flight, SingleFlight
+
+# hutch_bunny is imported when the first payload is built, not at import time
+if TYPE_CHECKING:
+    from hutch_bunny.core.rquest_dto.group import Group
+    from hutch_bunny.core.upstream.task_api_client import TaskApiClient
+    from query_planner import MarginalQueryPlanner
+    from rule import CustomRule
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Cell name -> (exposure_present, outcome_present), in [11, 10, 01, 00] order
+CELLS: Dict[str, Tuple[bool, bool]] = {
+    "exposed_with_outcome": (True, True),
+    "exposed_without_outcome": (True, False),
+    "unexposed_with_outcome": (False, True),
+    "unexposed_without_outcome": (False, False),
+}
+
+
+def cell_name(exposure_present: bool, outcome_present: bool) -> str:
+    """Return the cell name for a presence/absence combination"""
+    return next(
+        name for name, flags in CELLS.items() if flags == (exposure_present, outcome_present)
+    )
+
+
+class CellQueryError(RuntimeError):
+    """Raised when one or more cell queries of a contingency table fail."""
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        self.errors = errors
+        details = "; ".join(f"{cell}: {error!r}" for cell, error in errors.items())
+        super().__init__(f"Contingency cell queries failed ({details})")
+
+
+def build_rule(table: str, omop_code: str, present: bool) -> "CustomRule":
+    """Build an OMOP rule matching patients with (or, if not `present`, without) the code"""
+    from rule import CustomRule
+
+    return CustomRule(
+        varname="OMOP",
+        varcat=table,
+        type_="TEXT",
+        operator="=" if present else "!=",
+        value=omop_code,
+    )
+
+
+def build_rule_group(table: str, omop_codes: CodeSet, present: bool) -> "Group":
+    """Build a group matching patients with any of the codes or, if not `present`, with none of them"""
+    from hutch_bunny.core.rquest_dto.group import Group
+
+    return Group(
+        rules=[build_rule(table, omop_code, present) for omop_code in set_codes(omop_codes)],
+        rules_operator="OR" if present else "AND",
+    )
+
+
+def build_query_payload(
+    collection_id: str, owner: str, rules: List["CustomRule"], query_uuid: str
+) -> dict:
+    """Build the Task API payload for an availability query ANDing `rules` together"""
+    from hutch_bunny.core.rquest_dto.group import Group
+
+    return build_cohort_payload(collection_id, owner, [Group(rules=rules, rules_operator="AND")], "OR", query_uuid)
+
+
+def build_cohort_payload(
+    collection_id: str, owner: str, groups: List["Group"], groups_operator: str, query_uuid: str
+) -> dict:
+    """Build the Task API payload for an availability query combining `groups` with `groups_operator`"""
+    from availability_query import CustomAvailabilityQuery
+    from hutch_bunny.core.rquest_dto.cohort import Cohort
+
+    # Create cohort
+    cohort = Cohort(groups=groups, groups_operator=groups_operator)
+
+    # Create query
+    query = CustomAvailabilityQuery(
+        cohort=cohort,
+        uuid=query_uuid,
+        owner=owner,
+        collection=collection_id,
+        protocol_version="v2",
+        char_salt="salt",
+    )
+
+    return {"application": "AVAILABILITY_QUERY", "input": query.to_dict()}
+
+
+def render_rules_payload(collection_id: str, owner: str, rules: Sequence[RuleSpec], query_uuid: str) -> dict:
+    """Build the payload for `rules` through the hutch_bunny DTOs.
+
+    Rules on single codes are ANDed in one group (see `build_query_payload`). If any rule
+    is on a concept set, each rule becomes a group of its own (see `build_rule_group`)
+    and the groups are ANDed.
+    """
+    if not any(isinstance(rule.omop_code, tuple) for rule in rules):
+        return build_query_payload(collection_id, owner, [build_rule(*rule) for rule in rules], query_uuid)
+    return build_cohort_payload(collection_id, owner, [build_rule_group(*rule) for rule in rules], "AND", query_uuid)
+
+
+_default_payload_compiler = PayloadCompiler(render_rules_payload)
+
+
+def default_payload_compiler() -> PayloadCompiler:
+    """The process-wide PayloadCompiler shared by every builder"""
+    return _default_payload_compiler
+
+
+def build_rules_payload(
+    collection_id: str,
+    owner: str,
+    rules: Sequence[RuleSpec],
+    query_uuid: str,
+    payload_compiler: Optional[PayloadCompiler] = None,
+) -> dict:
+    """Build the payload ANDing `rules`, from a compiled template if a `payload_compiler` is given"""
+    if payload_compiler is None:
+        return render_rules_payload(collection_id, owner, rules, query_uuid)
+    return payload_compiler.payload(collection_id, owner, rules, query_uuid)
+
+
+def submit_job(client: "TaskApiClient", payload: dict) -> JobResponse:
+    """Submit a query payload to the Task API"""
+    response = client.post("/task/", data=payload)
+    response.raise_for_status()
+    job_response = JobResponse.from_dict(response.json())
+    logger.debug("Submitted job %s", job_response.job_uuid)
+    return job_response
+
+
+def get_job_status(client: "TaskApiClient", job_uuid: str, strict: bool = False) -> JobStatus:
+    """Fetch the current status of a submitted job; `strict` validates without type coercion"""
+    status_response = client.get(f"/task/status/{job_uuid}")
+    status_response.raise_for_status()
+    status = JobStatus.from_api_json(status_response.content, strict)
+    logger.debug("Job %s status %s", job_uuid, status.status)
+    return status
+
+
+def fetch_job_result(
+    client: "TaskApiClient", job_uuid: str, collection_id: str, strict: bool = False
+) -> QueryResult:
+    """Fetch the result of a finished job; `strict` validates without type coercion"""
+    result_response = client.get(f"/task/results/{job_uuid}/{collection_id}")
+    result_response.raise_for_status()
+    result = QueryResult.from_api_json(result_response.content, strict)
+    logger.debug("Job %s result %s", job_uuid, result.queryResult)
+    return result
+
+
+@dataclass(frozen=True)
+class QueryOptions:
+    """
+    How a query is run, shared by the builders and the planner.
+
+    Attributes:
+        polling_policy: Polling schedule of the job (default: PollingPolicy())
+        result_cache: ResultCache consulted before submitting, and given the fetched count
+        instrumentation: Records the stages of the query (default: disabled)
+        single_flight: SingleFlight sharing an identical query already in flight
+        journal: JobJournal to resume the query of an interrupted run
+        payload_compiler: Builds the payload from a precompiled template instead of the DTOs
+        strict_decode: Validate Task API responses in pydantic's strict mode (no type coercion)
+        job_tracker: JobTracker polling the job, for `start_rules_query`
+    """
+
+    polling_policy: Optional[PollingPolicy] = None
+    result_cache: Optional[ResultCache] = None
+    instrumentation: Instrumentation = field(default=NULL_INSTRUMENTATION, repr=False)
+    single_flight: Optional[SingleFlight] = field(default=None, repr=False)
+    journal: Optional[JobJournal] = field(default=None, repr=False)
+    payload_compiler: Optional[PayloadCompiler] = field(default=None, repr=False)
+    strict_decode: bool = False
+    job_tracker: Optional[JobTracker] = field(default=None, repr=False)
+
+    @classmethod
+    def of(cls, owner: object) -> "QueryOptions":
+        """The options held in the fields of the same names of a builder or planner"""
+        return cls(**{f.name: getattr(owner, f.name) for f in fields(cls)})
+
+
+def run_rules_query(
+    client: "TaskApiClient",
+    collection_id: str,
+    owner: str,
+    rules: Sequence[RuleSpec],
+    query_uuid: str,
+    options: Optional[QueryOptions] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    cell: str = "",
+) -> tuple[int, dict, Optional[PollResult]]:
+    """Run an availability query ANDing `rules` together and return its count, payload and poll outcome.
+
+    When `options.result_cache` holds the count for an identical query, no job is
+    submitted and the poll outcome is None. With a `single_flight`, a caller whose query
+    is identical to one already in flight waits for that job instead of submitting its
+    own, and gets the same poll outcome; the job is polled on the first caller's schedule,
+    this caller gives up after its own `polling_policy` deadline, and the count is
+    recorded in this caller's own `journal` and `result_cache`. With a `journal`, a query
+    fetched or submitted by an earlier, interrupted run is resumed rather than resubmitted
+    (see `run_payload`), never shared. With a `payload_compiler`, the payload is filled
+    into a precompiled template instead of being built through the DTOs. With
+    `strict_decode`, responses are validated in pydantic's strict mode, rejecting values
+    that would otherwise be coerced (e.g. a count sent as "12").
+
+    Each stage (payload build, submit, queue wait, polls, result fetch) is recorded on
+    `options.instrumentation`, labelled with `cell` and the job_uuid once known.
+    """
+    options = options or QueryOptions()
+    with options.instrumentation.timer("payload_build", cell=cell, query_uuid=query_uuid):
+        payload = build_rules_payload(collection_id, owner, rules, query_uuid, options.payload_compiler)
+
+    logger.debug("Query %s payload %s", query_uuid, payload)
+
+    cache_key = None
+    if options.result_cache is not None or options.single_flight is not None:
+        cache_key = canonical_payload_hash(payload["input"], collection_id)
+    if options.result_cache is not None:
+        cached_count = options.result_cache.get(cache_key)
+        if cached_count is not None:
+            options.instrumentation.count("cache_hits", cell=cell, query_uuid=query_uuid)
+            return cached_count, payload, None
+
+    if options.single_flight is None or _journalled(options.journal, cache_key):
+        count, poll_result = run_payload(client, collection_id, payload, options, cancel_token, cell)
+        return count, payload, poll_result
+
+    (count, poll_result), shared = options.single_flight.do(
+        cache_key,
+        lambda flight: run_payload(client, collection_id, payload, options, flight.token, cell, flight),
+        cancel_token,
+        (options.polling_policy or PollingPolicy()).deadline,
+    )
+    if shared:
+        options.instrumentation.count("coalesced", cell=cell, query_uuid=query_uuid)
+        _record_shared_count(cache_key, count, poll_result, options.result_cache, options.journal)
+    return count, payload, poll_result
+
+
+def start_rules_query(
+    client: "TaskApiClient",
+    collection_id: str,
+    owner: str,
+    rules: Sequence[RuleSpec],
+    query_uuid: str,
+    options: QueryOptions,
+    cancel_token: Optional[CancellationToken] = None,
+    cell: str = "",
+) -> "Future[tuple[int, dict, Optional[PollResult]]]":
+    """Like `run_rules_query`, but return at once with a Future of the count, payload and poll outcome.
+
+    The job is submitted, polled and fetched by `options.job_tracker` (see
+    `start_payload`), so the caller's thread is not held while it runs. Caching,
+    single-flight sharing, journalling and instrumentation work as in `run_rules_query`,
+    except that a caller joining a shared job waits for it without a deadline of its own;
+    cancelling `cancel_token` fails the Future with JobPollCancelled.
+
+    Raises:
+        ValueError: if `options` has no job_tracker
+    """
+    if options.job_tracker is None:
+        raise ValueError("start_rules_query needs a job_tracker")
+    with options.instrumentation.timer("payload_build", cell=cell, query_uuid=query_uuid):
+        payload = build_rules_payload(collection_id, owner, rules, query_uuid, options.payload_compiler)
+
+    logger.debug("Query %s payload %s", query_uuid, payload)
+
+    outcome: Future = Future()
+    cache_key = None
+    if options.result_cache is not None or options.single_flight is not None:
+        cache_key = canonical_payload_hash(payload["input"], collection_id)
+    if options.result_cache is not None:
+        cached_count = options.result_cache.get(cache_key)
+        if cached_count is not None:
+            options.instrumentation.count("cache_hits", cell=cell, query_uuid=query_uuid)
+            outcome.set_result((cached_count, payload, None))
+            return outcome
+
+    def with_payload(result: tuple[int, Optional[PollResult]]) -> None:
+        count, poll_result = result
+        outcome.set_result((count, payload, poll_result))
+
+    if options.single_flight is None or _journalled(options.journal, cache_key):
+        started = start_payload(client, collection_id, payload, options, cancel_token, cell)
+        _chain_future(started, with_payload, outcome.set_exception)
+        return outcome
+
+    flight, shared = options.single_flight.start_future(
+        cache_key,
+        lambda flight: start_payload(client, collection_id, payload, options, flight.token, cell, flight),
+    )
+    if shared:
+        options.instrumentation.count("coalesced", cell=cell, query_uuid=query_uuid)
+
+    # This caller stops waiting when its own token is cancelled; the shared job is only
+    # cancelled once every caller has left
+    left = threading.Lock()
+
+    def leave(error: Optional[BaseException] = None) -> None:
+        if not left.acquire(blocking=False):
+            return
+        options.single_flight.leave(flight)
+        if error is not None:
+            outcome.set_exception(error)
+            return
+        try:
+            count, poll_result = flight.result()
+            if shared:
+                _record_shared_count(cache_key, count, poll_result, options.result_cache, options.journal)
+        except Exception as e:
+            outcome.set_exception(e)
+        else:
+            with_payload((count, poll_result))
+
+    if cancel_token is not None:
+        handle = cancel_token.add_callback(
+            lambda: leave(JobPollCancelled(f"Stopped waiting for shared query {cache_key[:12]}"))
+        )
+        outcome.add_done_callback(lambda _: cancel_token.remove_callback(handle))
+    flight.add_done_callback(lambda _: leave())
+    return outcome
+
+
+def _journalled(journal: Optional[JobJournal], key: str) -> bool:
+    """Whether `journal` has the query, which is then resumed from it rather than shared"""
+    return journal is not None and journal.get(key) is not None
+
+
+def _record_shared_count(
+    key: str,
+    count: int,
+    poll_result: Optional[PollResult],
+    result_cache: Optional[ResultCache],
+    journal: Optional[JobJournal],
+) -> None:
+    """Record a count fetched by another caller's flight in this caller's own journal and cache"""
+    if journal is not None:
+        journal.record(key, "fetched", poll_result.job_uuid if poll_result is not None else None, count)
+    if result_cache is not None:
+        result_cache.put(key, count)
+
+
+def run_payload(
+    client: "TaskApiClient",
+    collection_id: str,
+    payload: dict,
+    options: QueryOptions,
+    cancel_token: Optional[CancellationToken] = None,
+    cell: str = "",
+    flight: Optional[Flight] = None,
+) -> tuple[int, Optional[PollResult]]:
+    """Submit a built payload, poll it to completion and return its count and poll outcome.
+
+    The count is stored in `result_cache` if given. When running as a shared `flight`, the
+    job_uuid, latest status and number of polls are published on `flight.progress`.
+
+    With a `journal`, each step is recorded before moving on. A query the journal already
+    fetched returns its count with no poll outcome, and one it submitted is re-attached to
+    by polling the journalled job_uuid instead of submitting again.
+    """
+    progress = flight.progress if flight is not None else {}
+    key = canonical_payload_hash(payload["input"], collection_id)
+    fetch_status = _status_fetcher(client, progress, options.strict_decode)
+
+    entry = options.journal.get(key) if options.journal is not None else None
+    if entry is not None and entry.state == "fetched":
+        options.instrumentation.count("journal_skips", cell=cell, job_uuid=entry.job_uuid)
+        return entry.count, None
+
+    poll_result = None
+    job_uuid = entry.job_uuid if entry is not None else None
+    if job_uuid is not None:
+        progress["job_uuid"] = job_uuid
+        options.instrumentation.count("journal_reattached", cell=cell, job_uuid=job_uuid)
+        try:
+            poll_result = poll_job(job_uuid, partial(fetch_status, job_uuid), options.polling_policy, cancel_token)
+        except Exception as e:
+            if not _is_unknown_job(e):
+                raise
+            logger.warning("Journalled job %s is unknown upstream; resubmitting", job_uuid)
+
+    if poll_result is None:
+        # Send query and wait for completion
+        job_uuid = _submit_payload(client, payload, key, progress, options.instrumentation, cell, options.journal)
+        poll_result = poll_job(job_uuid, partial(fetch_status, job_uuid), options.polling_policy, cancel_token)
+
+    count = _fetch_payload_count(client, collection_id, key, poll_result, options, cell)
+    return count, poll_result
+
+
+def start_payload(
+    client: "TaskApiClient",
+    collection_id: str,
+    payload: dict,
+    options: QueryOptions,
+    cancel_token: Optional[CancellationToken] = None,
+    cell: str = "",
+    flight: Optional[Flight] = None,
+) -> "Future[tuple[int, Optional[PollResult]]]":
+    """Like `run_payload`, but return at once with a Future of the count and poll outcome.
+
+    The submit runs on the `job_tracker`'s I/O pool, the job is polled by the tracker and
+    its result is fetched on the pool once it is done, so no thread waits on the job.
+    """
+    progress = flight.progress if flight is not None else {}
+    key = canonical_payload_hash(payload["input"], collection_id)
+    fetch_status = _status_fetcher(client, progress, options.strict_decode)
+    outcome: Future = Future()
+
+    def fetch_count(poll_result: PollResult) -> tuple[int, PollResult]:
+        count = _fetch_payload_count(client, collection_id, key, poll_result, options, cell)
+        return count, poll_result
+
+    def track(job_uuid: str, on_error: Callable[[BaseException], None]) -> None:
+        tracked = options.job_tracker.track(
+            job_uuid, partial(fetch_status, job_uuid), options.polling_policy, cancel_token, fetch_count
+        )
+        _chain_future(tracked, outcome.set_result, on_error)
+
+    def submit() -> None:
+        if cancel_token is not None and cancel_token.cancelled:
+            raise JobPollCancelled(f"Query for cell {cell or key[:12]} was cancelled before it was submitted")
+        job_uuid = _submit_payload(client, payload, key, progress, options.instrumentation, cell, options.journal)
+        track(job_uuid, outcome.set_exception)
+
+    def resubmit_unknown(error: BaseException) -> None:
+        if not _is_unknown_job(error):
+            outcome.set_exception(error)
+            return
+        logger.warning("Journalled job %s is unknown upstream; resubmitting", progress["job_uuid"])
+        _chain_future(options.job_tracker.run(submit), lambda _: None, outcome.set_exception)
+
+    entry = options.journal.get(key) if options.journal is not None else None
+    if entry is not None and entry.state == "fetched":
+        options.instrumentation.count("journal_skips", cell=cell, job_uuid=entry.job_uuid)
+        outcome.set_result((entry.count, None))
+    elif entry is not None and entry.job_uuid is not None:
+        progress["job_uuid"] = entry.job_uuid
+        options.instrumentation.count("journal_reattached", cell=cell, job_uuid=entry.job_uuid)
+        track(entry.job_uuid, resubmit_unknown)
+    else:
+        _chain_future(options.job_tracker.run(submit), lambda _: None, outcome.set_exception)
+    return outcome
+
+
+def _status_fetcher(
+    client: "TaskApiClient", progress: dict, strict_decode: bool
+) -> Callable[[str], JobStatus]:
+    """A status request that also publishes the status and poll count on `progress`"""
+
+    def fetch_status(job_uuid: str) -> JobStatus:
+        status = get_job_status(client, job_uuid, strict_decode)
+        progress["status"] = status.status
+        progress["polls"] = progress.get("polls", 0) + 1
+        return status
+
+    return fetch_status
+
+
+def _submit_payload(
+    client: "TaskApiClient",
+    payload: dict,
+    key: str,
+    progress: dict,
+    instrumentation: Instrumentation,
+    cell: str,
+    journal: Optional[JobJournal],
+) -> str:
+    """Submit the payload, journal the job and return its job_uuid"""
+    start = time.perf_counter()
+    job_uuid = progress["job_uuid"] = submit_job(client, payload).job_uuid
+    instrumentation.observe("submit", time.perf_counter() - start, cell=cell, job_uuid=job_uuid)
+    if journal is not None:
+        journal.record(key, "submitted", job_uuid)
+    return job_uuid
+
+
+def _fetch_payload_count(
+    client: "TaskApiClient",
+    collection_id: str,
+    key: str,
+    poll_result: PollResult,
+    options: QueryOptions,
+    cell: str,
+) -> int:
+    """Fetch the count of a finished job, journalling and caching it"""
+    job_uuid = poll_result.job_uuid
+    options.instrumentation.observe("queue_wait", poll_result.elapsed, cell=cell, job_uuid=job_uuid)
+    options.instrumentation.count("polls", poll_result.polls, cell=cell, job_uuid=job_uuid)
+    if options.journal is not None:
+        options.journal.record(key, "done", job_uuid)
+
+    # Get results
+    with options.instrumentation.timer("result_fetch", cell=cell, job_uuid=job_uuid):
+        result = fetch_job_result(client, job_uuid, collection_id, options.strict_decode)
+    count = result.queryResult.count
+
+    if options.journal is not None:
+        options.journal.record(key, "fetched", job_uuid, count)
+    if options.result_cache is not None:
+        options.result_cache.put(key, count)
+    return count
+
+
+def _is_unknown_job(error: BaseException) -> bool:
+    """Whether `error` is the Task API's 404 for a job_uuid it does not know"""
+    import requests
+
+    return (
+        isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code == 404
+    )
+
+
+def _chain_future(
+    source: Future, on_result: Callable[[T], None], on_error: Callable[[BaseException], None]
+) -> None:
+    """Once `source` finishes, pass its result to `on_result` or its error to `on_error`"""
+
+    def forward(future: Future) -> None:
+        if future.cancelled():
+            on_error(JobPollCancelled("Query was cancelled before it was submitted"))
+        elif future.exception() is not None:
+            on_error(future.exception())
+        else:
+            on_result(future.result())
+
+    source.add_done_callback(forward)
+
+
+@dataclass
+class CellJob:
+    """A cell query that has been submitted and may still be running upstream."""
+
+    cell: str
+    payload: dict
+    job_uuid: Optional[str] = None
+    status: str = "SUBMITTED"
+    count: Optional[int] = None
+    polls: int = 0
+    error: Optional[str] = None
+    flight: Optional[Flight] = field(default=None, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.count is not None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+
+def refresh_cell_job(
+    client: "TaskApiClient",
+    job: CellJob,
+    collection_id: str,
+    result_cache: Optional[ResultCache] = None,
+    instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+    journal: Optional[JobJournal] = None,
+    strict_decode: bool = False,
+) -> CellJob:
+    """
+    Poll a pending cell job once, fetching its count if it has finished.
+
+    Errors are recorded on the job rather than raised, so one failing cell does not stop
+    the others from being refreshed. A job attached to a shared flight is polled by that
+    flight; refreshing only copies its progress and, once it finishes, its count. With a
+    `journal`, completion and the fetched count are recorded in it. `strict_decode`
+    validates responses without type coercion.
+
+    A job re-attached from the journal that the upstream no longer knows (its 404) is
+    resubmitted, and the new job_uuid journalled, instead of being recorded as an error.
+    """
+    if job.flight is not None and not (job.done or job.failed):
+        return _refresh_from_flight(job)
+    if job.done or job.failed or job.job_uuid is None:
+        return job
+
+    key = canonical_payload_hash(job.payload["input"], collection_id)
+    try:
+        status = get_job_status(client, job.job_uuid, strict_decode)
+        job.polls += 1
+        job.status = status.status
+        instrumentation.count("polls", cell=job.cell, job_uuid=job.job_uuid)
+        if status.status == "JOB_DONE":
+            if journal is not None:
+                journal.record(key, "done", job.job_uuid)
+            with instrumentation.timer("result_fetch", cell=job.cell, job_uuid=job.job_uuid):
+                result = fetch_job_result(client, job.job_uuid, collection_id, strict_decode)
+            job.count = result.queryResult.count
+            if journal is not None:
+                journal.record(key, "fetched", job.job_uuid, job.count)
+            if result_cache is not None:
+                result_cache.put(key, job.count)
+    except Exception as e:
+        if job.status == "REATTACHED" and _is_unknown_job(e):
+            return _resubmit_cell_job(client, job, key, instrumentation, journal)
+        job.error = str(e)
+        job.status = "ERROR"
+    return job
+
+
+def _resubmit_cell_job(
+    client: "TaskApiClient",
+    job: CellJob,
+    key: str,
+    instrumentation: Instrumentation,
+    journal: Optional[JobJournal],
+) -> CellJob:
+    """Submit a re-attached cell's payload again after its journalled job was lost upstream"""
+    logger.warning("Journalled job %s is unknown upstream; resubmitting", job.job_uuid)
+    try:
+        progress: dict = {}
+        job.job_uuid = _submit_payload(client, job.payload, key, progress, instrumentation, job.cell, journal)
+        job.status, job.polls = "SUBMITTED", 0
+    except Exception as e:
+        job.error = str(e)
+        job.status = "ERROR"
+    return job
+
+
+def _refresh_from_flight(job: CellJob) -> CellJob:
+    """Copy a shared flight's progress and outcome onto the cell job"""
+    flight = job.flight
+    job.job_uuid = flight.progress.get("job_uuid", job.job_uuid)
+    job.status = flight.progress.get("status", job.status)
+    job.polls = flight.progress.get("polls", job.polls)
+    if flight.done:
+        try:
+            job.count, _ = flight.result()
+            job.status = "JOB_DONE"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "ERROR"
+    return job
+
+
+def table_from_cell_counts(counts: Dict[str, int]) -> Dict[str, Dict[str, int]]:
+    """Assemble the 2x2 table dict from counts keyed by cell name"""
+    return {
+        "exposed": {
+            "with_outcome": counts["exposed_with_outcome"],
+            "without_outcome": counts["exposed_without_outcome"]
+        },
+        "unexposed": {
+            "with_outcome": counts["unexposed_with_outcome"],
+            "without_outcome": counts["unexposed_without_outcome"]
+        }
+    }
+
 
 @dataclass
 class ContingencyTableQuery:
-    exposure_omop_code: str
-    outcome_omop_code: str
+    exposure_omop_code: CodeSet
+    outcome_omop_code: CodeSet
     exposure_table: str = "Condition"
     outcome_table: str = "Condition"
+    max_concurrency: int = 4
+    polling_policy: PollingPolicy = field(default_factory=PollingPolicy)
+    result_cache: Optional[ResultCache] = None
+    instrumentation: Instrumentation = field(default=NULL_INSTRUMENTATION, repr=False)
+    single_flight: Optional[SingleFlight] = field(default=None, repr=False)
+    journal: Optional[JobJournal] = field(default=None, repr=False)
+    payload_compiler: Optional[PayloadCompiler] = field(default_factory=default_payload_compiler, repr=False)
+    strict_decode: bool = False
+    job_tracker: Optional[JobTracker] = field(default=None, repr=False)
+    extra_rules: Tuple[RuleSpec, ...] = ()
+    query_payloads: Dict[str, dict] = field(default_factory=dict, init=False, repr=False)
+    poll_results: Dict[str, PollResult] = field(default_factory=dict, init=False, repr=False)
+    # Inconsistencies in the counts of the last table derived by a MarginalQueryPlanner
+    derivation_issues: List[str] = field(default_factory=list, init=False, repr=False)
+
+    def __post_init__(self):
+        # Collections of codes are concept sets, each queried as one group of rules
+        self.exposure_omop_code = code_set(self.exposure_omop_code)
+        self.outcome_omop_code = code_set(self.outcome_omop_code)
+        self.extra_rules = tuple(self.extra_rules)
+
+    @property
+    def query_options(self) -> QueryOptions:
+        """The options its cell queries are run with"""
+        return QueryOptions.of(self)
 
     def execute_single_query(
-        self, 
-        client: TaskApiClient, 
-        collection_id: str, 
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
         owner: str,
         exposure_present: bool,
-        outcome_present: bool
+        outcome_present: bool,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> tuple[int, dict]:
-        """Execute a single query and return its count and the payload used"""
-        # Build the rules based on presence/absence
-        rules = [
-            CustomRule(
-                varname="OMOP",
-                varcat=self.exposure_table,
-                type_="TEXT",
-                operator="=" if exposure_present else "!=",
-                value=self.exposure_omop_code,
-            ),
-            CustomRule(
-                varname="OMOP",
-                varcat=self.outcome_table,
-                type_="TEXT",
-                operator="=" if outcome_present else "!=",
-                value=self.outcome_omop_code,
-            ),
+        """Execute a single query and return its count and the payload used.
+
+        The job is polled according to `self.polling_policy`; the outcome, including
+        the number of polls made, is recorded in `self.poll_results` under the cell name.
+        Counts found in `self.result_cache` are returned without submitting a job, and an
+        identical query already in flight in `self.single_flight` is waited on rather than
+        resubmitted. With `self.journal`, a cell fetched or submitted by an interrupted
+        earlier run is resumed from the journal. Stage timings are recorded on
+        `self.instrumentation`. With `self.job_tracker`, the job is polled by the tracker
+        while this call waits for it (see `start_single_query`).
+        """
+        if self.job_tracker is not None:
+            return self.start_single_query(
+                client, collection_id, owner, exposure_present, outcome_present, cancel_token
+            ).result()
+
+        cell = cell_name(exposure_present, outcome_present)
+        count, payload, poll_result = run_rules_query(
+            client,
+            collection_id,
+            owner,
+            self.cell_rules(exposure_present, outcome_present),
+            query_uuid=f"contingency_{exposure_present}_{outcome_present}_{uuid4().hex}",
+            options=self.query_options,
+            cancel_token=cancel_token,
+            cell=cell,
+        )
+        if poll_result is not None:
+            self.poll_results[cell] = poll_result
+
+        return count, payload
+
+    def start_single_query(
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        exposure_present: bool,
+        outcome_present: bool,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> "Future[tuple[int, dict]]":
+        """Start a single query on `self.job_tracker` and return a Future of its count and payload.
+
+        The non-blocking counterpart of `execute_single_query`: no thread waits while the
+        job runs, and the poll outcome is recorded in `self.poll_results` once it is done.
+        """
+        if self.job_tracker is None:
+            raise ValueError("start_single_query needs a job_tracker")
+        cell = cell_name(exposure_present, outcome_present)
+        started = start_rules_query(
+            client,
+            collection_id,
+            owner,
+            self.cell_rules(exposure_present, outcome_present),
+            query_uuid=f"contingency_{exposure_present}_{outcome_present}_{uuid4().hex}",
+            options=self.query_options,
+            cancel_token=cancel_token,
+            cell=cell,
+        )
+        return _cell_outcome(started, cell, self.poll_results)
+
+    def build_contingency_table(
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        concurrent: bool = True,
+        max_concurrency: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        planner: Optional["MarginalQueryPlanner"] = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """Build the complete 2x2 contingency table.
+
+        By default the four cell queries are submitted at once and awaited together,
+        so wall-clock time tracks the slowest upstream job rather than the sum of all four.
+        Set `concurrent=False` to run them one after another. Cancelling `cancel_token`
+        stops any cell that is still polling. With `self.job_tracker`, concurrent cells are
+        polled by the tracker instead of by a thread each.
+
+        With a `planner`, only the joint cell is queried directly and the others are
+        derived from marginal counts cached by the planner (see MarginalQueryPlanner).
+        Derived cells are only approximate if the upstream rounds counts; inconsistent
+        counts are listed in `self.derivation_issues`.
+
+        Raises:
+            CellQueryError: if any cell query fails, with the failing cells and their errors
+        """
+        cancel_token = cancel_token or CancellationToken()
+        self.poll_results = {}
+        self.derivation_issues = []
+        if planner is not None:
+            return planner.build_contingency_table(
+                self, client, collection_id, owner,
+                max_concurrency=max_concurrency or self.max_concurrency, cancel_token=cancel_token
+            )
+
+        outcomes = execute_table_cells(
+            {cell: (self, *presence) for cell, presence in CELLS.items()},
+            client, collection_id, owner, concurrent, max_concurrency or self.max_concurrency, cancel_token,
+        )
+
+        counts = {cell: count for cell, (count, _) in outcomes.items()}
+
+        # Store the payloads for display
+        self.query_payloads = {cell: payload for cell, (_, payload) in outcomes.items()}
+
+        return table_from_cell_counts(counts)
+
+    def cell_rules(self, exposure_present: bool, outcome_present: bool) -> List[RuleSpec]:
+        """Build the rules for one cell based on presence/absence, followed by `self.extra_rules`"""
+        return [
+            RuleSpec(self.exposure_table, self.exposure_omop_code, exposure_present),
+            RuleSpec(self.outcome_table, self.outcome_omop_code, outcome_present),
+            *self.extra_rules,
         ]
 
-        # Create cohort
-        cohort = Cohort(
-            groups=[Group(rules=rules, rules_operator="AND")],
-            groups_operator="OR",
+    def submit_cells(
+        self, client: "TaskApiClient", collection_id: str, owner: str
+    ) -> Dict[str, CellJob]:
+        """
+        Submit the four cell queries without waiting for them.
+
+        Cells whose count is in `self.result_cache` are returned already done and are not
+        submitted. Use `refresh_cell_job` to poll the rest. With `self.single_flight`, each
+        cell joins the shared flight for its query (starting one if needed), which submits
+        and polls the job in the background; refreshing then reads that flight. With
+        `self.journal`, cells it fetched are returned done and cells it submitted keep
+        their journalled job_uuid; pass the journal on to `refresh_cell_job` too, which
+        resubmits any of those the upstream no longer knows.
+        """
+        jobs = {}
+        for cell, (exposure_present, outcome_present) in CELLS.items():
+            payload = build_rules_payload(
+                collection_id,
+                owner,
+                self.cell_rules(exposure_present, outcome_present),
+                f"contingency_{exposure_present}_{outcome_present}_{uuid4().hex}",
+                self.payload_compiler,
+            )
+            job = jobs[cell] = CellJob(cell=cell, payload=payload)
+            key = canonical_payload_hash(payload["input"], collection_id)
+
+            if self.result_cache is not None:
+                cached_count = self.result_cache.get(key)
+                if cached_count is not None:
+                    job.count = cached_count
+                    job.status = "CACHED"
+                    self.instrumentation.count("cache_hits", cell=cell)
+                    continue
+
+            if self.single_flight is not None:
+                job.flight, shared = self.single_flight.start(
+                    key,
+                    partial(
+                        self._run_cell_flight, client, collection_id, payload, cell
+                    ),
+                )
+                if shared:
+                    job.status = "COALESCED"
+                    self.instrumentation.count("coalesced", cell=cell)
+                continue
+
+            entry = self.journal.get(key) if self.journal is not None else None
+            if entry is not None and entry.state == "fetched":
+                job.job_uuid, job.count, job.status = entry.job_uuid, entry.count, "JOURNALLED"
+                self.instrumentation.count("journal_skips", cell=cell, job_uuid=entry.job_uuid)
+                continue
+            if entry is not None and entry.job_uuid is not None:
+                job.job_uuid, job.status = entry.job_uuid, "REATTACHED"
+                self.instrumentation.count("journal_reattached", cell=cell, job_uuid=entry.job_uuid)
+                continue
+
+            try:
+                start = time.perf_counter()
+                job.job_uuid = submit_job(client, payload).job_uuid
+                self.instrumentation.observe(
+                    "submit", time.perf_counter() - start, cell=cell, job_uuid=job.job_uuid
+                )
+                if self.journal is not None:
+                    self.journal.record(key, "submitted", job.job_uuid)
+            except Exception as e:
+                job.error = str(e)
+                job.status = "ERROR"
+        return jobs
+
+    def _run_cell_flight(
+        self, client: "TaskApiClient", collection_id: str, payload: dict, cell: str, flight: Flight
+    ) -> tuple[int, PollResult]:
+        """Body of a shared flight started by `submit_cells`"""
+        return run_payload(client, collection_id, payload, self.query_options, flight.token, cell, flight)
+
+
+def execute_cells(
+    cells: Dict[str, tuple],
+    execute: Callable[..., T],
+    start: Optional[Callable[..., "Future[T]"]],
+    concurrent: bool,
+    max_concurrency: int,
+    cancel_token: CancellationToken,
+) -> Dict[str, T]:
+    """
+    Run one query per cell, passing the cell's arguments to `execute` or `start`.
+
+    Concurrent cells are started at once with `start`, if given, for a JobTracker to poll,
+    or else run by `execute` on a thread pool of `max_concurrency` threads. Otherwise they
+    are executed one after another.
+
+    Args:
+        cells: Arguments of each cell's query, keyed by cell name
+        execute: Runs one cell query and returns its outcome
+        start: Starts one cell query and returns a Future of its outcome
+        concurrent: Whether to run the cells at once
+        max_concurrency: Threads of the pool running concurrent cells without `start`
+        cancel_token: Cancelled when a concurrent cell fails, so the others stop
+
+    Raises:
+        CellQueryError: as soon as any cell fails, with the failing cells and their errors
+    """
+    if concurrent and start is not None:
+        return await_cells({cell: start(*args) for cell, args in cells.items()}, cancel_token)
+    if concurrent:
+        return run_cells_concurrently(
+            {cell: partial(execute, *args) for cell, args in cells.items()}, max_concurrency, cancel_token
         )
+    outcomes = {}
+    for cell, args in cells.items():
+        try:
+            outcomes[cell] = execute(*args)
+        except Exception as e:
+            raise CellQueryError({cell: e}) from e
+    return outcomes
+
 
-        # Create and execute query
-        query = CustomAvailabilityQuery(
-            cohort=cohort,
-            uuid=f"contingency_{exposure_present}_{outcome_present}",
-            owner=owner,
-            collection=collection_id,
-            protocol_version="v2",
-            char_salt="salt",
+def execute_table_cells(
+    cells: Dict[str, Tuple[ContingencyTableQuery, bool, bool]],
+    client: "TaskApiClient",
+    collection_id: str,
+    owner: str,
+    concurrent: bool,
+    max_concurrency: int,
+    cancel_token: CancellationToken,
+) -> Dict[str, tuple[int, dict]]:
+    """
+    Run 2x2 cell queries, each given as (query, exposure_present, outcome_present), with `execute_cells`.
+
+    Concurrent cells are polled by the queries' job_tracker when they all have one.
+
+    Raises:
+        CellQueryError: as soon as any cell fails, with the failing cells and their errors
+    """
+
+    def execute(query: ContingencyTableQuery, exposure_present: bool, outcome_present: bool) -> tuple[int, dict]:
+        return query.execute_single_query(
+            client, collection_id, owner, exposure_present, outcome_present, cancel_token
         )
 
-        payload = {"application": "AVAILABILITY_QUERY", "input": query.to_dict()}
+    def start(
+        query: ContingencyTableQuery, exposure_present: bool, outcome_present: bool
+    ) -> "Future[tuple[int, dict]]":
+        return query.start_single_query(
+            client, collection_id, owner, exposure_present, outcome_present, cancel_token
+        )
+
+    tracked = all(query.job_tracker is not None for query, _, _ in cells.values())
+    return execute_cells(cells, execute, start if tracked else None, concurrent, max_concurrency, cancel_token)
+
+
+def run_cells_concurrently(
+    calls: Dict[str, Callable[[], T]], max_concurrency: int, cancel_token: CancellationToken
+) -> Dict[str, T]:
+    """
+    Run one call per cell on a thread pool and wait for them together.
+
+    Raises:
+        CellQueryError: as soon as any call fails, after cancelling `cancel_token` so the
+            cells that are still polling stop
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(max_concurrency, len(calls)),
+        thread_name_prefix="contingency-cell",
+    )
+    try:
+        return await_cells({cell: executor.submit(call) for cell, call in calls.items()}, cancel_token)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def await_cells(futures: Dict[str, "Future[T]"], cancel_token: CancellationToken) -> Dict[str, T]:
+    """
+    Wait for one Future per cell and return their results.
+
+    Raises:
+        CellQueryError: as soon as any cell fails, after cancelling `cancel_token` so the
+            cells that are still polling stop
+    """
+    # Stop waiting as soon as any cell fails; the table is unusable without it
+    wait(futures.values(), return_when=FIRST_EXCEPTION)
+
+    errors = {
+        cell: future.exception()
+        for cell, future in futures.items()
+        if future.done() and not future.cancelled() and future.exception() is not None
+    }
+    if errors:
+        # Release the cells that are still polling
+        cancel_token.cancel()
+        raise CellQueryError(errors) from next(iter(errors.values()))
+
+    return {cell: future.result() for cell, future in futures.items()}
 
-        print(payload)
-        
-        # Send query and get job response
-        response = client.post("/task/", data=payload)
-        job_response = JobResponse.from_dict(response.json())
 
-        print(job_response)
+def _cell_outcome(
+    started: "Future[tuple[int, dict, Optional[PollResult]]]", cell: str, poll_results: Dict[str, PollResult]
+) -> "Future[tuple[int, dict]]":
+    """Future of a started cell query's count and payload, recording its poll outcome in `poll_results`"""
+    outcome: Future = Future()
 
-        # Wait for completion
-        while True:
-            status_response = client.get(f"/task/status/{job_response.job_uuid}")
-            status = JobStatus.from_api_response(status_response.json())
-            print(status)
+    def record(result: tuple[int, dict, Optional[PollResult]]) -> None:
+        count, payload, poll_result = result
+        if poll_result is not None:
+            poll_results[cell] = poll_result
+        outcome.set_result((count, payload))
 
-            if status.status == "JOB_DONE":
-                break
-            time.sleep(2)
+    _chain_future(started, record, outcome.set_exception)
+    return outcome
 
-        # Get results
-        result_response = client.get(f"/task/results/{job_response.job_uuid}/{collection_id}")
-        result = QueryResult.from_api_response(result_response.json())
 
-        print(result)
-        
-        return result.queryResult.count, payload
+def categorical_cell_name(exposure_level: str, outcome_level: str) -> str:
+    """Return the cell name of an exposure level / outcome level pair"""
+    return f"{exposure_level} x {outcome_level}"
+
+
+@dataclass
+class CategoricalTableQuery:
+    """
+    R x C contingency table of exposure levels (e.g. drug classes) against outcome levels.
+
+    Each level maps a label to an OMOP code or a concept set. Cell (i, j) counts patients with exposure
+    level i and outcome level j. With `exclusive_levels` (the default) they must also lack
+    the codes of every other level on the same side, so no patient is counted in two
+    cells, as the tests on the table assume. A reference level named by
+    `exposure_reference` / `outcome_reference` counts the patients with none of that
+    side's codes and comes last.
+
+    All R*C cell queries are submitted at once and awaited together; with a
+    `job_tracker`, they are polled by the tracker instead of by a thread each.
+    """
+
+    exposure_levels: Dict[str, CodeSet]
+    outcome_levels: Dict[str, CodeSet]
+    exposure_table: str = "Condition"
+    outcome_table: str = "Condition"
+    exposure_reference: Optional[str] = None
+    outcome_reference: Optional[str] = None
+    exclusive_levels: bool = True
+    max_concurrency: int = 8
+    polling_policy: PollingPolicy = field(default_factory=PollingPolicy)
+    result_cache: Optional[ResultCache] = None
+    instrumentation: Instrumentation = field(default=NULL_INSTRUMENTATION, repr=False)
+    single_flight: Optional[SingleFlight] = field(default=None, repr=False)
+    journal: Optional[JobJournal] = field(default=None, repr=False)
+    payload_compiler: Optional[PayloadCompiler] = field(default_factory=default_payload_compiler, repr=False)
+    strict_decode: bool = False
+    job_tracker: Optional[JobTracker] = field(default=None, repr=False)
+    query_payloads: Dict[str, dict] = field(default_factory=dict, init=False, repr=False)
+    poll_results: Dict[str, PollResult] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.exposure_levels = {label: code_set(codes) for label, codes in self.exposure_levels.items()}
+        self.outcome_levels = {label: code_set(codes) for label, codes in self.outcome_levels.items()}
+        for side, levels, reference in (
+            ("exposure", self.exposure_levels, self.exposure_reference),
+            ("outcome", self.outcome_levels, self.outcome_reference),
+        ):
+            if reference in levels:
+                raise ValueError(f"The {side} reference level {reference!r} is also a coded level")
+            if len(levels) + (reference is not None) < 2:
+                raise ValueError(f"At least two {side} levels are needed, counting the reference level")
+
+    @property
+    def query_options(self) -> QueryOptions:
+        """The options its cell queries are run with"""
+        return QueryOptions.of(self)
+
+    @property
+    def exposure_labels(self) -> List[str]:
+        """Row labels, in table order"""
+        return list(self.exposure_levels) + ([self.exposure_reference] if self.exposure_reference else [])
+
+    @property
+    def outcome_labels(self) -> List[str]:
+        """Column labels, in table order"""
+        return list(self.outcome_levels) + ([self.outcome_reference] if self.outcome_reference else [])
+
+    def cell_rules(self, exposure_level: str, outcome_level: str) -> List[RuleSpec]:
+        """Build the rules for one cell from its exposure and outcome levels"""
+        return (
+            _level_rules(self.exposure_table, self.exposure_levels, exposure_level, self.exclusive_levels)
+            + _level_rules(self.outcome_table, self.outcome_levels, outcome_level, self.exclusive_levels)
+        )
+
+    def execute_cell(
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        exposure_level: str,
+        outcome_level: str,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> tuple[int, dict]:
+        """Execute one cell query and return its count and the payload used.
+
+        Polling, caching, single-flight sharing, job tracking and instrumentation work as in
+        ContingencyTableQuery.execute_single_query.
+        """
+        if self.job_tracker is not None:
+            return self.start_cell(
+                client, collection_id, owner, exposure_level, outcome_level, cancel_token
+            ).result()
+
+        cell = categorical_cell_name(exposure_level, outcome_level)
+        row = self.exposure_labels.index(exposure_level)
+        column = self.outcome_labels.index(outcome_level)
+        count, payload, poll_result = run_rules_query(
+            client,
+            collection_id,
+            owner,
+            self.cell_rules(exposure_level, outcome_level),
+            query_uuid=f"contingency_{row}_{column}_{uuid4().hex}",
+            options=self.query_options,
+            cancel_token=cancel_token,
+            cell=cell,
+        )
+        if poll_result is not None:
+            self.poll_results[cell] = poll_result
+
+        return count, payload
+
+    def start_cell(
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        exposure_level: str,
+        outcome_level: str,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> "Future[tuple[int, dict]]":
+        """Start one cell query on `self.job_tracker` and return a Future of its count and payload.
+
+        See ContingencyTableQuery.start_single_query.
+        """
+        if self.job_tracker is None:
+            raise ValueError("start_cell needs a job_tracker")
+        cell = categorical_cell_name(exposure_level, outcome_level)
+        row = self.exposure_labels.index(exposure_level)
+        column = self.outcome_labels.index(outcome_level)
+        started = start_rules_query(
+            client,
+            collection_id,
+            owner,
+            self.cell_rules(exposure_level, outcome_level),
+            query_uuid=f"contingency_{row}_{column}_{uuid4().hex}",
+            options=self.query_options,
+            cancel_token=cancel_token,
+            cell=cell,
+        )
+        return _cell_outcome(started, cell, self.poll_results)
 
     def build_contingency_table(
-        self, 
-        client: TaskApiClient, 
-        collection_id: str, 
-        owner: str
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        concurrent: bool = True,
+        max_concurrency: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Dict[str, Dict[str, int]]:
-        """Build the complete 2x2 contingency table"""
-        # Execute all queries and collect results and payloads
-        exposed_with_outcome, payload_11 = self.execute_single_query(
-            client, collection_id, owner, 
-            exposure_present=True, outcome_present=True
+        """Build the R x C table as {exposure level: {outcome level: count}}.
+
+        Set `concurrent=False` to run the cell queries one after another.
+
+        Raises:
+            CellQueryError: if any cell query fails, with the failing cells and their errors
+        """
+        cancel_token = cancel_token or CancellationToken()
+        self.poll_results = {}
+        outcomes = execute_cells(
+            {
+                categorical_cell_name(exposure_level, outcome_level): (exposure_level, outcome_level)
+                for exposure_level in self.exposure_labels
+                for outcome_level in self.outcome_labels
+            },
+            partial(self.execute_cell, client, collection_id, owner, cancel_token=cancel_token),
+            partial(self.start_cell, client, collection_id, owner, cancel_token=cancel_token)
+            if self.job_tracker is not None else None,
+            concurrent,
+            max_concurrency or self.max_concurrency,
+            cancel_token,
         )
-        exposed_without_outcome, payload_10 = self.execute_single_query(
-            client, collection_id, owner, 
-            exposure_present=True, outcome_present=False
+
+        self.query_payloads = {cell: payload for cell, (_, payload) in outcomes.items()}
+        return {
+            exposure_level: {
+                outcome_level: outcomes[categorical_cell_name(exposure_level, outcome_level)][0]
+                for outcome_level in self.outcome_labels
+            }
+            for exposure_level in self.exposure_labels
+        }
+
+
+def stratified_cell_name(stratum: str, cell: str) -> str:
+    """Return the cell name of a 2x2 cell within a stratum"""
+    return f"{stratum}: {cell}"
+
+
+@dataclass
+class StratifiedTableQuery:
+    """
+    2x2xK table of an exposure against an outcome within each of K strata (e.g. sex).
+
+    Each stratum maps a label to an OMOP code or a concept set in `stratum_table`, and its
+    2x2 table is that of a ContingencyTableQuery whose every cell also carries the
+    stratum's rules (see `stratum_query`). With `exclusive_strata` (the default) a
+    stratum's patients must also lack the codes of every other stratum, so no patient is
+    counted twice. A reference stratum named by `stratum_reference` counts the patients
+    with none of the stratum codes and comes last.
+
+    All 4*K cell queries are submitted at once and awaited together; with a
+    `job_tracker`, they are polled by the tracker instead of by a thread each. The result
+    is the input of `contingency_stats.methods.mantel_haenszel.MantelHaenszelTest`.
+    """
+
+    exposure_omop_code: CodeSet
+    outcome_omop_code: CodeSet
+    strata: Dict[str, CodeSet]
+    exposure_table: str = "Condition"
+    outcome_table: str = "Condition"
+    stratum_table: str = "Person"
+    stratum_reference: Optional[str] = None
+    exclusive_strata: bool = True
+    max_concurrency: int = 16
+    polling_policy: PollingPolicy = field(default_factory=PollingPolicy)
+    result_cache: Optional[ResultCache] = None
+    instrumentation: Instrumentation = field(default=NULL_INSTRUMENTATION, repr=False)
+    single_flight: Optional[SingleFlight] = field(default=None, repr=False)
+    journal: Optional[JobJournal] = field(default=None, repr=False)
+    payload_compiler: Optional[PayloadCompiler] = field(default_factory=default_payload_compiler, repr=False)
+    strict_decode: bool = False
+    job_tracker: Optional[JobTracker] = field(default=None, repr=False)
+    query_payloads: Dict[str, Dict[str, dict]] = field(default_factory=dict, init=False, repr=False)
+    poll_results: Dict[str, Dict[str, PollResult]] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.exposure_omop_code = code_set(self.exposure_omop_code)
+        self.outcome_omop_code = code_set(self.outcome_omop_code)
+        self.strata = {label: code_set(codes) for label, codes in self.strata.items()}
+        if self.stratum_reference in self.strata:
+            raise ValueError(f"The reference stratum {self.stratum_reference!r} is also a coded stratum")
+        if len(self.strata) + (self.stratum_reference is not None) < 2:
+            raise ValueError("At least two strata are needed, counting the reference stratum")
+
+    @property
+    def stratum_labels(self) -> List[str]:
+        """Stratum labels, in table order"""
+        return list(self.strata) + ([self.stratum_reference] if self.stratum_reference else [])
+
+    def table_query(self) -> ContingencyTableQuery:
+        """The unstratified 2x2 query, sharing this query's caching, polling and tracking options"""
+        own = {f.name for f in fields(self)}
+        return ContingencyTableQuery(
+            **{f.name: getattr(self, f.name) for f in fields(ContingencyTableQuery) if f.init and f.name in own}
         )
-        unexposed_with_outcome, payload_01 = self.execute_single_query(
-            client, collection_id, owner, 
-            exposure_present=False, outcome_present=True
+
+    def stratum_query(self, stratum: str) -> ContingencyTableQuery:
+        """The 2x2 query of one stratum: `table_query` with the stratum's rules added to every cell"""
+        return replace(
+            self.table_query(),
+            extra_rules=tuple(_level_rules(self.stratum_table, self.strata, stratum, self.exclusive_strata)),
         )
-        unexposed_without_outcome, payload_00 = self.execute_single_query(
-            client, collection_id, owner, 
-            exposure_present=False, outcome_present=False
+
+    def build_stratified_table(
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        concurrent: bool = True,
+        max_concurrency: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """Build the stratified table as {stratum: 2x2 table}, strata in `stratum_labels` order.
+
+        The payloads sent and the poll outcomes are stored per stratum in
+        `self.query_payloads` and `self.poll_results`. Set `concurrent=False` to run the
+        cell queries one after another.
+
+        Raises:
+            CellQueryError: if any cell query fails, with the failing cells and their errors
+        """
+        cancel_token = cancel_token or CancellationToken()
+        queries = {stratum: self.stratum_query(stratum) for stratum in self.stratum_labels}
+        outcomes = execute_table_cells(
+            {
+                stratified_cell_name(stratum, cell): (query, exposure_present, outcome_present)
+                for stratum, query in queries.items()
+                for cell, (exposure_present, outcome_present) in CELLS.items()
+            },
+            client, collection_id, owner, concurrent, max_concurrency or self.max_concurrency, cancel_token,
         )
-        
-        # Store the payloads for display
+
         self.query_payloads = {
-            "exposed_with_outcome": payload_11,
-            "exposed_without_outcome": payload_10,
-            "unexposed_with_outcome": payload_01,
-            "unexposed_without_outcome": payload_00
+            stratum: {cell: outcomes[stratified_cell_name(stratum, cell)][1] for cell in CELLS}
+            for stratum in queries
         }
-        
-        table = {
-            "exposed": {
-                "with_outcome": exposed_with_outcome,
-                "without_outcome": exposed_without_outcome
-            },
-            "unexposed": {
-                "with_outcome": unexposed_with_outcome,
-                "without_outcome": unexposed_without_outcome
-            }
+        self.poll_results = {stratum: query.poll_results for stratum, query in queries.items()}
+        return {
+            stratum: table_from_cell_counts({cell: outcomes[stratified_cell_name(stratum, cell)][0] for cell in CELLS})
+            for stratum in queries
         }
-        return table
+
+
+def _level_rules(table: str, levels: Dict[str, CodeSet], level: str, exclusive: bool) -> List[RuleSpec]:
+    """Rules selecting one level: its code present (and, if exclusive, the others absent),
+    or for the reference level every code absent"""
+    if level not in levels:
+        return [RuleSpec(table, code, False) for code in levels.values()]
+    rules = [RuleSpec(table, levels[level], True)]
+    if exclusive:
+        rules += [RuleSpec(table, code, False) for other, code in levels.items() if other != level]
+    return rules
@@ -1,9 +1,9 @@
 from contingency_table_builder import ContingencyTableQuery
-from hutch_bunny.core.upstream.task_api_client import TaskApiClient
+from client_factory import get_task_api_client
 from hutch_bunny.core.settings import get_settings, DaemonSettings
 
 settings: DaemonSettings = get_settings(daemon=True)
-client = TaskApiClient(settings)
+client = get_task_api_client(settings)
 
 # Initialize the query builder
 builder = ContingencyTableQuery(
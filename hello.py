@@ -1,5 +1,5 @@
 import time
-from hutch_bunny.core.upstream.task_api_client import TaskApiClient
+from client_factory import get_task_api_client
 from hutch_bunny.core.settings import get_settings, DaemonSettings
 from hutch_bunny.core.rquest_dto.cohort import Cohort
 from hutch_bunny.core.rquest_dto.group import Group
@@ -10,7 +10,7 @@ from job_response import JobResponse
 
 settings: DaemonSettings = get_settings(daemon=True)
 
-client = TaskApiClient(settings)
+client = get_task_api_client(settings)
 
 url = "/task/"
 groups = [
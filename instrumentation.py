@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Labels kept when aggregating; per-job labels such as job_uuid only go to event-level sinks
+AGGREGATE_LABELS = ("cell",)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+@dataclass(frozen=True)
+class MetricEvent:
+    """A single timer observation, counter increment or gauge reading."""
+
+    kind: str  # "timer", "counter" or "gauge"
+    name: str
+    value: float
+    labels: Dict[str, str]
+
+
+class MetricSink(Protocol):
+    """Receives every event recorded through an Instrumentation."""
+
+    def record(self, event: MetricEvent) -> None:
+        ...
+
+
+def _aggregate_key(event: MetricEvent) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    labels = tuple((k, event.labels[k]) for k in AGGREGATE_LABELS if event.labels.get(k))
+    return event.name, labels
+
+
+class LogSink:
+    """Writes one log line per event."""
+
+    def __init__(self, log: Optional[logging.Logger] = None, level: int = logging.INFO):
+        self.log = log or logger
+        self.level = level
+
+    def record(self, event: MetricEvent) -> None:
+        labels = " ".join(f"{k}={v}" for k, v in event.labels.items())
+        self.log.log(self.level, "%s %s=%.6g %s", event.kind, event.name, event.value, labels)
+
+
+class HistogramSink:
+    """Keeps every timer observation in memory, grouped by metric name and cell, for percentile summaries."""
+
+    def __init__(self):
+        self._values: Dict[Tuple, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, event: MetricEvent) -> None:
+        if event.kind != "timer":
+            return
+        with self._lock:
+            self._values[_aggregate_key(event)].append(event.value)
+
+    def values(self, name: str, **labels: str) -> List[float]:
+        """All observations of a metric, optionally restricted to matching labels"""
+        with self._lock:
+            return [
+                value
+                for (metric, key_labels), values in self._values.items()
+                if metric == name and all(dict(key_labels).get(k) == v for k, v in labels.items())
+                for value in values
+            ]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """count, sum and p50/p95/p99 per metric (all cells combined)"""
+        with self._lock:
+            grouped: Dict[str, List[float]] = defaultdict(list)
+            for (metric, _), values in self._values.items():
+                grouped[metric].extend(values)
+
+        summary = {}
+        for metric, values in grouped.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[metric] = {
+                "count": len(values),
+                "sum": float(np.sum(values)),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+            }
+        return summary
+
+
+class PrometheusTextSink:
+    """Aggregates events into counters and histograms rendered in the Prometheus text format."""
+
+    def __init__(self, namespace: str = "query_ui", buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[Tuple, float] = defaultdict(float)
+        self._gauges: Dict[Tuple, float] = {}
+        self._histograms: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, event: MetricEvent) -> None:
+        key = _aggregate_key(event)
+        with self._lock:
+            if event.kind == "counter":
+                self._counters[key] += event.value
+                return
+            if event.kind == "gauge":
+                self._gauges[key] = event.value
+                return
+            # Per-bucket counts followed by the running sum and count
+            state = self._histograms.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            bucket = bisect_left(self.buckets, event.value)
+            if bucket < len(self.buckets):
+                state[bucket] += 1
+            state[-2] += event.value
+            state[-1] += 1
+
+    def render(self) -> str:
+        """Return the current metrics as Prometheus exposition text"""
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self._counters}):
+                metric = f"{self.namespace}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+            for name in sorted({n for n, _ in self._gauges}):
+                metric = f"{self.namespace}_{name}"
+                lines.append(f"# TYPE {metric} gauge")
+                for (n, labels), value in sorted(self._gauges.items()):
+                    if n == name:
+                        lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+            for name in sorted({n for n, _ in self._histograms}):
+                metric = f"{self.namespace}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (n, labels), state in sorted(self._histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0.0
+                    for bound, bucket_count in zip(self.buckets, state):
+                        cumulative += bucket_count
+                        lines.append(f"{metric}_bucket{_format_labels(labels, le=f'{bound:g}')} {cumulative:g}")
+                    lines.append(f"{metric}_bucket{_format_labels(labels, le='+Inf')} {state[-1]:g}")
+                    lines.append(f"{metric}_sum{_format_labels(labels)} {state[-2]:.6f}")
+                    lines.append(f"{metric}_count{_format_labels(labels)} {state[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _NullTimer:
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("instrumentation", "name", "labels", "start")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str, labels: Dict[str, str]):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.instrumentation.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class Instrumentation:
+    """
+    Timers and counters for the query lifecycle, fanned out to pluggable sinks.
+
+    With no sinks every call returns immediately (timers are a shared no-op context
+    manager), so leaving instrumentation disabled costs close to nothing on the hot path.
+
+    Labels such as job_uuid and cell are attached to each event; aggregating sinks keep
+    only the cell label to bound their cardinality.
+
+    Args:
+        sinks: Sinks that receive every event, e.g. LogSink, HistogramSink, PrometheusTextSink
+    """
+
+    def __init__(self, sinks: Iterable[MetricSink] = ()):
+        self.sinks = list(sinks)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+    def timer(self, name: str, **labels: str):
+        """Context manager recording the elapsed time of its block"""
+        if not self.sinks:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        if not self.sinks:
+            return
+        event = MetricEvent("timer", name, seconds, labels)
+        for sink in self.sinks:
+            sink.record(event)
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        if not self.sinks:
+            return
+        event = MetricEvent("counter", name, value, labels)
+        for sink in self.sinks:
+            sink.record(event)
+
+    def gauge(self, name: str, value: float, **labels: str) -> None:
+        """Record the current value of a quantity that goes up and down, e.g. a limit"""
+        if not self.sinks:
+            return
+        event = MetricEvent("gauge", name, value, labels)
+        for sink in self.sinks:
+            sink.record(event)
+
+
+# Shared disabled instance used as the default everywhere
+NULL_INSTRUMENTATION = Instrumentation()
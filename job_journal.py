@@ -0,0 +1,133 @@
+"""
+Write-ahead journal of upstream jobs, so an interrupted run can resume where it stopped.
+
+Each cell query is identified by its canonical_payload_hash. As it moves through the
+job lifecycle its state is appended to a JSON-lines file and flushed to disk before the
+run moves on:
+
+    submitted  the job was accepted upstream; its job_uuid is recorded
+    done       the job reported JOB_DONE
+    fetched    the count was fetched; it is recorded with the entry
+
+A run restarted with the same journal skips cells that were fetched, re-attaches to jobs
+that were submitted by polling their existing job_uuid, and submits only the cells that
+never reached the upstream. If the upstream no longer knows a journalled job, the cell
+is resubmitted.
+
+The file is append-only and replayed on open, keeping the latest entry per key; a torn
+last line left by a crash is dropped. Use one journal per run (or screen): fetched
+entries are reused for as long as the journal is.
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Literal, Optional
+
+JournalState = Literal["submitted", "done", "fetched"]
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    """Latest recorded state of one cell query."""
+
+    key: str
+    state: JournalState
+    job_uuid: Optional[str] = None
+    count: Optional[int] = None
+    recorded_at: float = 0.0
+
+
+class JobJournal:
+    """
+    Append-only journal of cell query states, safe to share between threads.
+
+    Args:
+        path: JSON-lines file to append to (created if missing, replayed if present)
+        durable: fsync after every record, so a record survives a machine crash and not
+            just a process crash
+    """
+
+    def __init__(self, path: str, durable: bool = True):
+        self.path = path
+        self.durable = durable
+        self._entries: Dict[str, JournalEntry] = {}
+        self._lock = threading.Lock()
+        self._replay()
+        self._file = self._open_for_append()
+
+    def __enter__(self) -> "JobJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[JournalEntry]:
+        """The latest entry for a cell query, if it was journalled"""
+        return self._entries.get(key)
+
+    def pending(self) -> List[JournalEntry]:
+        """Entries of jobs submitted upstream whose count has not been fetched"""
+        with self._lock:
+            return [entry for entry in self._entries.values() if entry.state != "fetched"]
+
+    def record(
+        self, key: str, state: JournalState, job_uuid: Optional[str] = None, count: Optional[int] = None
+    ) -> JournalEntry:
+        """Append a state change and flush it to disk before returning"""
+        entry = JournalEntry(key=key, state=state, job_uuid=job_uuid, count=count, recorded_at=time.time())
+        line = json.dumps(asdict(entry), separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.durable:
+                os.fsync(self._file.fileno())
+            self._entries[key] = entry
+        return entry
+
+    def compact(self) -> None:
+        """Rewrite the file with only the latest entry per key"""
+        with self._lock:
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(asdict(entry), separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(temporary_path, self.path)
+            self._file = self._open_for_append()
+
+    def close(self) -> None:
+        """Close the journal file; further records fail. Safe to call more than once"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _open_for_append(self):
+        # The handle lives as long as the journal, so no with-block: close() (or leaving
+        # the journal's own with-block) closes it, and compact() closes it before replacing it
+        return open(self.path, "a", encoding="utf-8")  # noqa: SIM115
+
+    def _replay(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        # Drop a record torn by a crash mid-write, so new records start on a fresh line
+        intact = data[:data.rfind(b"\n") + 1]
+        if len(intact) < len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(len(intact))
+
+        for line in intact.decode("utf-8").splitlines():
+            try:
+                entry = JournalEntry(**json.loads(line))
+            except (ValueError, TypeError):
+                continue
+            self._entries[entry.key] = entry
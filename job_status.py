@@ -1,4 +1,10 @@
-from pydantic import BaseModel
+from typing import Dict, List
+
+from pydantic import BaseModel, TypeAdapter
+
+# Body of a status response: [{job_uuid: status}]
+_STATUS_BODY = TypeAdapter(List[Dict[str, str]])
+
 
 class JobStatus(BaseModel):
     job_uuid: str
@@ -8,3 +14,9 @@ class JobStatus(BaseModel):
     def from_api_response(cls, response_data: list) -> 'JobStatus':
         job_uuid, status = next(iter(response_data[0].items()))
         return cls(job_uuid=job_uuid, status=status)
+
+    @classmethod
+    def from_api_json(cls, body: bytes, strict: bool = False) -> 'JobStatus':
+        """Parse and validate a raw status response body in one pass; `strict` disables type coercion"""
+        job_uuid, status = next(iter(_STATUS_BODY.validate_json(body, strict=strict)[0].items()))
+        return cls.model_validate({"job_uuid": job_uuid, "status": status}, strict=strict)
@@ -0,0 +1,256 @@
+"""
+Shared polling of every outstanding upstream job.
+
+`poll_job` holds its caller's thread for the whole life of a job, sleeping between
+status requests, so a screen with hundreds of pending jobs holds hundreds of blocked
+threads, each polling on its own schedule. A JobTracker owns the outstanding jobs
+instead: one scheduler thread keeps them in a heap ordered by next poll time, and a
+small pool of I/O threads makes the status requests as they fall due. When a job reports
+JOB_DONE its `on_done` follow-up (typically the result fetch) runs on the same pool and
+the job's Future resolves with its return value. Thousands of pending jobs cost a heap
+entry each rather than a thread.
+
+Each job keeps its own PollingPolicy (fast probes, backoff, jitter and deadline) and
+CancellationToken, so a tracked job times out and is cancelled exactly as under
+`poll_job`, with JobPollTimeout and JobPollCancelled set on its Future.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, Optional, Set, Tuple
+
+from job_status import JobStatus
+from polling import CancellationToken, JobPollCancelled, JobPollTimeout, PollingPolicy, PollResult
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobTrackerStats:
+    """Counters of a JobTracker."""
+
+    tracked: int = 0
+    polls: int = 0
+    done: int = 0
+    failed: int = 0
+    max_outstanding: int = 0
+
+
+class _TrackedJob:
+    """A job owned by the tracker, with its polling state"""
+
+    __slots__ = (
+        "job_uuid", "fetch_status", "policy", "cancel_token", "on_done", "future",
+        "intervals", "started", "polls", "cancel_handle", "finished",
+    )
+
+    def __init__(
+        self,
+        job_uuid: str,
+        fetch_status: Callable[[], JobStatus],
+        policy: PollingPolicy,
+        cancel_token: CancellationToken,
+        on_done: Optional[Callable[[PollResult], Any]],
+    ):
+        self.job_uuid = job_uuid
+        self.fetch_status = fetch_status
+        self.policy = policy
+        self.cancel_token = cancel_token
+        self.on_done = on_done
+        self.future: Future = Future()
+        self.intervals: Iterator[float] = policy.intervals()
+        self.started = time.monotonic()
+        self.polls = 0
+        self.cancel_handle = -1
+        self.finished = False
+
+
+class JobTracker:
+    """
+    Polls every tracked job from one scheduler thread and a small I/O pool.
+
+    Thread-safe. Close the tracker (or use it as a context manager) when done with it:
+    jobs still outstanding then fail with JobPollCancelled.
+
+    Args:
+        max_workers: Threads making status requests and running `on_done` follow-ups
+        name: Prefix of the tracker's thread names
+    """
+
+    def __init__(self, max_workers: int = 4, name: str = "job-tracker"):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.stats = JobTrackerStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-io")
+        self._heap: List[Tuple[float, int, _TrackedJob]] = []
+        self._sequence = itertools.count()
+        self._jobs: Set[_TrackedJob] = set()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._scheduler = threading.Thread(target=self._schedule, name=f"{name}-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def __len__(self) -> int:
+        """Number of jobs not yet resolved"""
+        with self._condition:
+            return len(self._jobs)
+
+    def __enter__(self) -> "JobTracker":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def run(self, fn: Callable[..., Any], *args) -> Future:
+        """Run `fn(*args)` on the tracker's I/O pool, e.g. to submit a job without blocking"""
+        return self._executor.submit(fn, *args)
+
+    def track(
+        self,
+        job_uuid: str,
+        fetch_status: Callable[[], JobStatus],
+        policy: Optional[PollingPolicy] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        on_done: Optional[Callable[[PollResult], Any]] = None,
+    ) -> Future:
+        """
+        Poll a job until it reports JOB_DONE, without blocking the caller.
+
+        The first poll is made straight away and later ones follow `policy`, as in
+        `poll_job`.
+
+        Args:
+            job_uuid: The upstream job being polled, used for reporting
+            fetch_status: Callable performing one status request
+            policy: Polling schedule (default: PollingPolicy())
+            cancel_token: Optional token that stops polling the job when cancelled
+            on_done: Called on the I/O pool with the PollResult once the job is done,
+                e.g. to fetch its result
+
+        Returns:
+            Future of the PollResult, or of `on_done`'s return value if given. It fails with
+            JobPollTimeout if the policy deadline passes, JobPollCancelled if `cancel_token`
+            is cancelled or the tracker closed, or whatever `fetch_status` or `on_done` raised.
+        """
+        job = _TrackedJob(
+            job_uuid, fetch_status, policy or PollingPolicy(), cancel_token or CancellationToken(), on_done
+        )
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("JobTracker is closed")
+            self._jobs.add(job)
+            self.stats.tracked += 1
+            self.stats.max_outstanding = max(self.stats.max_outstanding, len(self._jobs))
+        # Registered before the first poll so the handle is set by the time the job resolves
+        job.cancel_handle = job.cancel_token.add_callback(lambda: self._cancel(job))
+        with self._condition:
+            if not (job.finished or self._closed):
+                self._executor.submit(self._poll, job)
+        return job.future
+
+    def close(self) -> None:
+        """Stop polling; jobs still outstanding fail with JobPollCancelled"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            abandoned = list(self._jobs)
+            self._heap.clear()
+            self._condition.notify()
+        for job in abandoned:
+            self._resolve(job, error=JobPollCancelled(f"Job tracker closed while polling job {job.job_uuid}"))
+        self._scheduler.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule(self) -> None:
+        """Scheduler thread: hand every job whose next poll is due to the I/O pool"""
+        with self._condition:
+            while not self._closed:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                _, _, job = heapq.heappop(self._heap)
+                if not job.finished:
+                    self._executor.submit(self._poll, job)
+
+    def _poll(self, job: _TrackedJob) -> None:
+        """Make one status request for `job` and resolve or reschedule it"""
+        if job.finished:
+            return
+        if job.cancel_token.cancelled:
+            self._cancel(job)
+            return
+        try:
+            status = job.fetch_status()
+        except BaseException as e:
+            self._resolve(job, error=e)
+            return
+
+        job.polls += 1
+        with self._condition:
+            self.stats.polls += 1
+        elapsed = time.monotonic() - job.started
+        if status.status == "JOB_DONE":
+            self._complete(job, PollResult(job_uuid=job.job_uuid, status=status, polls=job.polls, elapsed=elapsed))
+            return
+
+        interval = next(job.intervals)
+        if job.policy.deadline is not None:
+            remaining = job.policy.deadline - elapsed
+            if remaining <= 0:
+                self._resolve(job, error=JobPollTimeout(
+                    f"Job {job.job_uuid} not done after {elapsed:.1f}s "
+                    f"({job.polls} polls, last status {status.status})"
+                ))
+                return
+            interval = min(interval, remaining)
+
+        with self._condition:
+            # A closed tracker has already failed every outstanding job
+            if not self._closed:
+                heapq.heappush(self._heap, (time.monotonic() + interval, next(self._sequence), job))
+                # Wake the scheduler only if this job is now the next one due
+                if self._heap[0][2] is job:
+                    self._condition.notify()
+
+    def _complete(self, job: _TrackedJob, poll_result: PollResult) -> None:
+        if job.on_done is None:
+            self._resolve(job, result=poll_result)
+            return
+        try:
+            value = job.on_done(poll_result)
+        except BaseException as e:
+            self._resolve(job, error=e)
+        else:
+            self._resolve(job, result=value)
+
+    def _cancel(self, job: _TrackedJob) -> None:
+        # Runs on the cancelling thread; the job's heap entry is skipped when it comes due
+        self._resolve(
+            job, error=JobPollCancelled(f"Polling of job {job.job_uuid} was cancelled after {job.polls} polls")
+        )
+
+    def _resolve(self, job: _TrackedJob, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            if job.finished:
+                return
+            job.finished = True
+            self._jobs.discard(job)
+            if error is None:
+                self.stats.done += 1
+            else:
+                self.stats.failed += 1
+        job.cancel_token.remove_callback(job.cancel_handle)
+        if error is None:
+            job.future.set_result(result)
+        else:
+            logger.debug("Tracked job %s failed: %r", job.job_uuid, error)
+            job.future.set_exception(error)
@@ -0,0 +1,293 @@
+"""
+Local stand-in for the Task API endpoints used by contingency_table_builder.
+
+Counts come from a deterministic synthetic population, so every query over the same codes
+returns the same count, and counts are mutually consistent: the four cells of a table sum
+to the population size and agree with marginal queries. Job latency and failures are
+drawn from configurable distributions.
+
+Use MockTaskApiClient to call the mock in-process, or MockTaskApiServer to serve it over
+HTTP for PooledTaskApiClient:
+
+    api = MockTaskApi(latency=LatencyModel(median=0.05))
+    with MockTaskApiServer(api) as server:
+        client = PooledTaskApiClient(server.url)
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Literal, Optional, Tuple
+
+import numpy as np
+import requests
+
+
+@dataclass
+class LatencyModel:
+    """
+    Distribution of the time a job takes to reach JOB_DONE.
+
+    Args:
+        kind: 'fixed', 'uniform' (median +/- spread) or 'lognormal' (median, sigma=spread)
+        median: Median job latency in seconds
+        spread: Half-width for 'uniform', log-space sigma for 'lognormal'
+    """
+
+    kind: Literal["fixed", "uniform", "lognormal"] = "lognormal"
+    median: float = 0.05
+    spread: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.median
+        if self.kind == "uniform":
+            return max(0.0, rng.uniform(self.median - self.spread, self.median + self.spread))
+        return rng.lognormvariate(np.log(self.median), self.spread)
+
+
+@dataclass
+class _MockJob:
+    job_uuid: str
+    query_uuid: str
+    collection_id: str
+    count: int
+    ready_at: float
+
+
+@dataclass
+class MockTaskApi:
+    """
+    In-memory Task API with a synthetic population.
+
+    Args:
+        population_size: Number of synthetic patients
+        latency: Job latency distribution
+        submit_failure_rate: Probability that a job submission returns HTTP 500
+        status_failure_rate: Probability that a status request returns HTTP 503
+        rounding: Round counts to the nearest multiple of this (0 disables), as bunny does
+        seed: Seed for the population, latencies and failures
+        request_latency: Median seconds the mock takes to serve each request
+        request_jitter: Log-space sigma of the lognormal noise on each request's latency
+            (0 serves every request in exactly `request_latency`)
+        capacity: Requests served at once without slowing down, or None for no limit.
+            Beyond it, `request_latency` grows in proportion to the requests in progress;
+            beyond twice it, requests are refused with HTTP 429
+    """
+
+    population_size: int = 100_000
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    submit_failure_rate: float = 0.0
+    status_failure_rate: float = 0.0
+    rounding: int = 0
+    seed: int = 0
+    request_latency: float = 0.0
+    request_jitter: float = 0.0
+    capacity: Optional[int] = None
+
+    def __post_init__(self):
+        self._jobs: Dict[str, _MockJob] = {}
+        self._members: Dict[str, np.ndarray] = {}
+        self._ids = itertools.count(1)
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = {"submit": 0, "status": 0, "results": 0, "throttled": 0}
+        self._active = 0
+
+    def members(self, omop_code: str) -> np.ndarray:
+        """Boolean membership of every synthetic patient for a code (cached)"""
+        with self._lock:
+            mask = self._members.get(omop_code)
+            if mask is None:
+                rng = np.random.default_rng([self.seed, zlib.crc32(omop_code.encode())])
+                prevalence = rng.uniform(0.01, 0.5)
+                mask = self._members[omop_code] = rng.random(self.population_size) < prevalence
+            return mask
+
+    def count_cohort(self, cohort: dict) -> int:
+        """Count patients matching a cohort dict as produced by Cohort.to_dict()"""
+        group_masks = []
+        for group in cohort["groups"]:
+            rule_masks = []
+            for rule in group["rules"]:
+                mask = self.members(str(rule["value"]))
+                rule_masks.append(~mask if rule["oper"] == "!=" else mask)
+            combine = np.logical_or if group.get("rules_oper") == "OR" else np.logical_and
+            group_masks.append(combine.reduce(rule_masks))
+        combine = np.logical_and if cohort.get("groups_oper") == "AND" else np.logical_or
+        count = int(combine.reduce(group_masks).sum())
+        if self.rounding:
+            count = int(round(count / self.rounding) * self.rounding)
+        return count
+
+    def submit(self, payload: dict) -> Tuple[int, object]:
+        query = payload["input"]
+        with self._lock:
+            self.requests["submit"] += 1
+            if self._rng.random() < self.submit_failure_rate:
+                return 500, {"message": "Injected submit failure"}
+            job_id = next(self._ids)
+            latency = self.latency.sample(self._rng)
+
+        collection = query["collection"]
+        job = _MockJob(
+            job_uuid=f"mock-{job_id:08d}",
+            query_uuid=query["uuid"],
+            collection_id=collection[0] if isinstance(collection, list) else collection,
+            count=self.count_cohort(query["cohort"]),
+            ready_at=time.monotonic() + latency,
+        )
+        with self._lock:
+            self._jobs[job.job_uuid] = job
+        return 200, {"job-id": str(job_id), "job-uuid": job.job_uuid, "message": "Job submitted"}
+
+    def status(self, job_uuid: str) -> Tuple[int, object]:
+        with self._lock:
+            self.requests["status"] += 1
+            job = self._jobs.get(job_uuid)
+            if self._rng.random() < self.status_failure_rate:
+                return 503, {"message": "Injected status failure"}
+        if job is None:
+            return 404, {"message": f"Unknown job {job_uuid}"}
+        status = "JOB_DONE" if time.monotonic() >= job.ready_at else "JOB_RUNNING"
+        return 200, [{job_uuid: status}]
+
+    def results(self, job_uuid: str, collection_id: str) -> Tuple[int, object]:
+        with self._lock:
+            self.requests["results"] += 1
+            job = self._jobs.get(job_uuid)
+        if job is None or time.monotonic() < job.ready_at:
+            return 404, {"status": "NOT_FOUND", "message": "Job result not found"}
+        return 200, {
+            "status": "ok",
+            "protocolVersion": "v2",
+            "uuid": job.query_uuid,
+            "message": "",
+            "queryResult": {"count": job.count, "datasetsCount": 1, "files": []},
+            "collection_id": collection_id,
+        }
+
+    _STATUS = re.compile(r"^/?task/status/([^/]+)/?$")
+    _RESULTS = re.compile(r"^/?task/results/([^/]+)/([^/]+)/?$")
+
+    def handle(self, method: str, endpoint: str, payload: Optional[dict] = None) -> Tuple[int, object]:
+        """Serve a request, subject to the request latency and capacity"""
+        if self.capacity is None and not self.request_latency:
+            return self.route(method, endpoint, payload)
+
+        with self._lock:
+            self._active += 1
+            active = self._active
+            jitter = self._rng.lognormvariate(0.0, self.request_jitter) if self.request_jitter else 1.0
+        try:
+            if self.capacity is not None and active > 2 * self.capacity:
+                with self._lock:
+                    self.requests["throttled"] += 1
+                return 429, {"message": "Too many requests"}
+            # Requests beyond capacity share the server, so each takes longer
+            load = active / self.capacity if self.capacity is not None else 1.0
+            time.sleep(self.request_latency * jitter * max(1.0, load))
+            return self.route(method, endpoint, payload)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def route(self, method: str, endpoint: str, payload: Optional[dict] = None) -> Tuple[int, object]:
+        """Route a request to the matching endpoint"""
+        endpoint = "/" + endpoint.lstrip("/")
+        if method == "POST" and endpoint.rstrip("/") == "/task":
+            return self.submit(payload)
+        if method == "GET":
+            match = self._STATUS.match(endpoint)
+            if match:
+                return self.status(match.group(1))
+            match = self._RESULTS.match(endpoint)
+            if match:
+                return self.results(match.group(1), match.group(2))
+        return 404, {"message": f"No route for {method} {endpoint}"}
+
+
+class MockResponse:
+    """Minimal stand-in for requests.Response"""
+
+    def __init__(self, status_code: int, body: object):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error from mock Task API", response=self)
+
+
+class MockTaskApiClient:
+    """Calls a MockTaskApi in-process with the TaskApiClient post/get interface"""
+
+    def __init__(self, api: MockTaskApi):
+        self.api = api
+
+    def post(self, endpoint: str, data: Optional[dict] = None, **kwargs) -> MockResponse:
+        return MockResponse(*self.api.handle("POST", endpoint, json.loads(json.dumps(data))))
+
+    def get(self, endpoint: str, **kwargs) -> MockResponse:
+        return MockResponse(*self.api.handle("GET", endpoint))
+
+
+class MockTaskApiServer:
+    """Serves a MockTaskApi over HTTP on localhost, in a background thread"""
+
+    def __init__(self, api: MockTaskApi, host: str = "127.0.0.1", port: int = 0):
+        api_ref = api
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, status: int, body: object) -> None:
+                encoded = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_GET(self):
+                self._respond(*api_ref.handle("GET", self.path))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"null")
+                self._respond(*api_ref.handle("POST", self.path, payload))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.api = api
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockTaskApiServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockTaskApiServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,268 @@
+"""
+Precompiled availability query payloads.
+
+Building a payload through the hutch_bunny DTOs (CustomRule, Group, Cohort,
+CustomAvailabilityQuery, then `to_dict()` on the whole tree) costs the same for every
+cell, although cells of one table differ only in their codes, operators and uuid.
+PayloadCompiler renders the DTO payload once per (collection, rule tables) with
+placeholder values, records where the query uuid, owner and each rule's code and
+operator ended up, and generates one function that builds the payload literal with those
+slots filled in.
+
+A rule on a concept set renders as a group of one rule per code. Templates are keyed by
+each rule's table and whether it is a concept set, and the per-code rules of a set compile
+to a comprehension over its codes, so one template serves sets of every size.
+
+Templates are checked against the DTO output when they are compiled: probe payloads are
+built both ways and must serialise to the same JSON, key order included. A layout the
+compiler cannot reproduce (say, a DTO that formats the code into a longer string) is
+marked as such and its payloads keep going through the DTOs.
+"""
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from concept_set import CodeSet
+
+logger = logging.getLogger(__name__)
+
+
+class RuleSpec(NamedTuple):
+    """
+    An OMOP rule matching patients with (or, if not `present`, without) a code in a table.
+
+    `omop_code` may be a normalised concept set (see `concept_set.code_set`), matching
+    patients with any of its codes or, if not `present`, with none of them.
+    """
+
+    table: str
+    omop_code: CodeSet
+    present: bool
+
+
+# Layout of a rule in a payload: its table and whether it is on a concept set
+RuleShape = Tuple[str, bool]
+
+
+# Builds a payload through the DTOs: (collection_id, owner, rules, query_uuid) -> payload
+RenderPayload = Callable[[str, str, Sequence[RuleSpec], str], dict]
+
+# Fills a compiled node: (query_uuid, owner, rules) -> value
+_Fill = Callable[[str, str, Sequence[RuleSpec]], Any]
+
+# Code placeholder -> (rule index, position in the rule's concept set or None for a single code)
+_Codes = Dict[str, Tuple[int, Optional[int]]]
+
+_UUID = "\x00query-uuid\x00"
+_OWNER = "\x00owner\x00"
+_CODE = "\x00code-{}\x00"
+
+
+def rule_shapes(rules: Sequence[RuleSpec]) -> Tuple[RuleShape, ...]:
+    """The layout key of `rules`: each rule's table and whether it is on a concept set"""
+    return tuple((rule.table, isinstance(rule.omop_code, tuple)) for rule in rules)
+
+
+class PayloadTemplate:
+    """A compiled payload layout for one collection and sequence of rule shapes."""
+
+    def __init__(self, fill: _Fill, rule_count: int):
+        self._fill = fill
+        self.rule_count = rule_count
+
+    def payload(self, owner: str, rules: Sequence[RuleSpec], query_uuid: str) -> dict:
+        """Build the payload for `rules`, which must have the shapes the template was compiled for"""
+        return self._fill(query_uuid, owner, rules)
+
+
+class PayloadCompiler:
+    """
+    Builds payloads from templates compiled once per (collection, rule shapes).
+
+    Thread-safe; one instance is meant to be shared by the whole process (see
+    `contingency_table_builder.default_payload_compiler`).
+
+    Args:
+        render: Builds a payload through the DTOs; used to compile and check templates
+            and for layouts that cannot be compiled
+    """
+
+    def __init__(self, render: RenderPayload):
+        self.render = render
+        self._templates: Dict[Tuple[str, Tuple[RuleShape, ...]], Optional[PayloadTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of compiled templates"""
+        return sum(template is not None for template in self._templates.values())
+
+    def payload(self, collection_id: str, owner: str, rules: Sequence[RuleSpec], query_uuid: str) -> dict:
+        """Build the payload of an availability query ANDing `rules` together"""
+        template = self.template(collection_id, rule_shapes(rules))
+        if template is None:
+            return self.render(collection_id, owner, rules, query_uuid)
+        return template.payload(owner, rules, query_uuid)
+
+    def template(self, collection_id: str, shapes: Tuple[RuleShape, ...]) -> Optional[PayloadTemplate]:
+        """The (cached) template for rules of `shapes`, or None if the DTO layout cannot be compiled"""
+        key = (collection_id, shapes)
+        try:
+            return self._templates[key]
+        except KeyError:
+            pass
+
+        template = self._compile(collection_id, shapes)
+        with self._lock:
+            return self._templates.setdefault(key, template)
+
+    def _compile(self, collection_id: str, shapes: Tuple[RuleShape, ...]) -> Optional[PayloadTemplate]:
+        codes: _Codes = {}
+        rule_codes: List[CodeSet] = []
+        for i, (_, is_set) in enumerate(shapes):
+            if is_set:
+                # Two codes, so the per-code rules of the set can be told apart from a single rule
+                placeholders = tuple(_CODE.format(f"{i}-{j}") for j in range(2))
+                codes.update({placeholder: (i, j) for j, placeholder in enumerate(placeholders)})
+                rule_codes.append(placeholders)
+            else:
+                codes[_CODE.format(i)] = (i, None)
+                rule_codes.append(_CODE.format(i))
+
+        present = self.render(
+            collection_id, _OWNER, [RuleSpec(t, c, True) for (t, _), c in zip(shapes, rule_codes)], _UUID
+        )
+        absent = self.render(
+            collection_id, _OWNER, [RuleSpec(t, c, False) for (t, _), c in zip(shapes, rule_codes)], _UUID
+        )
+        constants: List[Any] = []
+        slots: List[str] = []
+        expression = _compile_node(present, absent, codes, None, constants, slots)
+        # One generated function builds the whole payload literal, without a call per node
+        fill = eval(f"lambda query_uuid, owner, rules: {expression}", {"constants": tuple(constants)})
+
+        template = PayloadTemplate(fill, len(shapes))
+        if not _reproduces_render(self.render, template, collection_id, shapes, slots):
+            logger.warning(
+                "Payload layout for rules %s is not compilable; building those payloads through the DTOs", shapes
+            )
+            return None
+        return template
+
+
+def _compile_node(
+    present: Any,
+    absent: Any,
+    codes: _Codes,
+    rule: Optional[int],
+    constants: List[Any],
+    slots: List[str],
+    loop_code: Optional[str] = None,
+) -> str:
+    """
+    Compile one node of the probe payloads into a Python expression building it.
+
+    `present` and `absent` are the same node rendered with every rule present and absent;
+    leaves that differ between them are operators of the one rule whose code placeholders
+    sit under the same dict. A list holding one item per code of a concept set compiles to
+    a comprehension over the set's codes, its first item standing for every code
+    (`loop_code`). Leaves are referenced from `constants` rather than written as literals,
+    and `slots` collects the kinds of slot found, for the check.
+    """
+    if isinstance(present, dict):
+        rules = {codes[placeholder][0] for placeholder in _placeholders(present, codes)}
+        if len(rules) == 1:
+            rule = rules.pop()
+        items = [
+            f"{_constant(key, constants)}: "
+            + _compile_node(
+                value, absent.get(key) if isinstance(absent, dict) else None,
+                codes, rule, constants, slots, loop_code,
+            )
+            for key, value in present.items()
+        ]
+        return "{" + ", ".join(items) + "}"
+
+    if isinstance(present, list):
+        absent_items = absent if isinstance(absent, list) and len(absent) == len(present) else [None] * len(present)
+        set_rule = _code_set_rule(present, codes)
+        if set_rule is not None:
+            item = _compile_node(
+                present[0], absent_items[0], codes, set_rule, constants, slots, _placeholders(present[0], codes)[0]
+            )
+            return f"[{item} for code in rules[{set_rule}].omop_code]"
+        items = [_compile_node(p, a, codes, rule, constants, slots, loop_code) for p, a in zip(present, absent_items)]
+        return "[" + ", ".join(items) + "]"
+
+    if present == _UUID:
+        slots.append("uuid")
+        return "query_uuid"
+    if present == _OWNER:
+        slots.append("owner")
+        return "owner"
+    if isinstance(present, str) and present in codes:
+        index, position = codes[present]
+        slots.append(f"code-{index}")
+        if present == loop_code:
+            return "code"
+        return f"rules[{index}].omop_code" if position is None else f"rules[{index}].omop_code[{position}]"
+    if present != absent and rule is not None:
+        slots.append(f"operator-{rule}")
+        return f"({_constant(present, constants)} if rules[{rule}].present else {_constant(absent, constants)})"
+
+    # Constant leaves are immutable JSON scalars, so they can be shared between payloads
+    return _constant(present, constants)
+
+
+def _placeholders(node: Any, codes: _Codes) -> List[str]:
+    """The code placeholders in a probe payload node, in order"""
+    if isinstance(node, dict):
+        return [placeholder for value in node.values() for placeholder in _placeholders(value, codes)]
+    if isinstance(node, list):
+        return [placeholder for item in node for placeholder in _placeholders(item, codes)]
+    return [node] if isinstance(node, str) and node in codes else []
+
+
+def _code_set_rule(items: List[Any], codes: _Codes) -> Optional[int]:
+    """The rule whose concept set `items` holds one item per code of, in order, if any"""
+    found = [_placeholders(item, codes) for item in items]
+    if len(items) < 2 or any(len(placeholders) != 1 for placeholders in found):
+        return None
+    positions = [codes[placeholders[0]] for placeholders in found]
+    rule = positions[0][0]
+    return rule if positions == [(rule, j) for j in range(len(items))] else None
+
+
+def _constant(value: Any, constants: List[Any]) -> str:
+    constants.append(value)
+    return f"constants[{len(constants) - 1}]"
+
+
+def _reproduces_render(
+    render: RenderPayload,
+    template: PayloadTemplate,
+    collection_id: str,
+    shapes: Tuple[RuleShape, ...],
+    slots: List[str],
+) -> bool:
+    """Whether every slot was found and the template serialises exactly like the DTOs on probes"""
+    expected_slots = {"uuid", "owner"} | {f"{kind}-{i}" for kind in ("code", "operator") for i in range(len(shapes))}
+    if not expected_slots <= set(slots):
+        return False
+    # Concept sets are probed at sizes other than the two codes the template was compiled from
+    set_sizes = (1, 3) if any(is_set for _, is_set in shapes) else (0,)
+    for parity in (0, 1):
+        for size in set_sizes:
+            rules = [
+                RuleSpec(
+                    table,
+                    tuple(str(1000 + 100 * i + j) for j in range(size)) if is_set else str(1000 + i),
+                    i % 2 == parity,
+                )
+                for i, (table, is_set) in enumerate(shapes)
+            ]
+            expected = render(collection_id, "probe-owner", rules, "probe-uuid")
+            actual = template.payload("probe-owner", rules, "probe-uuid")
+            if json.dumps(actual) != json.dumps(expected):
+                return False
+    return True
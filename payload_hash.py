@@ -0,0 +1,25 @@
+import hashlib
+import json
+
+# Fields that differ between otherwise identical submissions and do not affect the count
+VOLATILE_QUERY_FIELDS = frozenset({"uuid", "owner"})
+
+
+def canonical_payload_hash(query_input: dict, collection_id: str) -> str:
+    """
+    Hash an availability query for deduplication and caching.
+
+    Args:
+        query_input: The `CustomAvailabilityQuery.to_dict()` output (the payload's "input")
+        collection_id: Collection the query runs against
+
+    Returns:
+        Hex SHA-256 digest of the query with uuid and owner removed, plus the collection id
+    """
+    canonical = {k: v for k, v in query_input.items() if k not in VOLATILE_QUERY_FIELDS}
+    encoded = json.dumps(
+        {"collection_id": collection_id, "query": canonical},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
@@ -0,0 +1,170 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional
+
+from job_status import JobStatus
+
+
+class JobPollTimeout(TimeoutError):
+    """Raised when a job does not reach JOB_DONE before the polling deadline."""
+
+
+class JobPollCancelled(RuntimeError):
+    """Raised when polling is stopped through a CancellationToken."""
+
+
+class CancellationToken:
+    """Thread-safe flag used to stop one or more poll loops early."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._next_callback = 0
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, {}
+        for callback in callbacks.values():
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]) -> int:
+        """
+        Call `callback` (on the cancelling thread) once the token is cancelled.
+
+        It is called straight away if the token already is. Returns a handle for
+        `remove_callback`.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                handle = self._next_callback
+                self._next_callback += 1
+                self._callbacks[handle] = callback
+                return handle
+        callback()
+        return -1
+
+    def remove_callback(self, handle: int) -> None:
+        """Forget a callback added with `add_callback`, e.g. once its waiter has finished"""
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep for up to `timeout` seconds, returning True if cancelled meanwhile."""
+        return self._event.wait(timeout)
+
+
+@dataclass
+class PollingPolicy:
+    """
+    Schedule for polling the status of an upstream job.
+
+    The first `fast_probes` polls are spaced `fast_interval` apart so quick jobs return
+    promptly. After that the interval starts at `initial_interval` and grows by
+    `multiplier` up to `max_interval`, so slow jobs are polled less and less often.
+    Every interval is scaled by a random factor in [1 - jitter, 1 + jitter] to keep
+    many concurrent pollers from hitting the upstream in lockstep.
+
+    Args:
+        fast_probes: Number of polls made at `fast_interval`
+        fast_interval: Seconds between the fast probes
+        initial_interval: First interval of the backoff phase, in seconds
+        multiplier: Growth factor applied to the interval after each backoff poll
+        max_interval: Upper bound on the interval, in seconds
+        jitter: Relative jitter applied to every interval (0 disables it)
+        deadline: Seconds after which polling gives up, or None to poll indefinitely
+    """
+
+    fast_probes: int = 3
+    fast_interval: float = 0.25
+    initial_interval: float = 1.0
+    multiplier: float = 2.0
+    max_interval: float = 15.0
+    jitter: float = 0.2
+    deadline: Optional[float] = 600.0
+
+    def intervals(self, rng: Optional[random.Random] = None) -> Iterator[float]:
+        """Yield the (jittered) sleep before each successive poll."""
+        rng = rng or random.Random()
+        for _ in range(self.fast_probes):
+            yield self._jittered(self.fast_interval, rng)
+
+        interval = self.initial_interval
+        while True:
+            yield self._jittered(interval, rng)
+            interval = min(interval * self.multiplier, self.max_interval)
+
+    def _jittered(self, interval: float, rng: random.Random) -> float:
+        if self.jitter <= 0:
+            return interval
+        return interval * rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+@dataclass
+class PollResult:
+    """Outcome of polling a single job to completion."""
+
+    job_uuid: str
+    status: JobStatus
+    polls: int
+    elapsed: float
+
+
+def poll_job(
+    job_uuid: str,
+    fetch_status: Callable[[], JobStatus],
+    policy: Optional[PollingPolicy] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> PollResult:
+    """
+    Poll a job until it reports JOB_DONE.
+
+    Args:
+        job_uuid: The upstream job being polled, used for reporting
+        fetch_status: Callable performing one status request
+        policy: Polling schedule (default: PollingPolicy())
+        cancel_token: Optional token that aborts the loop when cancelled
+
+    Returns:
+        PollResult with the final status and the number of polls made
+
+    Raises:
+        JobPollTimeout: if the policy deadline passes first
+        JobPollCancelled: if the cancel token is triggered
+    """
+    policy = policy or PollingPolicy()
+    cancel_token = cancel_token or CancellationToken()
+    start = time.monotonic()
+    polls = 0
+
+    for interval in policy.intervals():
+        if cancel_token.cancelled:
+            raise JobPollCancelled(f"Polling of job {job_uuid} was cancelled after {polls} polls")
+
+        status = fetch_status()
+        polls += 1
+        if status.status == "JOB_DONE":
+            return PollResult(job_uuid=job_uuid, status=status, polls=polls, elapsed=time.monotonic() - start)
+
+        elapsed = time.monotonic() - start
+        if policy.deadline is not None:
+            remaining = policy.deadline - elapsed
+            if remaining <= 0:
+                raise JobPollTimeout(
+                    f"Job {job_uuid} not done after {elapsed:.1f}s ({polls} polls, last status {status.status})"
+                )
+            interval = min(interval, remaining)
+
+        if cancel_token.wait(interval):
+            raise JobPollCancelled(f"Polling of job {job_uuid} was cancelled after {polls} polls")
+
+    raise AssertionError("unreachable: PollingPolicy.intervals is infinite")
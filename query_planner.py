@@ -0,0 +1,494 @@
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from contingency_table_builder import (
+    CELLS,
+    ContingencyTableQuery,
+    QueryOptions,
+    await_cells,
+    run_cells_concurrently,
+    default_payload_compiler,
+    run_rules_query,
+    start_rules_query,
+    table_from_cell_counts,
+)
+from concept_set import CodeSet
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from job_journal import JobJournal
+from job_tracker import JobTracker
+from payload_compiler import PayloadCompiler, RuleSpec
+from polling import CancellationToken, JobPollCancelled, PollingPolicy
+from result_cache import ResultCache
+from single_flight import Flight, SingleFlight
+
+if TYPE_CHECKING:
+    from hutch_bunny.core.upstream.task_api_client import TaskApiClient
+
+logger = logging.getLogger(__name__)
+
+# Key of a cached marginal: (collection_id, table, omop_code or concept set, present)
+MarginalKey = Tuple[str, str, CodeSet, bool]
+
+# The upstream queries needed to derive a 2x2 table from marginals
+PLAN_PARTS = ("joint", "exposure_present", "exposure_absent", "outcome_present")
+
+
+class MarginalCountCache:
+    """
+    Thread-safe cache of single-code (or single concept set) counts, shared across pairs.
+
+    Concurrent requests for the same marginal wait on the one fetch in flight rather
+    than each issuing their own upstream job. That fetch runs under a token of its own,
+    cancelled only once every build waiting on it has been cancelled, so one failing or
+    cancelled build does not fail the others sharing its marginals.
+    """
+
+    def __init__(self):
+        self._values: Dict[MarginalKey, tuple[int, dict]] = {}
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_fetch(
+        self,
+        key: MarginalKey,
+        fetch: Callable[[CancellationToken], tuple[int, dict]],
+        cancel_token: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
+    ) -> tuple[int, dict]:
+        """
+        The cached value, or that of a fetch shared with concurrent callers.
+
+        `fetch(token)` is run on this thread if no fetch for `key` is in flight; it should
+        honour `token`, which is cancelled once every caller has stopped waiting.
+
+        Raises:
+            JobPollCancelled: if `cancel_token` is cancelled before the value is ready
+            JobPollTimeout: if a fetch in flight is not done after `timeout` seconds
+        """
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                return self._values[key]
+        value, shared = self._flights.do(key, partial(self._fetch, key, fetch), cancel_token, timeout)
+        if shared:
+            self._count(shared)
+        return value
+
+    def get_or_start(
+        self,
+        key: MarginalKey,
+        start: Callable[[CancellationToken], Future],
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Future:
+        """
+        Non-blocking `get_or_fetch`: a Future of the cached value, or of the fetch in flight.
+
+        `start(token)` begins the fetch and returns a Future of its value; it is only called
+        if the value is neither cached nor being fetched. Every caller gets a Future of its
+        own, which fails with JobPollCancelled once its `cancel_token` is cancelled.
+        """
+        future: Future = Future()
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                future.set_result(self._values[key])
+                return future
+        flight, shared = self._flights.start_future(key, partial(self._start, key, start))
+        if shared:
+            self._count(shared)
+
+        left = threading.Lock()
+
+        def leave() -> None:
+            if left.acquire(blocking=False):
+                self._flights.leave(flight)
+
+        def cancelled() -> None:
+            leave()
+            _settle(future, error=JobPollCancelled(f"Stopped waiting for marginal {key}"))
+
+        handle = cancel_token.add_callback(cancelled) if cancel_token is not None else None
+
+        def finished(flight: Flight) -> None:
+            if handle is not None:
+                cancel_token.remove_callback(handle)
+            leave()
+            try:
+                _settle(future, flight.result())
+            except BaseException as e:
+                _settle(future, error=e)
+
+        flight.add_done_callback(finished)
+        return future
+
+    def _fetch(
+        self, key: MarginalKey, fetch: Callable[[CancellationToken], tuple[int, dict]], flight: Flight
+    ) -> tuple[int, dict]:
+        with self._lock:
+            # Fetched by a flight that finished just before this one started
+            if key in self._values:
+                self.hits += 1
+                return self._values[key]
+            self.misses += 1
+        value = fetch(flight.token)
+        with self._lock:
+            self._values[key] = value
+        return value
+
+    def _start(self, key: MarginalKey, start: Callable[[CancellationToken], Future], flight: Flight) -> Future:
+        self._count(shared=False)
+        started = start(flight.token)
+        # Stored before the flight finishes, so callers arriving after it find the value
+        started.add_done_callback(partial(self._store, key))
+        return started
+
+    def _store(self, key: MarginalKey, started: Future) -> None:
+        if not started.cancelled() and started.exception() is None:
+            with self._lock:
+                self._values[key] = started.result()
+
+    def _count(self, shared: bool) -> None:
+        with self._lock:
+            if shared:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+def _settle(future: Future, result: Optional[tuple[int, dict]] = None, error: Optional[BaseException] = None) -> None:
+    """Set the outcome of `future` unless it already has one"""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _check_plannable(builder: ContingencyTableQuery) -> None:
+    """Marginals are whole-population counts, so a builder restricted by extra rules cannot be planned"""
+    if builder.extra_rules:
+        raise ValueError("A builder with extra_rules (e.g. one stratum of a StratifiedTableQuery) cannot be planned")
+
+
+def _unclamped_cells(
+    joint: int, exposure_present: int, exposure_absent: int, outcome_present: int
+) -> Dict[str, int]:
+    total = exposure_present + exposure_absent
+    return {
+        "exposed_with_outcome": joint,
+        "exposed_without_outcome": exposure_present - joint,
+        "unexposed_with_outcome": outcome_present - joint,
+        "unexposed_without_outcome": total - exposure_present - outcome_present + joint,
+    }
+
+
+def derive_cells(
+    joint: int, exposure_present: int, exposure_absent: int, outcome_present: int
+) -> Dict[str, int]:
+    """
+    Derive the four 2x2 cells from the joint count and the marginals.
+
+    The total population is `exposure_present + exposure_absent`. Upstream counts may be
+    rounded or suppressed, in which case the derived cells are only approximate and one
+    can come out negative; such cells are clamped to zero. `derivation_issues` reports
+    the counts that could not all be exact.
+    """
+    cells = _unclamped_cells(joint, exposure_present, exposure_absent, outcome_present)
+    return {cell: max(count, 0) for cell, count in cells.items()}
+
+
+def derivation_issues(
+    joint: int, exposure_present: int, exposure_absent: int, outcome_present: int
+) -> List[str]:
+    """
+    Describe the inconsistencies between a joint count and its marginals.
+
+    Exact counts never have any. Rounded or suppressed counts can have a joint count
+    larger than a marginal, or a derived cell below zero (which `derive_cells` clamps);
+    a table derived from such counts is not a table of real counts.
+
+    Returns:
+        One message per inconsistency; empty if the counts are consistent
+    """
+    issues = []
+    # A joint count above a marginal is what makes exposed_without / unexposed_with negative
+    for name, marginal in (("exposure_present", exposure_present), ("outcome_present", outcome_present)):
+        if joint > marginal:
+            issues.append(f"joint count {joint} exceeds the {name} count {marginal}")
+    remainder = _unclamped_cells(joint, exposure_present, exposure_absent, outcome_present)["unexposed_without_outcome"]
+    if remainder < 0:
+        issues.append(f"unexposed_without_outcome derived as {remainder}")
+    return issues
+
+
+@dataclass
+class MarginalQueryPlanner:
+    """
+    Query planner that issues only the joint query per pair.
+
+    Instead of four upstream jobs per table, the planner fetches the joint count
+    (exposure = AND outcome =) and derives the other cells from per-code marginals:
+    the exposure count, the exposure-absent count (together giving the total N) and the
+    outcome count. Marginals are cached per code in `cache`, so every pair sharing an
+    exposure or an outcome reuses them. Screening one exposure against K outcomes costs
+    2K + 2 jobs instead of 4K.
+
+    This relies on `=` and `!=` for a code partitioning the population, which holds for
+    the OMOP rules used by ContingencyTableQuery, and likewise on "any of" and "none of"
+    partitioning it for a concept set.
+
+    It also relies on exact counts. Bunny rounds counts (to 10 by default) and suppresses
+    small ones, and each derived cell combines up to four of them, so on such an upstream
+    a derived cell can be off by about twice the rounding target, and the table is not
+    one of real counts. Use the planner there only for screening, and confirm hits with
+    the direct four-query table. Counts that cannot all be exact (a joint count above a
+    marginal, or a negative derived cell, which is clamped to zero) are listed in the
+    builder's `derivation_issues` and logged.
+
+    Args:
+        polling_policy: Polling schedule for marginal queries (default: PollingPolicy())
+        cache: Shared marginal cache (default: a new MarginalCountCache)
+        result_cache: Optional persistent ResultCache consulted before submitting marginal queries
+        instrumentation: Records stage timings of marginal queries (default: disabled)
+        single_flight: Optional SingleFlight sharing marginal queries already in flight
+            elsewhere in the process, e.g. `default_single_flight()` in a multi-session app
+        journal: Optional JobJournal to resume marginal queries of an interrupted run
+        payload_compiler: Builds marginal payloads from precompiled templates (default: the
+            process-wide PayloadCompiler; None builds them through the DTOs)
+        strict_decode: Validate Task API responses in pydantic's strict mode (no type coercion)
+        job_tracker: Optional JobTracker polling marginal queries started with
+            `start_marginal_count` / `part_futures`
+    """
+
+    polling_policy: PollingPolicy = field(default_factory=PollingPolicy)
+    cache: MarginalCountCache = field(default_factory=MarginalCountCache)
+    result_cache: Optional[ResultCache] = None
+    instrumentation: Instrumentation = field(default=NULL_INSTRUMENTATION, repr=False)
+    single_flight: Optional[SingleFlight] = field(default=None, repr=False)
+    journal: Optional[JobJournal] = field(default=None, repr=False)
+    payload_compiler: Optional[PayloadCompiler] = field(default_factory=default_payload_compiler, repr=False)
+    strict_decode: bool = False
+    job_tracker: Optional[JobTracker] = field(default=None, repr=False)
+
+    def marginal_count(
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        table: str,
+        omop_code: CodeSet,
+        present: bool,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> tuple[int, dict]:
+        """Return the (cached) count and payload of patients with or without a single code or concept set"""
+
+        def fetch(token: CancellationToken) -> tuple[int, dict]:
+            count, payload, _ = run_rules_query(
+                client,
+                collection_id,
+                owner,
+                [RuleSpec(table, omop_code, present)],
+                query_uuid=f"marginal_{present}_{uuid4().hex}",
+                options=QueryOptions.of(self),
+                cancel_token=token,
+                cell=f"marginal_{'present' if present else 'absent'}",
+            )
+            return count, payload
+
+        return self.cache.get_or_fetch(
+            (collection_id, table, omop_code, present), fetch, cancel_token, self.polling_policy.deadline
+        )
+
+    def start_marginal_count(
+        self,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        table: str,
+        omop_code: CodeSet,
+        present: bool,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> "Future[tuple[int, dict]]":
+        """Non-blocking `marginal_count`: a Future of the count and payload, polled by `self.job_tracker`"""
+        if self.job_tracker is None:
+            raise ValueError("start_marginal_count needs a job_tracker")
+
+        def start(token: CancellationToken) -> Future:
+            started = start_rules_query(
+                client,
+                collection_id,
+                owner,
+                [RuleSpec(table, omop_code, present)],
+                query_uuid=f"marginal_{present}_{uuid4().hex}",
+                options=QueryOptions.of(self),
+                cancel_token=token,
+                cell=f"marginal_{'present' if present else 'absent'}",
+            )
+            outcome: Future = Future()
+
+            def count_and_payload(future: Future) -> None:
+                if future.exception() is not None:
+                    outcome.set_exception(future.exception())
+                else:
+                    count, payload, _ = future.result()
+                    outcome.set_result((count, payload))
+
+            started.add_done_callback(count_and_payload)
+            return outcome
+
+        return self.cache.get_or_start((collection_id, table, omop_code, present), start, cancel_token)
+
+    def part_tasks(
+        self,
+        builder: ContingencyTableQuery,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Dict[str, Callable[[], tuple[int, dict]]]:
+        """Return a callable per upstream query the plan for `builder` needs, keyed by PLAN_PARTS"""
+        _check_plannable(builder)
+        return {
+            "joint": lambda: builder.execute_single_query(
+                client, collection_id, owner, True, True, cancel_token
+            ),
+            "exposure_present": lambda: self.marginal_count(
+                client, collection_id, owner,
+                builder.exposure_table, builder.exposure_omop_code, True, cancel_token
+            ),
+            "exposure_absent": lambda: self.marginal_count(
+                client, collection_id, owner,
+                builder.exposure_table, builder.exposure_omop_code, False, cancel_token
+            ),
+            "outcome_present": lambda: self.marginal_count(
+                client, collection_id, owner,
+                builder.outcome_table, builder.outcome_omop_code, True, cancel_token
+            ),
+        }
+
+    def part_futures(
+        self,
+        builder: ContingencyTableQuery,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Dict[str, "Future[tuple[int, dict]]"]:
+        """
+        Start every upstream query the plan for `builder` needs and return their Futures, keyed by PLAN_PARTS.
+
+        The non-blocking counterpart of `part_tasks`: the joint query is polled by
+        `builder.job_tracker` and the marginals by `self.job_tracker`.
+        """
+        _check_plannable(builder)
+        return {
+            "joint": builder.start_single_query(client, collection_id, owner, True, True, cancel_token),
+            "exposure_present": self.start_marginal_count(
+                client, collection_id, owner,
+                builder.exposure_table, builder.exposure_omop_code, True, cancel_token
+            ),
+            "exposure_absent": self.start_marginal_count(
+                client, collection_id, owner,
+                builder.exposure_table, builder.exposure_omop_code, False, cancel_token
+            ),
+            "outcome_present": self.start_marginal_count(
+                client, collection_id, owner,
+                builder.outcome_table, builder.outcome_omop_code, True, cancel_token
+            ),
+        }
+
+    def build_contingency_table(
+        self,
+        builder: ContingencyTableQuery,
+        client: "TaskApiClient",
+        collection_id: str,
+        owner: str,
+        max_concurrency: int = 4,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """
+        Build the 2x2 table for `builder` from its joint count and cached marginals.
+
+        The payloads actually sent are stored in `builder.query_payloads` keyed by plan part.
+        When both the planner and `builder` have a job_tracker, the queries are polled by
+        it rather than by a thread each.
+
+        Raises:
+            CellQueryError: as soon as any of the planned queries fails, keyed by plan part;
+                marginals shared with other builds carry on for them
+        """
+        cancel_token = cancel_token or CancellationToken()
+        if self.job_tracker is not None and builder.job_tracker is not None:
+            outcomes = await_cells(
+                self.part_futures(builder, client, collection_id, owner, cancel_token), cancel_token
+            )
+        else:
+            outcomes = run_cells_concurrently(
+                self.part_tasks(builder, client, collection_id, owner, cancel_token), max_concurrency, cancel_token
+            )
+        return self._finish_table(builder, outcomes)
+
+    def _finish_table(
+        self, builder: ContingencyTableQuery, outcomes: Dict[str, tuple[int, dict]]
+    ) -> Dict[str, Dict[str, int]]:
+        """Record the payloads and any derivation issues on `builder` and derive its table"""
+        builder.query_payloads = {part: payload for part, (_, payload) in outcomes.items()}
+        counts = {part: count for part, (count, _) in outcomes.items()}
+        builder.derivation_issues = derivation_issues(**counts)
+        if builder.derivation_issues:
+            self.instrumentation.count("derivation_inconsistent")
+            logger.warning(
+                "Derived table for %s x %s is approximate: %s",
+                builder.exposure_omop_code, builder.outcome_omop_code, "; ".join(builder.derivation_issues),
+            )
+        return table_from_parts(counts)
+
+
+def table_from_parts(counts: Dict[str, int]) -> Dict[str, Dict[str, int]]:
+    """Assemble a contingency table from the counts of the PLAN_PARTS queries"""
+    return table_from_cell_counts(derive_cells(**counts))
+
+
+def verify_marginal_plan(
+    builder: ContingencyTableQuery,
+    client: "TaskApiClient",
+    collection_id: str,
+    owner: str,
+    planner: Optional[MarginalQueryPlanner] = None,
+) -> Dict[str, Tuple[int, int]]:
+    """
+    Compare the planner's derived cells with the direct four-query table.
+
+    Meant for a mock or test upstream. With exact counts the two tables always agree;
+    with rounded counts they usually differ (see `benchmarks/bench_marginal_plan.py`).
+
+    Returns:
+        Mapping of each disagreeing cell to its (direct, derived) counts; empty if they agree
+    """
+    planner = planner or MarginalQueryPlanner(polling_policy=builder.polling_policy)
+    direct = builder.build_contingency_table(client, collection_id, owner)
+    derived = planner.build_contingency_table(builder, client, collection_id, owner)
+
+    mismatches = {}
+    for cell, (exposure_present, outcome_present) in CELLS.items():
+        row = "exposed" if exposure_present else "unexposed"
+        column = "with_outcome" if outcome_present else "without_outcome"
+        if direct[row][column] != derived[row][column]:
+            mismatches[cell] = (direct[row][column], derived[row][column])
+    return mismatches
@@ -17,3 +17,8 @@ class QueryResult(BaseModel):
     @classmethod
     def from_api_response(cls, response_data: dict) -> 'QueryResult':
         return cls(**response_data)
+
+    @classmethod
+    def from_api_json(cls, body: bytes, strict: bool = False) -> 'QueryResult':
+        """Parse and validate a raw result response body in one pass; `strict` disables type coercion"""
+        return cls.model_validate_json(body, strict=strict)
@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+# Access times of memory hits written to the on-disk tier in one batch
+ACCESS_BATCH_SIZE = 256
+
+
+@dataclass
+class CacheStats:
+    """Hit/miss counters of a ResultCache."""
+
+    hits: int = 0
+    misses: int = 0
+    memory_hits: int = 0
+    disk_hits: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ResultCache:
+    """
+    Two-tier cache of query counts keyed on `canonical_payload_hash`.
+
+    Lookups check an in-memory LRU first and then, if configured, a SQLite file so
+    results survive process restarts. Entries older than `ttl_seconds` are treated as
+    missing and removed. Both tiers evict their least recently used entries once full.
+
+    Memory hits also refresh the entry's access time on disk, so counts hot in memory
+    are not the first evicted from disk after a restart; those times are written in
+    batches, before the disk tier evicts anything and on `close`. The disk tier's size is
+    counted once when the file is opened and then tracked in memory, which assumes no
+    other process writes to the same file.
+
+    Args:
+        ttl_seconds: Maximum age of a cached count, or None to keep counts indefinitely
+        max_entries: Capacity of the in-memory tier
+        sqlite_path: Path of the on-disk tier, or None to cache in memory only
+        max_disk_entries: Capacity of the on-disk tier
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = 24 * 60 * 60,
+        max_entries: int = 1024,
+        sqlite_path: Optional[str] = None,
+        max_disk_entries: int = 100_000,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.stats = CacheStats()
+        self._memory: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_size = 0
+        # key -> access time of memory hits not yet written to disk
+        self._accessed: Dict[str, float] = {}
+        if sqlite_path is not None:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            # WAL with relaxed syncing keeps hits and access-time updates to well under a millisecond
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_results ("
+                "key TEXT PRIMARY KEY, count INTEGER NOT NULL, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS query_results_accessed ON query_results (accessed_at)"
+            )
+            self._db.commit()
+            (self._disk_size,) = self._db.execute("SELECT COUNT(*) FROM query_results").fetchone()
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[int]:
+        """Return the cached count for `key`, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                count, stored_at = entry
+                if not self._expired(stored_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats.hits += 1
+                    self.stats.memory_hits += 1
+                    if self._db is not None:
+                        self._accessed[key] = now
+                        if len(self._accessed) >= ACCESS_BATCH_SIZE:
+                            self._write_access_times()
+                            self._db.commit()
+                    return count
+                del self._memory[key]
+                self.stats.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT count, stored_at FROM query_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    count, stored_at = row
+                    if not self._expired(stored_at, now):
+                        self._accessed.pop(key, None)
+                        self._db.execute(
+                            "UPDATE query_results SET accessed_at = ? WHERE key = ?", (now, key)
+                        )
+                        self._db.commit()
+                        self._store_in_memory(key, count, stored_at)
+                        self.stats.hits += 1
+                        self.stats.disk_hits += 1
+                        return count
+                    self._disk_size -= self._db.execute("DELETE FROM query_results WHERE key = ?", (key,)).rowcount
+                    self._db.commit()
+                    self.stats.expirations += 1
+
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: str, count: int) -> None:
+        """Store the count for `key` in every tier"""
+        now = time.time()
+        with self._lock:
+            self._store_in_memory(key, count, now)
+            if self._db is not None:
+                self._accessed.pop(key, None)
+                updated = self._db.execute(
+                    "UPDATE query_results SET count = ?, stored_at = ?, accessed_at = ? WHERE key = ?",
+                    (count, now, now, key),
+                ).rowcount
+                if not updated:
+                    self._db.execute(
+                        "INSERT INTO query_results (key, count, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                        (key, count, now, now),
+                    )
+                    self._disk_size += 1
+                    self._evict_from_disk()
+                self._db.commit()
+
+    def _store_in_memory(self, key: str, count: int, stored_at: float) -> None:
+        self._memory[key] = (count, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _evict_from_disk(self) -> None:
+        excess = self._disk_size - self.max_disk_entries
+        if excess > 0:
+            # Evict by up-to-date access times, including those of memory hits
+            self._write_access_times()
+            evicted = self._db.execute(
+                "DELETE FROM query_results WHERE key IN ("
+                "SELECT key FROM query_results ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+            self._disk_size -= evicted
+            self.stats.evictions += evicted
+
+    def _write_access_times(self) -> None:
+        """Write the access times of memory hits to the on-disk tier (uncommitted)"""
+        if self._accessed:
+            self._db.executemany(
+                "UPDATE query_results SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def clear(self) -> None:
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._accessed.clear()
+                self._db.execute("DELETE FROM query_results")
+                self._db.commit()
+                self._disk_size = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._write_access_times()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def __len__(self) -> int:
+        return len(self._memory)
@@ -0,0 +1,271 @@
+"""
+Columnar on-disk store for screening results.
+
+A store is a directory of immutable part files, each holding one flushed batch of rows
+in Arrow IPC (default) or Parquet format. Each row is one screened pair: its codes and
+tables, the four cell counts, the canonical payload hash of every upstream query, the
+flattened numeric statistics of each test (e.g. `fishers_exact_p_value`,
+`fishers_exact_confidence_interval_lower`) and any error.
+
+Appends are buffered and written `batch_size` rows at a time. Each part is written to a
+temporary file and renamed into place, so readers never see a partial part. Reads open
+the parts as a `pyarrow.dataset` over memory-mapped files: opening a store reads only
+the file footers, and a filtered read pages in just the columns it touches, so a
+million-row screen can be re-opened and queried without loading it into RAM. Uncompressed
+IPC columns are used in place (zero-copy); Parquet parts are smaller but decoded on read.
+
+pyarrow is imported on first use, so importing this module does not require it.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Literal, Optional, Sequence
+from uuid import uuid4
+
+from batch_screen import ScreeningResult
+from concept_set import format_code_set
+from contingency_table_builder import CELLS
+from payload_hash import canonical_payload_hash
+
+StoreFormat = Literal["arrow", "parquet"]
+
+_EXTENSIONS = {"arrow": ".arrow", "parquet": ".parquet"}
+_DATASET_FORMATS = {"arrow": "ipc", "parquet": "parquet"}
+
+# Columns every row has, in order; counts are int64, payload_hashes maps part -> hash,
+# the rest are strings
+BASE_COLUMNS = (
+    "index",
+    "collection_id",
+    "exposure_omop_code",
+    "exposure_table",
+    "outcome_omop_code",
+    "outcome_table",
+    *CELLS,
+    "payload_hashes",
+    "error",
+    "derivation_issues",
+)
+
+
+def result_row(result: ScreeningResult, collection_id: str) -> Dict[str, Any]:
+    """
+    Flatten a ScreeningResult into one store row.
+
+    Concept sets are written as their codes joined by `concept_set.CODE_SET_SEPARATOR`.
+
+    Numeric and boolean fields of each test's result become `{test}_{field}` columns;
+    tuples such as confidence intervals become `_lower` / `_upper` columns. Text fields
+    (interpretations) and nested values (expected counts) are left out.
+    """
+    table = result.table or {}
+    row: Dict[str, Any] = {
+        "index": result.index,
+        "collection_id": collection_id,
+        "exposure_omop_code": format_code_set(result.pair.exposure_omop_code),
+        "exposure_table": result.pair.exposure_table,
+        "outcome_omop_code": format_code_set(result.pair.outcome_omop_code),
+        "outcome_table": result.pair.outcome_table,
+        "payload_hashes": [
+            (part, canonical_payload_hash(payload["input"], collection_id))
+            for part, payload in result.query_payloads.items()
+        ],
+        "error": str(result.error) if result.error is not None else None,
+        "derivation_issues": "; ".join(result.derivation_issues) or None,
+    }
+    for cell in CELLS:
+        exposure, outcome = cell.split("_", 1)
+        row[cell] = table.get(exposure, {}).get(outcome)
+
+    for name, stat in result.stats.items():
+        for field_name, value in stat.model_dump(exclude={"additional_info"}).items():
+            if isinstance(value, (bool, int, float)):
+                row[f"{name}_{field_name}"] = value
+            elif isinstance(value, tuple) and len(value) == 2 and all(isinstance(v, (int, float)) for v in value):
+                row[f"{name}_{field_name}_lower"], row[f"{name}_{field_name}_upper"] = value
+    for name, error in result.stat_errors.items():
+        row[f"{name}_error"] = str(error)
+    return row
+
+
+class ResultsStore:
+    """
+    Append-only columnar store of screening results in a directory of part files.
+
+    Safe to append to from several threads. Open the same directory again (in the app, a
+    notebook or another process) to read it; rows appear once their batch is flushed.
+
+    Args:
+        path: Directory holding the parts (created if missing)
+        batch_size: Rows buffered before a part is written
+        format: 'arrow' (Arrow IPC, memory-mapped zero-copy reads) or 'parquet' (zstd-compressed)
+    """
+
+    def __init__(self, path: str, batch_size: int = 50_000, format: StoreFormat = "arrow"):
+        if format not in _EXTENSIONS:
+            raise ValueError("`format` should be one of {'arrow', 'parquet'}")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.path = path
+        self.batch_size = batch_size
+        self.format = format
+        self._rows: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def __enter__(self) -> "ResultsStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
+
+    def append(self, result: ScreeningResult, collection_id: str) -> None:
+        """Buffer one result, writing a part once `batch_size` rows are buffered"""
+        self.append_row(result_row(result, collection_id))
+
+    def extend(self, results: Iterable[ScreeningResult], collection_id: str) -> None:
+        for result in results:
+            self.append(result, collection_id)
+
+    def append_row(self, row: Dict[str, Any]) -> None:
+        """Buffer one already-flattened row (see `result_row`)"""
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) < self.batch_size:
+                return
+            rows, self._rows = self._rows, []
+        self._write_part(rows)
+
+    def flush(self) -> None:
+        """Write any buffered rows as a new part"""
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if rows:
+            self._write_part(rows)
+
+    @property
+    def pending(self) -> int:
+        """Rows buffered but not yet written"""
+        return len(self._rows)
+
+    def parts(self) -> List[str]:
+        """Paths of the written parts, oldest first"""
+        extensions = tuple(_EXTENSIONS.values())
+        return sorted(
+            os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(extensions)
+        )
+
+    def dataset(self):
+        """
+        The written parts as a memory-mapped `pyarrow.dataset.Dataset`.
+
+        Parts written with different tests (and so different stats columns) are read
+        under their unified schema, with missing columns as nulls.
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        from pyarrow import fs
+
+        filesystem = fs.LocalFileSystem(use_mmap=True)
+        by_format = defaultdict(list)
+        for part in self.parts():
+            store_format = "parquet" if part.endswith(_EXTENSIONS["parquet"]) else "arrow"
+            by_format[store_format].append(part)
+
+        if not by_format:
+            return ds.dataset(_rows_to_table([]))
+
+        children = [
+            ds.dataset(paths, format=_DATASET_FORMATS[store_format], filesystem=filesystem)
+            for store_format, paths in by_format.items()
+        ]
+        schema = pa.unify_schemas(
+            [fragment.physical_schema for child in children for fragment in child.get_fragments()]
+        )
+        children = [child.replace_schema(schema) for child in children]
+        return children[0] if len(children) == 1 else ds.dataset(children)
+
+    def read(self, columns: Optional[Sequence[str]] = None, filter=None):
+        """
+        Read the matching rows as a pyarrow Table.
+
+        Args:
+            columns: Columns to read (default: all)
+            filter: A `pyarrow.dataset` expression, e.g.
+                `ds.field("fishers_exact_p_value") < 1e-6`
+
+        Returns:
+            pyarrow.Table; with the Arrow format, unfiltered columns reference the
+            memory-mapped files rather than copies
+        """
+        return self.dataset().to_table(columns=list(columns) if columns is not None else None, filter=filter)
+
+    def head(self, rows: int, columns: Optional[Sequence[str]] = None, filter=None):
+        """Read the first `rows` matching rows as a pyarrow Table, stopping the scan early"""
+        return self.dataset().head(rows, columns=list(columns) if columns is not None else None, filter=filter)
+
+    def to_pandas(self, columns: Optional[Sequence[str]] = None, filter=None):
+        """Read the matching rows as a pandas DataFrame"""
+        return self.read(columns, filter).to_pandas()
+
+    def count_rows(self, filter=None) -> int:
+        """Number of written rows (matching `filter`), read from part metadata where possible"""
+        return self.dataset().count_rows(filter=filter)
+
+    def _write_part(self, rows: List[Dict[str, Any]]) -> None:
+        table = _rows_to_table(rows)
+        name = f"part-{time.time_ns():020d}-{uuid4().hex[:8]}{_EXTENSIONS[self.format]}"
+        final_path = os.path.join(self.path, name)
+        temporary_path = final_path + ".tmp"
+
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(table, temporary_path, compression="zstd")
+        else:
+            import pyarrow as pa
+
+            with pa.OSFile(temporary_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temporary_path, final_path)
+
+
+def _rows_to_table(rows: List[Dict[str, Any]]):
+    """Build a pyarrow Table from row dicts, typing each column from its values"""
+    import pyarrow as pa
+
+    names = list(BASE_COLUMNS)
+    seen = set(names)
+    for row in rows:
+        for name in row:
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+
+    columns = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        columns[name] = pa.array(values, type=_column_type(name, values))
+    return pa.table(columns)
+
+
+def _column_type(name: str, values: List[Any]):
+    import pyarrow as pa
+
+    if name == "index" or name in CELLS:
+        return pa.int64()
+    if name == "payload_hashes":
+        return pa.map_(pa.string(), pa.string())
+    if name in BASE_COLUMNS:
+        return pa.string()
+
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, bool):
+        return pa.bool_()
+    if isinstance(sample, int):
+        return pa.int64()
+    if isinstance(sample, str):
+        return pa.string()
+    # Statistics, including columns that are null throughout this batch
+    return pa.float64()
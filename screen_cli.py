@@ -0,0 +1,234 @@
+"""
+Headless batch screening from the command line.
+
+Reads exposure x outcome pairs from CSV (a file or stdin), screens them against the Task
+API through `screen_pairs` and writes one JSON line per finished pair, in completion
+order, with the cell counts, the payload hash of every upstream query and the flattened
+Fisher's exact and chi-squared results. Pairs are read lazily and records written as
+they complete, so memory stays constant however long the code lists are, and the output
+can be piped straight into other tools:
+
+    python -m screen_cli pairs.csv > screen.jsonl
+    cut -d, -f1,2 big_list.csv | python -m screen_cli --max-workers 64 | jq 'select(.fishers_exact_p_value < 1e-6)'
+    python -m screen_cli --exposures drugs.csv --outcomes conditions.csv --output screen.jsonl
+
+A pairs CSV has a header with `exposure_omop_code` and `outcome_omop_code` columns and
+optionally `exposure_table` and `outcome_table`. With --exposures/--outcomes, each file
+has an `omop_code` column and optionally `table`, and every exposure is screened against
+every outcome (the outcome list is held in memory, exposures are streamed).
+
+A code field may hold a concept set, its codes separated by "|" (e.g. 201826|443238),
+queried as one upstream cohort per cell. With --concept-ancestor, every code is expanded
+to itself and its descendants in that concept_ancestor file.
+
+Non-finite statistics (e.g. an infinite odds ratio) are written as null, so every line is
+standard JSON. Exits with status 1 if any pair failed; failed pairs are still written,
+with their `error`.
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import sys
+import time
+from contextlib import ExitStack
+from dataclasses import replace
+from typing import IO, TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from batch_screen import ScreeningPair, ScreeningResult, cross_pairs, screen_pairs
+from concept_set import CodeSet, parse_code_set
+from polling import PollingPolicy
+
+if TYPE_CHECKING:
+    from concept_hierarchy import ConceptHierarchy
+
+logger = logging.getLogger("screen_cli")
+
+
+def read_pairs(
+    lines: Iterable[str], exposure_table: str = "Condition", outcome_table: str = "Condition"
+) -> Iterator[ScreeningPair]:
+    """Parse a pairs CSV lazily, filling missing tables with the defaults"""
+    for row in csv.DictReader(lines):
+        yield ScreeningPair(
+            exposure_omop_code=parse_code_set(row["exposure_omop_code"]),
+            outcome_omop_code=parse_code_set(row["outcome_omop_code"]),
+            exposure_table=(row.get("exposure_table") or exposure_table).strip(),
+            outcome_table=(row.get("outcome_table") or outcome_table).strip(),
+        )
+
+
+def read_codes(lines: Iterable[str], table: str = "Condition") -> Iterator[Tuple[CodeSet, str]]:
+    """Parse a code list CSV lazily into (omop_code, table) tuples"""
+    for row in csv.DictReader(lines):
+        yield parse_code_set(row["omop_code"]), (row.get("table") or table).strip()
+
+
+def expand_codes(
+    codes: Iterable[Tuple[CodeSet, str]], hierarchy: "ConceptHierarchy", max_levels: Optional[int] = None
+) -> Iterator[Tuple[CodeSet, str]]:
+    """Replace each code by the concept set of the code and its descendants"""
+    for omop_code, table in codes:
+        yield hierarchy.expand(omop_code, max_levels), table
+
+
+def expand_pairs(
+    pairs: Iterable[ScreeningPair], hierarchy: "ConceptHierarchy", max_levels: Optional[int] = None
+) -> Iterator[ScreeningPair]:
+    """Replace both codes of each pair by concept sets of the codes and their descendants"""
+    for pair in pairs:
+        yield replace(
+            pair,
+            exposure_omop_code=hierarchy.expand(pair.exposure_omop_code, max_levels),
+            outcome_omop_code=hierarchy.expand(pair.outcome_omop_code, max_levels),
+        )
+
+
+def result_record(result: ScreeningResult, collection_id: str) -> Dict[str, Any]:
+    """The JSON record of one screened pair (see `results_store.result_row`)"""
+    from results_store import result_row
+
+    record = result_row(result, collection_id)
+    record["payload_hashes"] = dict(record["payload_hashes"])
+    return {
+        key: None if isinstance(value, float) and not math.isfinite(value) else value
+        for key, value in record.items()
+    }
+
+
+def write_records(
+    results: Iterable[ScreeningResult], collection_id: str, output: IO[str]
+) -> Tuple[int, int]:
+    """Write one JSON line per result as it arrives; returns the (written, failed) counts"""
+    written = failed = 0
+    for result in results:
+        output.write(json.dumps(result_record(result, collection_id), separators=(",", ":")) + "\n")
+        # Flush per record so a downstream consumer sees each pair as soon as it is done
+        output.flush()
+        written += 1
+        failed += not result.ok
+    return written, failed
+
+
+def make_client(args: argparse.Namespace):
+    """The Task API client (and collection id) the screen runs against"""
+    if args.mock:
+        from mock_task_api import LatencyModel, MockTaskApi, MockTaskApiClient
+
+        client = MockTaskApiClient(MockTaskApi(latency=LatencyModel(median=args.mock_latency)))
+        collection_id = args.collection_id or "mock"
+    else:
+        from client_factory import get_task_api_client
+        from hutch_bunny.core.settings import get_settings
+
+        settings = get_settings(daemon=True)
+        client = get_task_api_client(settings)
+        collection_id = args.collection_id or settings.COLLECTION_ID
+
+    if args.max_rate is not None:
+        from admission import AdmissionController, AdmittedTaskApiClient
+
+        client = AdmittedTaskApiClient(client, AdmissionController(rate=args.max_rate))
+    return client, collection_id
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("input", nargs="?", default="-", help="Pairs CSV file, or - for stdin (default)")
+    parser.add_argument("--exposures", help="Exposure code list CSV, screened against every --outcomes code")
+    parser.add_argument("--outcomes", help="Outcome code list CSV")
+    parser.add_argument("--output", "-o", default="-", help="JSONL output file, or - for stdout (default)")
+    parser.add_argument("--exposure-table", default="Condition", help="Table for rows without one")
+    parser.add_argument("--outcome-table", default="Condition", help="Table for rows without one")
+    parser.add_argument("--concept-ancestor", help="concept_ancestor file to expand every code to its descendants")
+    parser.add_argument(
+        "--max-levels", type=int, help="With --concept-ancestor, only descendants up to this many levels down"
+    )
+    parser.add_argument("--collection-id", help="Collection to query (default: COLLECTION_ID from the settings)")
+    parser.add_argument("--owner", default="query-ui-cli", help="Owner recorded on each query")
+    parser.add_argument("--max-workers", type=int, default=16, help="Cell queries running at once")
+    parser.add_argument("--planner", action="store_true", help="Derive cells from shared marginal queries")
+    parser.add_argument(
+        "--job-tracker", action="store_true", help="Poll every job from a JobTracker instead of a thread per cell"
+    )
+    parser.add_argument("--journal", help="Job journal file, to resume the screen if it is interrupted")
+    parser.add_argument("--max-rate", type=float, help="Adaptive admission control with this requests/s ceiling")
+    parser.add_argument("--deadline", type=float, default=600.0, help="Seconds before a job is given up on")
+    parser.add_argument("--mock", action="store_true", help="Run against an in-process mock Task API")
+    parser.add_argument("--mock-latency", type=float, default=0.05, help="Median mock job latency in seconds")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args(argv)
+    if (args.exposures is None) != (args.outcomes is None):
+        parser.error("--exposures and --outcomes go together")
+    if args.max_levels is not None and args.concept_ancestor is None:
+        parser.error("--max-levels needs --concept-ancestor")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    with ExitStack() as stack:
+        def open_text(path: str, mode: str) -> IO[str]:
+            if path == "-":
+                return sys.stdout if "w" in mode else sys.stdin
+            return stack.enter_context(open(path, mode, newline="" if "r" in mode else None))
+
+        hierarchy = None
+        if args.concept_ancestor:
+            from concept_hierarchy import load_concept_hierarchy
+
+            hierarchy = load_concept_hierarchy(args.concept_ancestor)
+
+        if args.exposures is not None:
+            exposures = read_codes(open_text(args.exposures, "r"), args.exposure_table)
+            outcomes = read_codes(open_text(args.outcomes, "r"), args.outcome_table)
+            if hierarchy is not None:
+                # Each code is expanded once, not once per pair
+                exposures = expand_codes(exposures, hierarchy, args.max_levels)
+                outcomes = expand_codes(outcomes, hierarchy, args.max_levels)
+            pairs = cross_pairs(exposures, outcomes)
+        else:
+            pairs = read_pairs(open_text(args.input, "r"), args.exposure_table, args.outcome_table)
+            if hierarchy is not None:
+                pairs = expand_pairs(pairs, hierarchy, args.max_levels)
+
+        client, collection_id = make_client(args)
+        policy = PollingPolicy(deadline=args.deadline)
+        journal = None
+        options: Dict[str, Any] = {}
+        if args.journal:
+            from job_journal import JobJournal
+
+            journal = stack.enter_context(JobJournal(args.journal))
+            options["query_options"] = {"journal": journal}
+        if args.planner:
+            from query_planner import MarginalQueryPlanner
+
+            options["planner"] = MarginalQueryPlanner(polling_policy=policy, journal=journal)
+        if args.job_tracker:
+            from job_tracker import JobTracker
+
+            options["job_tracker"] = stack.enter_context(JobTracker())
+
+        start = time.perf_counter()
+        results = screen_pairs(
+            client, collection_id, args.owner, pairs,
+            max_workers=args.max_workers, polling_policy=policy, **options,
+        )
+        try:
+            written, failed = write_records(results, collection_id, open_text(args.output, "w"))
+        finally:
+            results.close()
+
+    logger.info("Screened %d pairs in %.1fs, %d failed", written, time.perf_counter() - start, failed)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Coalescing of identical in-flight upstream queries.
+
+When several sessions ask for the same count at the same time (say every analyst's
+default Person/8507 exposure), each would submit an identical upstream job and poll it.
+A SingleFlight runs one execution per key at a time: the first caller starts it and
+every caller arriving with the same key while it is still running waits on the same
+Flight and gets the same result, or the same exception. Once the execution finishes the
+key is forgotten; finished counts are reused through ResultCache instead.
+
+With `do`, the first caller runs the execution on its own thread and later callers wait
+for it. Any caller can stop waiting through its CancellationToken without stopping the
+others: the execution's own token is cancelled only once every caller has given up, so
+a first caller cancelled while others still wait carries on for them. `start` runs the
+execution on a new thread for callers that do not wait (the app's non-blocking runs),
+and an execution that is itself asynchronous (one returning a Future, as with a
+JobTracker) is joined with `start_future` and needs no thread of its own.
+
+Sharing only pays off when independent callers ask for the same query at once, as the
+app's sessions do, so builders and the planner leave it off unless given a SingleFlight.
+"""
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from polling import CancellationToken, JobPollCancelled, JobPollTimeout
+
+T = TypeVar("T")
+
+@dataclass
+class SingleFlightStats:
+    """Counters of a SingleFlight."""
+
+    started: int = 0
+    coalesced: int = 0
+    abandoned: int = 0
+
+
+class Flight(Generic[T]):
+    """
+    One execution shared by every caller with the same key.
+
+    `token` is cancelled once every caller has left. `progress` is free-form state the
+    execution can update for callers to display (e.g. job_uuid, status, polls).
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.token = CancellationToken()
+        self.progress: Dict[str, Any] = {}
+        self._done = threading.Event()
+        self._result: Optional[T] = None
+        self._error: Optional[BaseException] = None
+        self._waiters = 0
+        self._abandoned = False
+        self._callbacks: List[Callable[["Flight[T]"], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def failed(self) -> bool:
+        return self.done and self._error is not None
+
+    def result(self) -> T:
+        """The shared result of a finished flight; raises its exception if it failed"""
+        if not self.done:
+            raise RuntimeError(f"Flight {self.key} has not finished")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def add_done_callback(self, callback: Callable[["Flight[T]"], None]) -> None:
+        """Call `callback(flight)` once the flight finishes (straight away if it has)"""
+        with self._lock:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, cancel_token: Optional[CancellationToken] = None, timeout: Optional[float] = None) -> T:
+        """
+        Block until the flight finishes and return its result.
+
+        Raises:
+            JobPollCancelled: if `cancel_token` is cancelled first
+            JobPollTimeout: if the flight has not finished after `timeout` seconds
+        """
+        if cancel_token is None:
+            self._done.wait(timeout)
+        else:
+            # Woken by whichever comes first, the flight finishing or the caller's token
+            wake = threading.Event()
+            handle = cancel_token.add_callback(wake.set)
+            self.add_done_callback(lambda _: wake.set())
+            try:
+                wake.wait(timeout)
+            finally:
+                cancel_token.remove_callback(handle)
+            if cancel_token.cancelled and not self.done:
+                raise JobPollCancelled(f"Stopped waiting for shared query {self.key[:12]}")
+        if not self.done:
+            raise JobPollTimeout(f"Shared query {self.key[:12]} not done after {timeout:.1f}s")
+        return self.result()
+
+
+class SingleFlight:
+    """
+    Runs at most one execution per key at a time and shares its outcome.
+
+    Thread-safe; one instance is meant to be shared by the whole process (see
+    `default_single_flight`).
+    """
+
+    def __init__(self):
+        self.stats = SingleFlightStats()
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of executions currently in flight"""
+        with self._lock:
+            return len(self._flights)
+
+    def start(self, key: str, fn: Callable[[Flight[T]], T]) -> Tuple[Flight[T], bool]:
+        """
+        Join the flight for `key`, starting `fn(flight)` on a new thread if there is none.
+
+        Every call must be matched by `leave` once the caller no longer needs the result.
+
+        Returns:
+            Tuple of (flight, shared), where `shared` is True if an execution was already running
+        """
+        flight, shared = self._join(key)
+        if not shared:
+            threading.Thread(
+                target=self._run, args=(flight, fn), name=f"single-flight-{key[:8]}", daemon=True
+            ).start()
+        return flight, shared
+
+    def start_future(self, key: str, fn: Callable[[Flight[T]], "Future[T]"]) -> Tuple[Flight[T], bool]:
+        """
+        Join the flight for `key`, starting the asynchronous `fn(flight)` if there is none.
+
+        Like `start`, but `fn` returns a Future instead of blocking, so no thread is
+        started; the flight finishes when the Future does. Use `Flight.add_done_callback`
+        to be notified, and `leave` once the result is no longer needed.
+        """
+        flight, shared = self._join(key)
+        if shared:
+            return flight, True
+        try:
+            future = fn(flight)
+        except BaseException as e:
+            self._finish(flight, error=e)
+        else:
+            future.add_done_callback(partial(self._finish_from_future, flight))
+        return flight, False
+
+    def leave(self, flight: Flight) -> None:
+        """Stop waiting on `flight`; the last caller to leave an unfinished flight cancels it"""
+        with self._lock:
+            flight._waiters -= 1
+            if flight._waiters == 0 and not flight.done:
+                flight._abandoned = True
+                self.stats.abandoned += 1
+        # Cancelled outside the lock: the token's callbacks may finish the flight
+        if flight._abandoned:
+            flight.token.cancel()
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[Flight[T]], T],
+        cancel_token: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[T, bool]:
+        """
+        Run `fn(flight)` for `key` on this thread, or wait for the execution already running for it.
+
+        Args:
+            key: Identifies equivalent executions, e.g. a canonical_payload_hash
+            fn: The execution; it should honour `flight.token`
+            cancel_token: Stops this caller waiting (and the execution, if it is the last caller)
+            timeout: Seconds a caller joining a running execution waits for it
+
+        Returns:
+            Tuple of (result, shared)
+
+        Raises:
+            JobPollCancelled: if `cancel_token` is cancelled before the result is ready
+            JobPollTimeout: if a joining caller's `timeout` passes first
+            Exception: whatever the shared execution raised
+        """
+        flight, shared = self._join(key)
+        if shared:
+            try:
+                return flight.wait(cancel_token, timeout), True
+            finally:
+                self.leave(flight)
+
+        # Leave once, either when this caller is cancelled or once the execution returns;
+        # while others still wait, a cancelled first caller keeps running it for them
+        left = threading.Lock()
+
+        def leave() -> None:
+            if left.acquire(blocking=False):
+                self.leave(flight)
+
+        handle = cancel_token.add_callback(leave) if cancel_token is not None else None
+        try:
+            self._run(flight, fn)
+        finally:
+            if handle is not None:
+                cancel_token.remove_callback(handle)
+            leave()
+        return flight.result(), False
+
+    def _join(self, key: str) -> Tuple[Flight, bool]:
+        """Join the running flight for `key`, or register a new one the caller must start"""
+        with self._lock:
+            flight = self._flights.get(key)
+            # A flight every caller has abandoned is winding down; start afresh
+            if flight is not None and not flight._abandoned:
+                flight._waiters += 1
+                self.stats.coalesced += 1
+                return flight, True
+
+            flight = self._flights[key] = Flight(key)
+            flight._waiters = 1
+            self.stats.started += 1
+            return flight, False
+
+    def _run(self, flight: Flight[T], fn: Callable[[Flight[T]], T]) -> None:
+        try:
+            result = fn(flight)
+        except BaseException as e:
+            self._finish(flight, error=e)
+        else:
+            self._finish(flight, result)
+
+    def _finish_from_future(self, flight: Flight[T], future: "Future[T]") -> None:
+        if future.cancelled():
+            self._finish(flight, error=JobPollCancelled(f"Shared query {flight.key[:12]} was cancelled"))
+        elif future.exception() is not None:
+            self._finish(flight, error=future.exception())
+        else:
+            self._finish(flight, future.result())
+
+    def _finish(self, flight: Flight[T], result: Optional[T] = None, error: Optional[BaseException] = None) -> None:
+        flight._result, flight._error = result, error
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        with flight._lock:
+            flight._done.set()
+            callbacks, flight._callbacks = flight._callbacks, []
+        for callback in callbacks:
+            callback(flight)
+
+
+_default_single_flight = SingleFlight()
+
+
+def default_single_flight() -> SingleFlight:
+    """The process-wide SingleFlight, for callers that share queries across sessions (the app)"""
+    return _default_single_flight